@@ -0,0 +1,480 @@
+import asyncio
+import hmac
+import json
+import os
+import threading
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from sanic import Blueprint, json as json_response
+
+from .config import config_manager
+from .refresh import refresh_coordinator
+from .serialization import load_yaml
+from .storage import atomic_write
+
+# 管理接口的访问令牌; 未设置时服务端不注册管理接口, 经由 main.py 启动时会自动生成
+# 不按来源地址放行: 同机的反向代理转发的公网请求同样来自 127.0.0.1
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+# 保留的刷新任务数量, 以及超过多久仍未结束的任务视为已中断（worker 进程不存在时立即视为中断, 进程号被复用时以此兜底）
+JOB_LIMIT = 20
+JOB_TIMEOUT = 600
+# 缓存配置预览的默认和最大分页大小
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+# 由刷新流程维护, 不允许通过接口修改的配置项
+READONLY_KEYS = frozenset(("last_update", "auth_tokens"))
+
+STAGES = {
+    "queued": (0.0, "等待开始"),
+    "fetch": (0.1, "正在获取订阅"),
+    "transform": (0.6, "正在生成配置"),
+    "write": (0.9, "正在写入缓存"),
+    "done": (1.0, "已完成"),
+}
+
+admin = Blueprint("admin", url_prefix="/admin")
+
+
+def ok(data=None):
+    return json_response({"code": 200, "message": "success", "data": data})
+
+
+def error(status: int, message: str):
+    return json_response({"code": status, "message": message, "data": None}, status=status)
+
+
+def versions() -> dict:
+    """Content versions of everything the UI caches, used as st.cache_data keys"""
+    rendered = config_manager.load_rendered_proxy()
+    config_manager.config_view()
+    config_manager.ordering_file.view()
+    config_manager.prober.cache.view()
+    return {
+        "config": config_manager.config_file.version,
+        "rules": config_manager.rules_version,
+        "ordering": config_manager.ordering_file.version,
+        "cache": rendered.etag.strip('"') if rendered else "",
+        "probe": config_manager.prober.cache.version,
+    }
+
+
+def _alive(pid: Optional[int]) -> bool:
+    """Whether the worker that runs a job still exists; jobs written before pids were recorded count as alive"""
+    if not pid:
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class RefreshJobs:
+    """Refresh jobs started through the admin API, one JSON file each in data_dir/jobs
+
+    The job runs in the worker that accepted the POST, but its progress is
+    written to disk so that whichever worker answers a poll can report it.
+    A running job whose worker process is gone is reported as interrupted
+    right away instead of blocking new refreshes until JOB_TIMEOUT.
+    """
+
+    def __init__(self, data_dir: Path, limit: int = JOB_LIMIT):
+        self.dir = data_dir / "jobs"
+        self.limit = limit
+        self._lock = threading.Lock()
+
+    def _path(self, job_id: str) -> Path:
+        return self.dir / f"{job_id}.json"
+
+    def get(self, job_id: str) -> Optional[dict]:
+        if not job_id.isalnum():
+            return None
+        try:
+            with open(self._path(job_id), "rb") as f:
+                job = json.loads(f.read())
+        except (FileNotFoundError, ValueError):
+            return None
+        if job["state"] == "running" and (not _alive(job.get("pid"))
+                                          or job["updated_at"] + JOB_TIMEOUT < datetime.now().timestamp()):
+            job.update(state="failed", message="任务已中断")
+        return job
+
+    def save(self, job: dict):
+        job["updated_at"] = datetime.now().timestamp()
+        atomic_write(self._path(job["id"]), json.dumps(job, ensure_ascii=False).encode("utf-8"))
+
+    def running(self) -> Optional[dict]:
+        for job in self.list():
+            if job["state"] == "running":
+                return job
+        return None
+
+    def list(self) -> List[dict]:
+        """Newest first"""
+        paths = sorted(self.dir.glob("*.json"), key=lambda path: path.stat().st_mtime, reverse=True) \
+            if self.dir.exists() else []
+        jobs = [self.get(path.stem) for path in paths]
+        return [job for job in jobs if job is not None]
+
+    def create(self) -> dict:
+        self.dir.mkdir(exist_ok=True)
+        with self._lock:
+            now = datetime.now().timestamp()
+            job = {"id": uuid.uuid4().hex[:12], "state": "running", "stage": "queued", "started_at": now,
+                   "progress": 0.0, "message": STAGES["queued"][1], "changes": None, "pid": os.getpid()}
+            self.save(job)
+            for path in sorted(self.dir.glob("*.json"), key=lambda path: path.stat().st_mtime)[:-self.limit]:
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+        return job
+
+    async def run(self, job: dict):
+        def progress(stage: str, entry: Optional[dict] = None):
+            job["stage"] = stage
+            job["progress"], job["message"] = STAGES[stage]
+            if stage == "done":
+                job["changes"] = entry
+            self.save(job)
+
+        try:
+            await refresh_coordinator.refresh(force=True, progress=progress)
+        except Exception as e:
+            job.update(state="failed", message=str(e))
+        else:
+            job.update(state="done", progress=1.0)
+            if job["stage"] != "done":
+                # 刷新由其它请求或进程完成, 没有收到本任务的进度
+                job["message"] = "已由其它刷新完成"
+        self.save(job)
+
+
+def preview_config(body: bytes) -> Tuple[dict, List[dict]]:
+    """Summary and proxy rows of a rendered config; runs in the CPU pool"""
+    config = load_yaml(body) or {}
+    proxies = config.get("proxies") or []
+    summary = {
+        "proxies": len(proxies),
+        "proxy_groups": [
+            {"name": group.get("name"), "type": group.get("type"), "size": len(group.get("proxies") or [])}
+            for group in config.get("proxy-groups") or []
+        ],
+        "rules": len(config.get("rules") or []),
+        "rule_providers": len(config.get("rule-providers") or {}),
+    }
+    rows = [
+        {"name": proxy.get("name"), "type": proxy.get("type"), "server": proxy.get("server"), "port": proxy.get("port")}
+        for proxy in proxies
+    ]
+    return summary, rows
+
+
+class ConfigPreview:
+    """Summary and paginated proxy list of the cached config, parsed once per ETag
+
+    The parse runs in the CPU pool, shared by concurrent requests for the
+    same ETag, so a large config does not stall the event loop.
+    """
+
+    def __init__(self):
+        self._etag = None
+        self._summary = None
+        self._proxies: List[dict] = []
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    async def _load(self, rendered) -> Tuple[dict, List[dict]]:
+        from .offload import cpu_pool
+
+        etag = rendered.etag
+        if self._etag == etag:
+            return self._summary, self._proxies
+        future = self._inflight.get(etag)
+        if future is None:
+            future = self._inflight[etag] = asyncio.ensure_future(
+                cpu_pool.run("preview", preview_config, bytes(rendered.body)))
+            future.add_done_callback(lambda _: self._inflight.pop(etag, None))
+        # shield: 单个请求被取消时不影响其它等待者
+        summary, proxies = await asyncio.shield(future)
+        summary = dict(summary, etag=etag.strip('"'), bytes=len(rendered.body), mtime=rendered.mtime)
+        self._etag, self._summary, self._proxies = etag, summary, proxies
+        return summary, proxies
+
+    async def page(self, rendered, page: int, size: int, query: str = "") -> dict:
+        summary, proxies = await self._load(rendered)
+        if query:
+            query = query.lower()
+            proxies = [proxy for proxy in proxies if query in str(proxy["name"]).lower()
+                       or query in str(proxy["server"]).lower()]
+        start = (page - 1) * size
+        return dict(summary, page=page, size=size, matched=len(proxies), items=proxies[start:start + size])
+
+
+refresh_jobs = RefreshJobs(config_manager.data_dir)
+config_preview = ConfigPreview()
+
+
+def _int_arg(request, name: str, default: int, maximum: int) -> int:
+    try:
+        return min(max(1, int(request.args.get(name, default))), maximum)
+    except ValueError:
+        return default
+
+
+@admin.on_request
+async def check_admin_token(request):
+    if not ADMIN_TOKEN:
+        return error(403, "未设置 ADMIN_TOKEN, 管理接口不可用")
+    header = request.headers.get("authorization", "")
+    token = header[7:] if header.lower().startswith("bearer ") else request.headers.get("x-admin-token", "")
+    if not hmac.compare_digest(token.encode("utf-8"), ADMIN_TOKEN.encode("utf-8")):
+        return error(403, "无效的管理令牌")
+    return None
+
+
+@admin.get("/status")
+async def get_status(_):
+    from .sources import SourceCache
+
+    config = config_manager.config_view()
+    cache = SourceCache(config_manager.data_dir)
+    sources = []
+    for source in config_manager.subscription_sources():
+        cached = cache.load(source)
+        sources.append({
+            "name": source["name"],
+            "enabled": source["enabled"],
+            "fetched_at": cached.fetched_at if cached else 0,
+        })
+    return ok({
+        "versions": versions(),
+        "last_update": config.get("last_update", 0),
+        "need_update": config_manager.need_update(),
+        "sources": sources,
+        "job": refresh_jobs.running(),
+    })
+
+
+@admin.get("/config")
+async def get_config(_):
+    return ok({"version": versions()["config"], "config": config_manager.config_view()})
+
+
+@admin.patch("/config")
+async def patch_config(request):
+    """Merge the given top-level keys into config.json, leaving the others as they are on disk"""
+    changes = request.json
+    if not isinstance(changes, dict):
+        return error(400, "请求体必须是 JSON 对象")
+    readonly = READONLY_KEYS.intersection(changes)
+    if readonly:
+        return error(400, f"不允许修改: {', '.join(sorted(readonly))}")
+    config = config_manager.load_config()
+    config.update(changes)
+    config_manager.save_config(config)
+    return ok({"version": versions()["config"]})
+
+
+@admin.get("/rules")
+async def get_rules(_):
+    return ok({"version": config_manager.rules_version, **config_manager.rules_view()})
+
+
+@admin.patch("/rules")
+async def patch_rules(request):
+    """Update rules and/or rule_providers, refusing rules the engine reports as invalid"""
+    from .rules_engine import build_engine
+
+    changes = request.json
+    if not isinstance(changes, dict) or not set(changes) <= {"rules", "rule_providers"}:
+        return error(400, "只能修改 rules 和 rule_providers")
+    rules_config = config_manager.load_rules_config()
+    rules_config.update(changes)
+    # 按修改后的规则和提供者检查: 同时新增提供者和引用它的规则可以保存, 删除仍被 RULE-SET 引用的提供者会被拒绝
+    engine = build_engine(config_manager, rules_config["rules"], rules_config["rule_providers"])
+    if engine.errors:
+        return error(400, f"存在 {len(engine.errors)} 条无效规则, 请修正后再保存")
+    config_manager.save_rules_config(rules_config)
+    return ok({"version": config_manager.rules_version})
+
+
+@admin.post("/rules/check")
+async def check_rules(request):
+    """Issues of unsaved rules, and which of them matches host / ip when given"""
+    from .rules_engine import build_engine
+
+    body = request.json or {}
+    engine = build_engine(config_manager, body.get("rules"))
+    data = {"issues": [issue.to_dict() for issue in engine.issues], "errors": len(engine.errors), "match": None}
+    if body.get("host") or body.get("ip"):
+        try:
+            rule = engine.match(host=body.get("host"), ip=body.get("ip"))
+        except ValueError as e:
+            return error(400, str(e))
+        if rule is not None:
+            data["match"] = {"index": rule.index, "rule": rule.raw, "target": rule.target, "rule_set": rule.source}
+    return ok(data)
+
+
+@admin.get("/ordering")
+async def get_ordering(_):
+    return ok({"version": versions()["ordering"], "ordering": config_manager.ordering_file.view()})
+
+
+@admin.put("/ordering")
+async def put_ordering(request):
+    from .ordering import validate_ordering
+
+    ordering = request.json
+    try:
+        validate_ordering(ordering)
+    except (ValueError, AttributeError) as e:
+        return error(400, str(e))
+    config_manager.save_ordering_config(ordering)
+    return ok({"version": versions()["ordering"]})
+
+
+@admin.get("/tokens")
+async def get_tokens(_):
+    config = config_manager.config_view()
+    return ok({
+        "tokens": config.get("auth_tokens") or [],
+        "token_profiles": config.get("token_profiles") or {},
+        "profiles": list(config.get("profiles") or {}),
+    })
+
+
+@admin.get("/tokens/stats")
+async def get_token_stats(_):
+    """Poll counters of every token merged over all workers, with the rate limit settings"""
+    from .ratelimit import rate_limit_settings
+
+    config = config_manager.config_view()
+    stats = config_manager.token_stats.collect()
+    return ok({
+        "rate_limit": rate_limit_settings(config),
+        "stats": {token: stats[token] for token in config.get("auth_tokens") or [] if token in stats},
+    })
+
+
+@admin.post("/tokens")
+async def add_token(request):
+    token = ((request.json or {}).get("token") or "").strip()
+    if not token:
+        return error(400, "令牌不能为空")
+    config = config_manager.load_config()
+    tokens = config.setdefault("auth_tokens", [])
+    if token in tokens:
+        return error(409, "令牌已存在")
+    tokens.append(token)
+    config_manager.save_config(config)
+    return ok({"version": versions()["config"]})
+
+
+@admin.put("/tokens/<token>")
+async def set_token_profile(request, token: str):
+    """Assign a profile to a token, null for the default output"""
+    profile = (request.json or {}).get("profile")
+    config = config_manager.load_config()
+    if token not in (config.get("auth_tokens") or []):
+        return error(404, "令牌不存在")
+    if profile is not None and profile not in (config.get("profiles") or {}):
+        return error(400, "配置方案不存在")
+    token_profiles = config.setdefault("token_profiles", {})
+    if profile is None:
+        token_profiles.pop(token, None)
+    else:
+        token_profiles[token] = profile
+    config_manager.save_config(config)
+    return ok({"version": versions()["config"]})
+
+
+@admin.delete("/tokens/<token>")
+async def delete_token(_, token: str):
+    config = config_manager.load_config()
+    if token not in (config.get("auth_tokens") or []):
+        return error(404, "令牌不存在")
+    config["auth_tokens"].remove(token)
+    (config.get("token_profiles") or {}).pop(token, None)
+    config_manager.save_config(config)
+    return ok({"version": versions()["config"]})
+
+
+@admin.post("/refresh")
+async def start_refresh(request):
+    """Start a forced refresh in the background and return its job for polling"""
+    if not config_manager.subscription_sources():
+        return error(400, "未配置订阅地址")
+    job = refresh_jobs.running()
+    if job is None:
+        job = refresh_jobs.create()
+        request.app.add_task(refresh_jobs.run(job))
+    return ok(job)
+
+
+@admin.get("/refresh/<job_id>")
+async def get_refresh(_, job_id: str):
+    job = refresh_jobs.get(job_id)
+    if job is None:
+        return error(404, "任务不存在")
+    return ok(job)
+
+
+@admin.get("/history")
+async def get_history(_):
+    return ok(config_manager.refresh_history.entries())
+
+
+@admin.get("/cache")
+async def get_cache(request):
+    """Summary of cached_config.yaml with one page of its proxies, ?page=&size=&q="""
+    rendered = config_manager.load_rendered_proxy()
+    if not rendered:
+        return ok(None)
+    page = _int_arg(request, "page", 1, 1 << 31)
+    size = _int_arg(request, "size", PAGE_SIZE, MAX_PAGE_SIZE)
+    return ok(await config_preview.page(rendered, page, size, request.args.get("q", "").strip()))
+
+
+@admin.get("/snapshots")
+async def get_snapshots(_):
+    from .snapshots import snapshot_settings
+
+    return ok({
+        "settings": snapshot_settings(config_manager.config_view()),
+        "snapshots": config_manager.snapshots.entries(),
+    })
+
+
+@admin.post("/snapshots/<digest>/promote")
+async def promote_snapshot(_, digest: str):
+    """Serve a retained snapshot again without rebuilding it"""
+    try:
+        rendered = config_manager.snapshots.promote(digest)
+    except Exception as e:
+        return error(400, str(e))
+    return ok({"etag": rendered.etag.strip('"')})
+
+
+@admin.get("/rulesets")
+async def get_rulesets(_):
+    return ok(config_manager.ruleset_mirror.status())
+
+
+@admin.get("/probe")
+async def get_probe(_):
+    prober = config_manager.prober
+    return ok({"version": versions()["probe"], "stats": prober.stats(), "results": prober.results()})
+
+
+@admin.post("/probe")
+async def run_probe(_):
+    from .prober import cached_proxies
+
+    await config_manager.prober.probe(cached_proxies(config_manager), force=True)
+    return ok(config_manager.prober.stats())
@@ -0,0 +1,50 @@
+import os
+
+import requests
+
+# Streamlit 通过管理接口读写配置, 默认访问同一容器内的服务
+ADMIN_URL = os.getenv("ADMIN_URL", f"http://127.0.0.1:{os.getenv('PORT', '8000')}")
+ADMIN_TIMEOUT = 30
+
+
+class AdminClient:
+    """Thin client of the /admin API, returning the data field of each response"""
+
+    def __init__(self, base_url: str = ADMIN_URL, token: str = None, timeout: float = ADMIN_TIMEOUT):
+        self.base_url = base_url.rstrip("/") + "/admin"
+        self.session = requests.Session()
+        token = os.getenv("ADMIN_TOKEN", "") if token is None else token
+        if token:
+            self.session.headers["Authorization"] = f"Bearer {token}"
+        self.timeout = timeout
+
+    def request(self, method: str, path: str, **kwargs):
+        try:
+            response = self.session.request(method, self.base_url + path, **dict({"timeout": self.timeout}, **kwargs))
+        except requests.RequestException as e:
+            raise Exception(f"无法连接管理接口 {self.base_url}: {e}")
+        try:
+            body = response.json()
+        except ValueError:
+            raise Exception(f"管理接口返回了无效的响应 ({response.status_code})")
+        if response.status_code != 200:
+            raise Exception(body.get("message") or f"管理接口错误 ({response.status_code})")
+        return body["data"]
+
+    def get(self, path: str, **params):
+        return self.request("GET", path, params=params or None)
+
+    def post(self, path: str, data=None, **kwargs):
+        return self.request("POST", path, json=data, **kwargs)
+
+    def put(self, path: str, data=None):
+        return self.request("PUT", path, json=data)
+
+    def patch(self, path: str, data=None):
+        return self.request("PATCH", path, json=data)
+
+    def delete(self, path: str):
+        return self.request("DELETE", path)
+
+
+admin_client = AdminClient()
@@ -0,0 +1,104 @@
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict
+
+from .metrics import process_snapshots
+from .storage import atomic_write
+
+# 每个令牌保留最近一小时的每分钟请求数
+WINDOW_MINUTES = 60
+# 请求频率按最近几分钟计算
+RATE_MINUTES = 5
+USER_AGENT_LENGTH = 200
+
+
+def _new_stats() -> dict:
+    return {
+        "requests": 0,
+        "bytes": 0,
+        "not_modified": 0,
+        "limited": 0,
+        "last_seen": 0,
+        "user_agent": "",
+        # 环形缓冲: minutes[i] 是槽位 i 当前对应的分钟, counts[i] 是该分钟的请求数
+        "minutes": [0] * WINDOW_MINUTES,
+        "counts": [0] * WINDOW_MINUTES,
+    }
+
+
+class TokenStats:
+    """Per-token poll counters of this worker, flushed in batches to data_dir/token_stats/<pid>.json
+
+    record() only touches an in-memory dict; the server's flush loop writes
+    the snapshot every few seconds and collect() merges the snapshots of
+    all workers for the UI.
+    """
+
+    def __init__(self, data_dir: Path):
+        self.dir = data_dir / "token_stats"
+        self._lock = threading.Lock()
+        self._tokens: Dict[str, dict] = {}
+        self._dirty = False
+
+    def record(self, token: str, user_agent: str, status: int, size: int):
+        now = time.time()
+        minute = int(now // 60)
+        slot = minute % WINDOW_MINUTES
+        with self._lock:
+            stats = self._tokens.get(token)
+            if stats is None:
+                stats = self._tokens[token] = _new_stats()
+            if stats["minutes"][slot] != minute:
+                stats["minutes"][slot] = minute
+                stats["counts"][slot] = 0
+            stats["counts"][slot] += 1
+            stats["requests"] += 1
+            stats["bytes"] += size
+            if status == 304:
+                stats["not_modified"] += 1
+            elif status == 429:
+                stats["limited"] += 1
+            stats["last_seen"] = now
+            stats["user_agent"] = (user_agent or "")[:USER_AGENT_LENGTH]
+            self._dirty = True
+
+    def flush(self):
+        if not self._dirty:
+            return
+        with self._lock:
+            body = json.dumps(self._tokens, ensure_ascii=False).encode("utf-8")
+            self._dirty = False
+        self.dir.mkdir(exist_ok=True)
+        atomic_write(self.dir / f"{os.getpid()}.json", body)
+
+    def collect(self) -> Dict[str, dict]:
+        """{token: summary} merged over all workers"""
+        with self._lock:
+            snapshots = [json.loads(json.dumps(self._tokens))]
+        snapshots += process_snapshots(self.dir)
+
+        now_minute = int(time.time() // 60)
+        merged: Dict[str, dict] = {}
+        for snapshot in snapshots:
+            for token, stats in snapshot.items():
+                summary = merged.setdefault(token, {
+                    "requests": 0, "bytes": 0, "not_modified": 0, "limited": 0,
+                    "last_seen": 0, "user_agent": "", "last_hour": 0, "recent": 0,
+                })
+                for key in ("requests", "bytes", "not_modified", "limited"):
+                    summary[key] += stats[key]
+                if stats["last_seen"] > summary["last_seen"]:
+                    summary["last_seen"] = stats["last_seen"]
+                    summary["user_agent"] = stats["user_agent"]
+                for minute, count in zip(stats["minutes"], stats["counts"]):
+                    age = now_minute - minute
+                    if 0 <= age < WINDOW_MINUTES:
+                        summary["last_hour"] += count
+                    if 0 <= age < RATE_MINUTES:
+                        summary["recent"] += count
+        for summary in merged.values():
+            summary["per_minute"] = round(summary.pop("recent") / RATE_MINUTES, 2)
+        return merged
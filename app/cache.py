@@ -0,0 +1,201 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Optional
+
+from .compression import ENCODING_EXTENSIONS, compress, available_encodings
+from .storage import atomic_write
+
+
+@dataclass(frozen=True)
+class RenderedConfig:
+    """Serialized subscription ready to be written to the client
+
+    body and variants are bytes, or memoryview slices of the shared segment
+    for the main cached config.
+    """
+    body: bytes
+    etag: str
+    mtime: float
+    variants: Dict[str, bytes] = field(default_factory=dict)
+
+    def representation(self, encoding: Optional[str]):
+        """Return (body, etag) for the given Content-Encoding"""
+        if encoding is None or encoding not in self.variants:
+            return self.body, self.etag
+        # 不同编码的表示需要不同的强 ETag
+        return self.variants[encoding], '%s-%s"' % (self.etag[:-1], encoding)
+
+
+def make_digest(body: bytes) -> str:
+    return hashlib.sha256(body).hexdigest()[:32]
+
+
+def make_etag(body: bytes) -> str:
+    """Strong ETag derived from the response body"""
+    return '"%s"' % make_digest(body)
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """检查 If-None-Match 请求头是否命中当前 ETag"""
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        # If-None-Match 使用弱比较, 忽略 W/ 前缀
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+class RenderedCache:
+    """In-memory byte buffer of the cached config, invalidated by file stat
+
+    Compressed variants are written next to the cache file with the body
+    digest in their name, so a variant can never be paired with the wrong body.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._key = None
+        self._entry: Optional[RenderedConfig] = None
+
+    @staticmethod
+    def _stat_key(st: os.stat_result) -> tuple:
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def _variant_path(self, digest: str, encoding: str) -> Path:
+        return self.path.with_name(f"{self.path.name}.{digest}.{ENCODING_EXTENSIONS[encoding]}")
+
+    def write_variants(self, body: bytes, variants: Optional[Dict[str, bytes]] = None) -> Dict[str, bytes]:
+        """Persist the compressed variants of body, compressing them here when they are not given"""
+        digest = make_digest(body)
+        if variants is None:
+            variants = {encoding: compress(body, encoding) for encoding in available_encodings()}
+        for encoding, data in variants.items():
+            atomic_write(self._variant_path(digest, encoding), data)
+        return variants
+
+    def load_variants(self, body: bytes) -> Dict[str, bytes]:
+        """Compressed variants of body found on disk
+
+        Missing ones are skipped, never compressed here: this runs on the
+        request path. Clients get another encoding or the plain body until
+        the next refresh fills them in.
+        """
+        digest = make_digest(body)
+        variants = {}
+        for encoding in available_encodings():
+            try:
+                with open(self._variant_path(digest, encoding), "rb") as f:
+                    variants[encoding] = f.read()
+            except FileNotFoundError:
+                continue
+        return variants
+
+    def missing_encodings(self, rendered: RenderedConfig) -> list:
+        """Encodings that could be served but have no variant yet"""
+        return [encoding for encoding in available_encodings() if encoding not in rendered.variants]
+
+    def cleanup_variants(self, *keep_digests: str):
+        """Remove compressed files belonging to bodies other than keep_digests"""
+        prefix = self.path.name + "."
+        for candidate in self.path.parent.glob(self.path.name + ".*"):
+            digest = candidate.name[len(prefix):].split(".", 1)[0]
+            if len(digest) == 32 and digest not in keep_digests:
+                try:
+                    candidate.unlink()
+                except FileNotFoundError:
+                    pass
+
+    def get(self) -> Optional[RenderedConfig]:
+        """Return the rendered config, re-reading the file only when it changed"""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            with self._lock:
+                self._key = None
+                self._entry = None
+            return None
+
+        key = self._stat_key(st)
+        entry = self._entry
+        if entry is not None and key == self._key:
+            return entry
+
+        with self._lock:
+            if self._entry is not None and key == self._key:
+                return self._entry
+            with open(self.path, "rb") as f:
+                st = os.fstat(f.fileno())
+                body = f.read()
+            self._entry = RenderedConfig(
+                body=body,
+                etag=make_etag(body),
+                mtime=st.st_mtime,
+                variants=self.load_variants(body)
+            )
+            self._key = self._stat_key(st)
+            return self._entry
+
+    def prime(self, body: bytes, variants: Dict[str, bytes]) -> RenderedConfig:
+        """Populate the buffer right after the file was written"""
+        st = os.stat(self.path)
+        with self._lock:
+            self._entry = RenderedConfig(
+                body=body,
+                etag=make_etag(body),
+                mtime=st.st_mtime,
+                variants=variants
+            )
+            self._key = self._stat_key(st)
+            return self._entry
+
+
+class LRUCache:
+    """Size-bounded LRU of RenderedConfig entries, counting body and variant bytes"""
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, max_entries: int = 256):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[tuple, RenderedConfig]" = OrderedDict()
+        self._size = 0
+
+    @staticmethod
+    def _weight(entry: RenderedConfig) -> int:
+        return len(entry.body) + sum(len(data) for data in entry.variants.values())
+
+    def get(self, key: tuple) -> Optional[RenderedConfig]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key: tuple, entry: RenderedConfig):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= self._weight(old)
+            self._entries[key] = entry
+            self._size += self._weight(entry)
+            # 至少保留刚放入的条目, 避免超大配置每次都重新编译
+            while len(self._entries) > 1 and (self._size > self.max_bytes or len(self._entries) > self.max_entries):
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= self._weight(evicted)
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def size(self) -> int:
+        return self._size
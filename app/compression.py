@@ -0,0 +1,96 @@
+import gzip
+from typing import Dict, Iterable, Optional
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional dependency
+    zstandard = None
+
+
+# 编码名称 -> 缓存文件扩展名, 按服务端偏好排序
+ENCODING_EXTENSIONS = {
+    "br": "br",
+    "zstd": "zst",
+    "gzip": "gz",
+}
+
+
+def available_encodings() -> list:
+    """Content-Encodings that can be produced with the installed libraries"""
+    encodings = []
+    if brotli is not None:
+        encodings.append("br")
+    if zstandard is not None:
+        encodings.append("zstd")
+    encodings.append("gzip")
+    return encodings
+
+
+# brotli 11 / zstd 19 压缩几 MB 的配置要十秒左右, 这两个级别的压缩率相差不多, 耗时在一秒以内
+BROTLI_QUALITY = 5
+ZSTD_LEVEL = 6
+# gzip 9 比 6 慢两到三倍, 体积只小几个百分点
+GZIP_LEVEL = 6
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    """Compress body once per refresh, with levels that keep a large config well under a second"""
+    if encoding == "gzip":
+        # mtime=0 保证相同内容得到相同的压缩结果
+        return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+    if encoding == "br" and brotli is not None:
+        return brotli.compress(bytes(body), quality=BROTLI_QUALITY)
+    if encoding == "zstd" and zstandard is not None:
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(body)
+    raise ValueError(f"不支持的压缩格式: {encoding}")
+
+
+def compress_variants(body: bytes, encodings: Optional[Iterable[str]] = None) -> Dict[str, bytes]:
+    """Build every compressed variant of body"""
+    if encodings is None:
+        encodings = available_encodings()
+    return {encoding: compress(body, encoding) for encoding in encodings}
+
+
+def parse_accept_encoding(header: Optional[str]) -> Dict[str, float]:
+    """Parse an Accept-Encoding header into {coding: q}"""
+    accepted = {}
+    if not header:
+        return accepted
+    for part in header.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        coding, _, params = part.partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name.lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding.strip().lower()] = q
+    return accepted
+
+
+def choose_encoding(header: Optional[str], available: Iterable[str]) -> Optional[str]:
+    """选择客户端接受且服务端已有的压缩格式, 返回 None 表示发送原始内容"""
+    accepted = parse_accept_encoding(header)
+    if not accepted:
+        return None
+    wildcard = accepted.get("*", 0.0)
+    best, best_q = None, 0.0
+    for encoding in available:
+        q = accepted.get(encoding, wildcard)
+        if encoding == "gzip":
+            q = max(q, accepted.get("x-gzip", 0.0))
+        # 同等 q 值时保留服务端偏好顺序
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
@@ -1,7 +1,51 @@
-import json
-import yaml
+import os
+from functools import cached_property
 from pathlib import Path
 from datetime import datetime
+from .shared_cache import SharedRenderedCache
+from .storage import JsonFile
+from .ordering import OrderingEngine, default_ordering
+from .profiles import profile_version
+from .incremental import RefreshHistory, default_refresh_state
+from .metrics import Metrics
+from .offload import committing
+from .ratelimit import RateLimiter
+from .analytics import TokenStats
+from .snapshots import SnapshotStore
+from .serialization import RulesFragment, load_yaml
+
+
+def default_config():
+    return {
+        "url": "",
+        "update_interval": 3600,
+        "last_update": 0,
+        "auth_tokens": []
+    }
+
+
+def default_rules_config():
+    # Return default rules from utils.py
+    from .utils import DEFAULT_RULES, DEFAULT_RULE_PROVIDERS
+    return {
+        "rules": DEFAULT_RULES,
+        "rule_providers": DEFAULT_RULE_PROVIDERS
+    }
+
+
+class ConfigFile(JsonFile):
+    """config.json with a prebuilt token set for O(1) auth checks"""
+
+    tokens = frozenset()
+    profile_versions = {}
+
+    def on_reload(self, data):
+        self.tokens = frozenset(data.get("auth_tokens") or ())
+        self.profile_versions = {
+            name: profile_version(profile)
+            for name, profile in (data.get("profiles") or {}).items()
+        }
+
 
 class ConfigManager:
     def __init__(self, data_dir: Path = Path("/app/data")):
@@ -10,24 +54,77 @@ class ConfigManager:
         self.config_path = self.data_dir / "config.json"
         self.cache_path = self.data_dir / "cached_config.yaml"
         self.rules_path = self.data_dir / "rules_config.json"
+        # 所有 worker 共享同一份内存映射的输出, 而不是各自读入一份
+        self.rendered_cache = SharedRenderedCache(self.cache_path)
+        self.config_file = ConfigFile(self.config_path, default_config)
+        self.rules_file = JsonFile(self.rules_path, default_rules_config, indent=2)
+        self.rules_fragment = RulesFragment(self)
+        self.ordering_path = self.data_dir / "ordering.json"
+        self.ordering_file = JsonFile(self.ordering_path, default_ordering, indent=2)
+        self.ordering_engine = OrderingEngine(self)
+        # 上次生成 cached_config.yaml 时的输入签名和节点摘要, 用于跳过未变化的刷新
+        self.refresh_state = JsonFile(self.data_dir / "refresh_state.json", default_refresh_state)
+        self.refresh_history = RefreshHistory(self.data_dir)
+        self.metrics = Metrics(self.data_dir)
+        self.rate_limiter = RateLimiter(self)
+        self.token_stats = TokenStats(self.data_dir)
+        self.snapshots = SnapshotStore(self)
+
+    # 规则集镜像、展开规则、规则引擎和节点探测只在对应功能启用或首次使用时导入和创建
+    @cached_property
+    def ruleset_mirror(self):
+        from .rulesets import RuleSetMirror
+        return RuleSetMirror(self)
+
+    @cached_property
+    def inline_compiler(self):
+        from .inline_rules import InlineRuleCompiler
+        return InlineRuleCompiler(self)
+
+    @cached_property
+    def rules_engine(self):
+        from .rules_engine import RulesEngineCache
+        return RulesEngineCache(self)
+
+    @cached_property
+    def prober(self):
+        from .prober import Prober
+        return Prober(self)
 
     def load_config(self):
         """Load configuration from file"""
-        if not self.config_path.exists():
-            return {
-                "url": "",
-                "update_interval": 3600,
-                "last_update": 0,
-                "auth_tokens": []
-            }
-        
-        with open(self.config_path, "r") as f:
-            return json.load(f)
+        return self.config_file.load()
+
+    def config_view(self):
+        """Read-only parsed configuration, reloaded only when config.json changes"""
+        return self.config_file.view()
+
+    def is_valid_token(self, token: str) -> bool:
+        """检查访问令牌是否有效"""
+        self.config_file.view()
+        return token in self.config_file.tokens
 
     def save_config(self, config):
         """Save configuration to file"""
-        with open(self.config_path, "w") as f:
-            json.dump(config, f)
+        self.config_file.save(config)
+
+    def token_profile(self, token: str):
+        """Profile assigned to a token, None for the default output"""
+        return (self.config_view().get("token_profiles") or {}).get(token)
+
+    def rule_mirror_settings(self):
+        """Settings of the local rule-provider mirror"""
+        from .rulesets import mirror_settings
+        return mirror_settings(self.config_view())
+
+    def rule_mode(self) -> str:
+        """provider: 输出 RULE-SET 和 rule-providers; inline: 展开为普通规则"""
+        return "inline" if self.config_view().get("rule_mode") == "inline" else "provider"
+
+    def subscription_sources(self):
+        """Normalized list of subscription sources, including the legacy single url"""
+        from .sources import normalize_sources
+        return normalize_sources(self.config_view())
 
     def load_cached_proxy(self):
         """Load cached transformed configuration"""
@@ -35,30 +132,58 @@ class ConfigManager:
             return None
         
         with open(self.cache_path, "r") as f:
-            return yaml.safe_load(f)
+            return load_yaml(f)
 
     def save_cached_proxy(self, config: dict):
-        """Save transformed configuration to cache"""
-        with open(self.cache_path, "w") as f:
-            yaml.dump(config, f, allow_unicode=True)
+        """Store the transformed configuration as a snapshot and serve it when it passes the sanity gates"""
+        with self.metrics.timer("serialize"):
+            body = self.render_config(config)
+        with self.metrics.timer("write"):
+            # 未通过检查时抛出异常, 继续使用当前的配置
+            digest = self.snapshots.store(config, body)
+            # 先写压缩文件, 再切换主文件, 读取方总能找到对应的压缩版本
+            variants = self.rendered_cache.write_variants(body)
+            # 在线程池中超时的刷新已经报告失败, 不再切换到新配置
+            with committing():
+                self.snapshots.point(digest)
+                rendered = self.rendered_cache.prime(body, variants)
+        # 保留的快照都留着压缩文件, 回滚时无需重新压缩
+        self.rendered_cache.cleanup_variants(*self.snapshots.digests())
+        return rendered
+
+    def render_config(self, config: dict) -> bytes:
+        """Serialize a config, reusing the pre-serialized rules section"""
+        return self.rules_fragment.render(config)
+
+    def load_rendered_proxy(self):
+        """Load the serialized cached configuration without parsing it"""
+        return self.rendered_cache.get()
 
     def load_rules_config(self):
         """Load rules configuration from file"""
-        if not self.rules_path.exists():
-            # Return default rules from utils.py
-            from .utils import DEFAULT_RULES, DEFAULT_RULE_PROVIDERS
-            return {
-                "rules": DEFAULT_RULES,
-                "rule_providers": DEFAULT_RULE_PROVIDERS
-            }
-        
-        with open(self.rules_path, "r") as f:
-            return json.load(f)
+        return self.rules_file.load()
+
+    def rules_view(self):
+        """Read-only parsed rules configuration"""
+        return self.rules_file.view()
+
+    @property
+    def rules_version(self) -> str:
+        """Content hash of rules_config.json, changes whenever rules are saved"""
+        self.rules_file.view()
+        return self.rules_file.version
 
     def save_rules_config(self, rules_config):
         """Save rules configuration to file"""
-        with open(self.rules_path, "w") as f:
-            json.dump(rules_config, f, indent=2, ensure_ascii=False)
+        self.rules_file.save(rules_config)
+
+    def load_ordering_config(self):
+        """Load node ordering configuration from file"""
+        return self.ordering_file.load()
+
+    def save_ordering_config(self, ordering):
+        """Save node ordering configuration to file"""
+        self.ordering_file.save(ordering)
 
     def update_last_update_time(self):
         """Update the last update timestamp in config"""
@@ -73,9 +198,11 @@ class ConfigManager:
         Returns:
             bool: True 表示需要更新，False 表示不需要更新
         """
-        config = self.load_config()
+        config = self.config_view()
         last_update = config.get("last_update")
-        update_interval = config.get("update_interval", 3600)
+        # 多订阅时按最短的订阅更新间隔检查
+        intervals = [source["update_interval"] for source in self.subscription_sources() if source["enabled"]]
+        update_interval = min(intervals or [config.get("update_interval", 3600)])
         
         # 如果没有上次更新时间,需要更新
         if not last_update:
@@ -87,4 +214,4 @@ class ConfigManager:
 
 
 # Create a singleton instance
-config_manager = ConfigManager() 
\ No newline at end of file
+config_manager = ConfigManager(Path(os.getenv("DATA_DIR", "/app/data"))) 
\ No newline at end of file
@@ -0,0 +1,160 @@
+import asyncio
+import aiohttp
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Optional
+
+from .storage import atomic_writer
+
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7',
+    'Accept-Language': 'zh-CN,zh;q=0.9,en;q=0.8',
+    'Accept-Encoding': 'gzip, deflate, br',
+    'Connection': 'keep-alive'
+}
+
+# 连接与读取超时（秒）
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 60
+# 失败后最多重试次数及退避基数（秒）
+MAX_RETRIES = 3
+RETRY_BACKOFF = 1.0
+# 这些状态码视为临时错误, 可以重试
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+# 下载到文件时每次读取的块大小
+CHUNK_SIZE = 64 * 1024
+
+_session: Optional[aiohttp.ClientSession] = None
+_session_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def create_session() -> aiohttp.ClientSession:
+    """Create a pooled keep-alive client session bound to the running loop"""
+    connector = aiohttp.TCPConnector(
+        limit=32,
+        limit_per_host=8,
+        ttl_dns_cache=300,
+        keepalive_timeout=60
+    )
+    timeout = aiohttp.ClientTimeout(
+        total=None,
+        connect=CONNECT_TIMEOUT,
+        sock_connect=CONNECT_TIMEOUT,
+        sock_read=READ_TIMEOUT
+    )
+    return aiohttp.ClientSession(connector=connector, timeout=timeout, headers=DEFAULT_HEADERS)
+
+
+def get_session() -> aiohttp.ClientSession:
+    """Shared client session of the current worker"""
+    global _session, _session_loop
+    loop = asyncio.get_running_loop()
+    if _session is None or _session.closed or _session_loop is not loop:
+        _session = create_session()
+        _session_loop = loop
+    return _session
+
+
+async def close_session():
+    """Close the shared session, called when the worker stops"""
+    global _session, _session_loop
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+    _session_loop = None
+
+
+@dataclass
+class FetchResult:
+    """Response of a successful (200) or not-modified (304) request, header names lower-cased
+
+    When downloaded to a file, body stays empty and path points at the file.
+    """
+    status: int
+    headers: Dict[str, str]
+    body: bytes = b""
+    charset: Optional[str] = None
+    path: Optional[Path] = None
+    size: int = 0
+
+    @property
+    def not_modified(self) -> bool:
+        return self.status == 304
+
+    def text(self) -> str:
+        return self.body.decode(self.charset or "utf-8", errors="replace")
+
+
+async def fetch(url: str,
+                session: Optional[aiohttp.ClientSession] = None,
+                etag: Optional[str] = None,
+                last_modified: Optional[str] = None,
+                retries: int = MAX_RETRIES,
+                backoff: float = RETRY_BACKOFF,
+                path: Optional[Path] = None,
+                max_bytes: Optional[int] = None) -> FetchResult:
+    """获取 url 的内容, 支持条件请求, 对临时错误做有限次数的指数退避重试
+
+    指定 path 时分块写入该文件而不是读入内存; 超过 max_bytes 的响应直接失败, 不再重试
+    """
+    if session is None:
+        session = get_session()
+
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+
+    last_error = None
+    for attempt in range(retries + 1):
+        try:
+            async with session.get(url, headers=headers) as response:
+                if response.status in (200, 304):
+                    result = FetchResult(
+                        status=response.status,
+                        headers={key.lower(): value for key, value in response.headers.items()},
+                        charset=response.charset
+                    )
+                    if response.status == 200:
+                        if max_bytes and (response.content_length or 0) > max_bytes:
+                            raise Exception(f"上游内容过大: {response.content_length} 字节, 上限 {max_bytes} 字节")
+                        if path is None:
+                            result.body = await response.read()
+                            result.size = len(result.body)
+                        else:
+                            result.size = await download(response, path, max_bytes)
+                            result.path = path
+                    return result
+                last_error = f"获取配置失败: {response.status}"
+                if response.status not in RETRYABLE_STATUS:
+                    break
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            last_error = f"获取配置失败: {type(e).__name__} {e}"
+
+        if attempt < retries:
+            await asyncio.sleep(backoff * (2 ** attempt))
+
+    raise Exception(last_error)
+
+
+async def download(response: aiohttp.ClientResponse, path: Path, max_bytes: Optional[int] = None) -> int:
+    """Stream the response body into path chunk by chunk, returning its size"""
+    size = 0
+    with atomic_writer(path) as f:
+        async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+            size += len(chunk)
+            if max_bytes and size > max_bytes:
+                raise Exception(f"上游内容过大: 超过上限 {max_bytes} 字节")
+            f.write(chunk)
+    return size
+
+
+async def fetch_text(url: str,
+                     session: Optional[aiohttp.ClientSession] = None,
+                     retries: int = MAX_RETRIES,
+                     backoff: float = RETRY_BACKOFF) -> str:
+    """获取 url 的文本内容"""
+    result = await fetch(url, session=session, retries=retries, backoff=backoff)
+    return result.text()
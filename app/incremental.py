@@ -0,0 +1,157 @@
+import hashlib
+import json
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .compression import compress
+from .storage import atomic_write
+
+# 刷新历史最多保留的条数, 以及每条记录中列出的节点名称数量
+HISTORY_LIMIT = 50
+SAMPLE_SIZE = 20
+
+
+def default_refresh_state():
+    return {"signature": "", "proxies": {}}
+
+
+def proxy_digest(proxy: dict) -> str:
+    return hashlib.sha1(json.dumps(proxy, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()[:16]
+
+
+def diff_proxies(previous: Dict[str, str], current: Dict[str, str]) -> Dict[str, List[str]]:
+    """Node names added, removed and modified between two {name: digest} maps"""
+    return {
+        "added": [name for name in current if name not in previous],
+        "removed": [name for name in previous if name not in current],
+        "modified": [name for name, digest in current.items() if name in previous and previous[name] != digest],
+    }
+
+
+def output_signature(manager, results) -> str:
+    """Hash of everything cached_config.yaml is built from
+
+    Covers the raw upstream bodies, the source settings that change the
+    merge (order, prefix), the rules and ordering configuration and, when
+    probing is on, the probe results.
+    """
+    manager.ordering_file.view()
+    inputs = [
+        [[result.source["url"], result.source["prefix"], result.body_hash] for result in results],
+        list(manager.rules_fragment.version()),
+        manager.ordering_file.version,
+        manager.prober.version(),
+    ]
+    return hashlib.sha256(json.dumps(inputs, ensure_ascii=False, default=str).encode("utf-8")).hexdigest()
+
+
+class RefreshHistory:
+    """Bounded log of proxy-level changes in data_dir/refresh_history.jsonl"""
+
+    def __init__(self, data_dir: Path, limit: int = HISTORY_LIMIT):
+        self.path = data_dir / "refresh_history.jsonl"
+        self.limit = limit
+        self._lock = threading.Lock()
+
+    def entries(self) -> List[dict]:
+        """Newest first"""
+        try:
+            with open(self.path, "rb") as f:
+                lines = f.read().splitlines()
+        except FileNotFoundError:
+            return []
+        return [json.loads(line) for line in reversed(lines) if line.strip()]
+
+    def append(self, entry: dict):
+        with self._lock:
+            entries = list(reversed(self.entries()))[-(self.limit - 1):] + [entry]
+            body = "".join(json.dumps(item, ensure_ascii=False) + "\n" for item in entries)
+            atomic_write(self.path, body.encode("utf-8"))
+
+
+def write_output(config: dict) -> Dict[str, str]:
+    """Render and publish config, returning the {name: digest} map the history is diffed against
+
+    Runs in the CPU pool, possibly in another process, so it goes through
+    the config_manager of that process and returns only plain data.
+    """
+    from .config import config_manager
+
+    config_manager.save_cached_proxy(config)
+    return {proxy["name"]: proxy_digest(proxy) for proxy in config["proxies"]}
+
+
+def fill_variants():
+    """Compress the served config for the encodings it has no variant for, and publish them"""
+    from .config import config_manager
+
+    cache = config_manager.rendered_cache
+    rendered = cache.get()
+    body = bytes(rendered.body)
+    missing = {encoding: compress(body, encoding) for encoding in cache.missing_encodings(rendered)}
+    cache.write_variants(body, missing)
+    cache.prime(body, {**rendered.variants, **missing})
+
+
+async def refresh_config(manager, session=None, force: bool = False,
+                         progress: Optional[Callable[[str, Optional[dict]], None]] = None) -> Tuple[object, Optional[dict]]:
+    """Fetch all sources and rebuild cached_config.yaml only when its inputs changed
+
+    Returns (rendered config, history entry). The entry is None when
+    upstreams, rules and ordering are all unchanged; then only last_update
+    moves forward. progress(stage, entry) is called as the refresh moves
+    through fetch, transform and write, and with "done" at the end.
+    """
+    report = progress or (lambda stage, entry=None: None)
+    try:
+        rendered, entry = await _refresh_config(manager, session=session, force=force, report=report)
+    except Exception:
+        manager.metrics.inc("clash_refresh_total", result="failed")
+        manager.metrics.flush()
+        raise
+    manager.metrics.inc("clash_refresh_total", result="unchanged" if entry is None else "changed")
+    manager.metrics.flush()
+    report("done", entry)
+    return rendered, entry
+
+
+async def _refresh_config(manager, session=None, force: bool = False, report=None):
+    from .offload import cpu_pool
+    from .utils import fetch_source_results, transform_results
+
+    report("fetch")
+    results = await fetch_source_results(manager.subscription_sources(), session=session, force=force)
+    signature = output_signature(manager, results)
+    state = manager.refresh_state.view()
+    rendered = manager.load_rendered_proxy()
+    if rendered and state.get("signature") == signature:
+        if manager.rendered_cache.missing_encodings(rendered):
+            # 升级前的缓存或回滚到的快照缺少压缩文件, 在这里补齐而不是在请求中压缩
+            await cpu_pool.run("write", fill_variants)
+            rendered = manager.load_rendered_proxy()
+        manager.update_last_update_time()
+        return rendered, None
+
+    # 合并排序和序列化在 CPU 池中进行, 事件循环只等待结果
+    report("transform")
+    config = await cpu_pool.run("transform", transform_results, results)
+    manager.metrics.set("clash_proxies", len(config["proxies"]))
+    report("write")
+    digests = await cpu_pool.run("write", write_output, config)
+    rendered = manager.load_rendered_proxy()
+    manager.update_last_update_time()
+
+    diff = diff_proxies(state.get("proxies") or {}, digests)
+    entry = {
+        "time": datetime.now().timestamp(),
+        "total": len(digests),
+        "sources": [result.source["name"] for result in results if result.changed],
+        **{kind: len(names) for kind, names in diff.items()},
+        "samples": {kind: names[:SAMPLE_SIZE] for kind, names in diff.items() if names},
+    }
+    manager.refresh_history.append(entry)
+    manager.refresh_state.save({"signature": signature, "proxies": digests})
+    return rendered, entry
+
@@ -0,0 +1,265 @@
+import bisect
+import hashlib
+import ipaddress
+import json
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import List, Tuple
+
+from .serialization import load_yaml
+from .storage import atomic_write
+
+DOMAIN_TYPES = ("DOMAIN", "DOMAIN-SUFFIX")
+CIDR_TYPES = ("IP-CIDR", "IP-CIDR6")
+
+
+def parse_payload(body: bytes) -> List[str]:
+    """Entries of a rule-provider file, either `payload:` YAML or one entry per line"""
+    text = body.decode("utf-8", errors="replace")
+    if text.lstrip().startswith("payload:"):
+        payload = load_yaml(text) or {}
+        return [str(entry).strip() for entry in payload.get("payload") or [] if str(entry).strip()]
+    entries = []
+    for line in text.splitlines():
+        line = line.strip()
+        if line and not line.startswith("#"):
+            entries.append(line)
+    return entries
+
+
+def domain_entry(entry: str) -> Tuple[str, str]:
+    """Convert a domain-behavior entry to (rule type, domain)
+
+    `+.example.com` matches the domain and its subdomains, which is exactly
+    DOMAIN-SUFFIX. `.example.com` and `*.example.com` only match subdomains
+    in the provider format; they are widened to DOMAIN-SUFFIX because plain
+    rules have no subdomain-only form.
+    """
+    entry = entry.lower()
+    for prefix in ("+.", "*.", "."):
+        if entry.startswith(prefix):
+            return "DOMAIN-SUFFIX", entry[len(prefix):]
+    return "DOMAIN", entry
+
+
+def parent_suffixes(domain: str):
+    """example.a.com -> example.a.com, a.com, com"""
+    parts = domain.split(".")
+    for i in range(len(parts)):
+        yield ".".join(parts[i:])
+
+
+def minimize_domains(entries: List[Tuple[str, str]]) -> List[Tuple[str, str]]:
+    """Drop duplicates and domains already covered by a DOMAIN-SUFFIX of the same set"""
+    suffixes = {value for rule_type, value in entries if rule_type == "DOMAIN-SUFFIX"}
+    kept = []
+    seen = set()
+    for rule_type, value in entries:
+        if (rule_type, value) in seen:
+            continue
+        seen.add((rule_type, value))
+        candidates = parent_suffixes(value)
+        if rule_type == "DOMAIN-SUFFIX":
+            # 自身不算, 只看更短的父域名
+            next(candidates)
+        if any(suffix in suffixes for suffix in candidates):
+            continue
+        kept.append((rule_type, value))
+    return kept
+
+
+def collapse_cidrs(entries: List[str]) -> List[str]:
+    """Merge adjacent and overlapping IPv4 / IPv6 ranges into a minimal set"""
+    v4, v6 = [], []
+    for entry in entries:
+        try:
+            network = ipaddress.ip_network(entry, strict=False)
+        except ValueError:
+            continue
+        (v4 if network.version == 4 else v6).append(network)
+    return [str(network) for network in ipaddress.collapse_addresses(v4)] + \
+        [str(network) for network in ipaddress.collapse_addresses(v6)]
+
+
+def compile_provider(body: bytes, behavior: str) -> List[list]:
+    """Expand one provider into [type, value, *options] entries without target"""
+    entries = parse_payload(body)
+    if behavior == "domain":
+        return [list(entry) for entry in minimize_domains([domain_entry(entry) for entry in entries])]
+    if behavior == "ipcidr":
+        compiled = []
+        for cidr in collapse_cidrs(entries):
+            compiled.append(["IP-CIDR6" if ":" in cidr else "IP-CIDR", cidr])
+        return compiled
+
+    # classical: 每行已经是 类型,值[,选项]
+    compiled = []
+    seen = set()
+    for entry in entries:
+        parts = [part.strip() for part in entry.split(",")]
+        if len(parts) < 2 or tuple(parts) in seen:
+            continue
+        seen.add(tuple(parts))
+        compiled.append(parts)
+    return compiled
+
+
+class RangeIndex:
+    """Sorted, merged integer ranges of earlier CIDR rules for O(log n) coverage checks"""
+
+    def __init__(self):
+        self.starts: List[int] = []
+        self.ends: List[int] = []
+
+    @staticmethod
+    def _range(cidr: str) -> Tuple[int, int, int]:
+        network = ipaddress.ip_network(cidr, strict=False)
+        # 用版本号区分 IPv4 和 IPv6 的地址空间
+        offset = network.version << 128
+        return offset + int(network.network_address), offset + int(network.broadcast_address), network.version
+
+    def covers(self, cidr: str) -> bool:
+        start, end, _ = self._range(cidr)
+        index = bisect.bisect_right(self.starts, start) - 1
+        return index >= 0 and self.ends[index] >= end
+
+    def add_all(self, cidrs: List[str]):
+        ranges = list(zip(self.starts, self.ends))
+        ranges.extend(self._range(cidr)[:2] for cidr in cidrs)
+        ranges.sort()
+        merged = []
+        for start, end in ranges:
+            if merged and start <= merged[-1][1] + 1:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        self.starts = [start for start, _ in merged]
+        self.ends = [end for _, end in merged]
+
+
+class InlineRuleCompiler:
+    """Expand RULE-SET lines into plain rules for clients without rule-provider support
+
+    Each provider list is compiled once per content hash (memory and
+    data_dir/inline_cache). While assembling the final list, rules that an
+    earlier rule already covers can never match and are dropped: exact
+    duplicates, domains under an earlier DOMAIN-SUFFIX and CIDRs inside an
+    earlier range.
+    """
+
+    MEMORY_ENTRIES = 64
+
+    def __init__(self, manager):
+        self.manager = manager
+        self.dir = manager.data_dir / "inline_cache"
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, List[list]]" = OrderedDict()
+
+    def _cache_path(self, key: str) -> Path:
+        return self.dir / f"{key}.json"
+
+    def compiled_provider(self, body: bytes, behavior: str) -> List[list]:
+        key = f"{hashlib.sha256(body).hexdigest()[:32]}-{behavior}"
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+        try:
+            with open(self._cache_path(key), "rb") as f:
+                compiled = json.loads(f.read())
+        except FileNotFoundError:
+            compiled = compile_provider(body, behavior)
+            self.dir.mkdir(exist_ok=True)
+            atomic_write(self._cache_path(key), json.dumps(compiled, ensure_ascii=False).encode("utf-8"))
+        with self._lock:
+            self._memory[key] = compiled
+            while len(self._memory) > self.MEMORY_ENTRIES:
+                self._memory.popitem(last=False)
+        return compiled
+
+    def version(self, rule_providers: dict) -> tuple:
+        """Content versions of the mirrored lists, used as part of cache keys"""
+        mirror = self.manager.ruleset_mirror
+        versions = []
+        for name in sorted(rule_providers):
+            rendered = mirror.get(name)
+            versions.append((name, rendered.etag if rendered else None))
+        return tuple(versions)
+
+    def compile(self, rules: List[str], rule_providers: dict) -> Tuple[List[str], dict]:
+        """Return (plain rules, providers that could not be inlined)"""
+        mirror = self.manager.ruleset_mirror
+        remaining = {}
+        output = []
+        seen = set()
+        suffixes = set()
+        # 不带 no-resolve 的 IP 规则会解析域名, 能覆盖之后的所有同范围规则;
+        # 带 no-resolve 的只能覆盖之后同样带 no-resolve 的规则
+        ranges = {False: RangeIndex(), True: RangeIndex()}
+
+        def covered(rule_type: str, value: str, no_resolve: bool = False) -> bool:
+            if rule_type in CIDR_TYPES:
+                try:
+                    return ranges[False].covers(value) or (no_resolve and ranges[True].covers(value))
+                except ValueError:
+                    return False
+            if (rule_type, value) in seen:
+                return True
+            if rule_type in DOMAIN_TYPES:
+                candidates = parent_suffixes(value.lower())
+                if rule_type == "DOMAIN-SUFFIX":
+                    next(candidates)
+                return any(suffix in suffixes for suffix in candidates)
+            return False
+
+        def remember(entries: List[Tuple[str, str, bool]]):
+            cidrs = {False: [], True: []}
+            for rule_type, value, no_resolve in entries:
+                seen.add((rule_type, value))
+                if rule_type == "DOMAIN-SUFFIX":
+                    suffixes.add(value.lower())
+                elif rule_type in CIDR_TYPES:
+                    cidrs[no_resolve].append(value)
+            for no_resolve, values in cidrs.items():
+                if values:
+                    try:
+                        ranges[no_resolve].add_all(values)
+                    except ValueError:
+                        pass
+
+        for rule in rules:
+            parts = [part.strip() for part in rule.split(",")]
+            if parts[0] != "RULE-SET" or len(parts) < 3:
+                if len(parts) >= 3:
+                    no_resolve = "no-resolve" in parts[3:]
+                    if not covered(parts[0], parts[1], no_resolve):
+                        remember([(parts[0], parts[1], no_resolve)])
+                        output.append(rule)
+                elif len(parts) < 3:
+                    output.append(rule)
+                continue
+
+            name, target, options = parts[1], parts[2], parts[3:]
+            provider = rule_providers.get(name)
+            rendered = mirror.get(name) if provider else None
+            if rendered is None:
+                # 尚未同步的规则集保留 RULE-SET 形式
+                if provider:
+                    remaining[name] = provider
+                output.append(rule)
+                continue
+
+            added = []
+            for entry in self.compiled_provider(rendered.body, provider.get("behavior", "domain")):
+                rule_type, value, entry_options = entry[0], entry[1], entry[2:]
+                if rule_type in CIDR_TYPES:
+                    entry_options = list(dict.fromkeys(entry_options + options))
+                no_resolve = "no-resolve" in entry_options
+                if covered(rule_type, value, no_resolve):
+                    continue
+                added.append((rule_type, value, no_resolve))
+                output.append(",".join([rule_type, value, target] + entry_options))
+            remember(added)
+
+        return output, remaining
@@ -0,0 +1,58 @@
+import asyncio
+import fcntl
+import os
+from pathlib import Path
+
+
+class FileLock:
+    """Advisory inter-process lock backed by flock on a file in data_dir
+
+    The kernel drops the lock when the holding process exits, so a crashed
+    worker can never leave a stale lease behind.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._fd = None
+
+    @property
+    def locked(self) -> bool:
+        return self._fd is not None
+
+    def try_acquire(self) -> bool:
+        """Take the lock without blocking, returns False when held elsewhere"""
+        if self._fd is not None:
+            return True
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        self._fd = fd
+        return True
+
+    async def acquire(self, poll_interval: float = 0.1, timeout: float = None):
+        """Wait for the lock without blocking the event loop"""
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        while not self.try_acquire():
+            if deadline is not None and loop.time() >= deadline:
+                raise TimeoutError(f"等待文件锁超时: {self.path}")
+            await asyncio.sleep(poll_interval)
+
+    def release(self):
+        if self._fd is None:
+            return
+        try:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        finally:
+            os.close(self._fd)
+            self._fd = None
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *_):
+        self.release()
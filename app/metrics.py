@@ -0,0 +1,182 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from .storage import atomic_write
+
+# 延迟直方图的桶上限（秒）
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# 超过这个时间没有更新的进程快照视为已退出, 清理掉
+STALE_AFTER = 24 * 3600
+
+METRICS = {
+    "clash_http_requests_total": ("counter", "HTTP requests by route, method and status"),
+    "clash_http_request_duration_seconds": ("histogram", "HTTP request latency by route"),
+    "clash_subscription_cache_total": ("counter", "Subscription requests by cache status (HIT, STALE, MISS)"),
+    "clash_rate_limited_total": ("counter", "Subscription requests stopped by the rate limiter, by response (304, 429)"),
+    "clash_refresh_total": ("counter", "Refreshes by result (changed, unchanged, failed)"),
+    "clash_refresh_stage_seconds": ("histogram", "Time spent in each refresh stage"),
+    "clash_upstream_response_bytes": ("gauge", "Size of the last upstream response per source"),
+    "clash_proxies": ("gauge", "Number of proxies in the cached config"),
+    "clash_cached_config_age_seconds": ("gauge", "Seconds since cached_config.yaml was written"),
+    "clash_event_loop_lag_seconds": ("histogram", "How late the event loop of a worker woke up a periodic timer"),
+}
+
+Key = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+def _key(name: str, labels: dict) -> Key:
+    return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+def process_snapshots(directory: Path) -> List[dict]:
+    """Snapshots written by the other processes into directory/<pid>.json, dropping stale ones"""
+    snapshots = []
+    own = f"{os.getpid()}.json"
+    now = time.time()
+    for path in directory.glob("*.json") if directory.exists() else ():
+        if path.name == own:
+            continue
+        try:
+            if path.stat().st_mtime + STALE_AFTER < now:
+                path.unlink()
+                continue
+            with open(path, "rb") as f:
+                snapshots.append(json.loads(f.read()))
+        except (OSError, ValueError):
+            # 文件可能正被替换或清理, 下次读取时再读
+            continue
+    return snapshots
+
+
+class Metrics:
+    """Process-local counters, gauges and histograms, shared through data_dir/metrics
+
+    Every process writes its own snapshot to metrics/<pid>.json; /metrics
+    sums counters and histograms over all snapshots and takes the most
+    recently set value of each gauge, so the numbers are the same whichever
+    Sanic worker answers the scrape.
+    """
+
+    def __init__(self, data_dir: Path):
+        self.dir = data_dir / "metrics"
+        self._lock = threading.Lock()
+        self.counters: Dict[Key, float] = {}
+        self.gauges: Dict[Key, Tuple[float, float]] = {}
+        self.histograms: Dict[Key, List[float]] = {}
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels):
+        with self._lock:
+            self.gauges[_key(name, labels)] = (value, time.time())
+
+    def observe(self, name: str, value: float, **labels):
+        """Record one histogram sample: per-bucket counts, then sum and count"""
+        key = _key(name, labels)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [0] * (len(BUCKETS) + 2)
+            for index, bound in enumerate(BUCKETS):
+                if value <= bound:
+                    histogram[index] += 1
+                    break
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    @contextmanager
+    def timer(self, stage: str):
+        """Time a refresh stage into clash_refresh_stage_seconds"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe("clash_refresh_stage_seconds", time.perf_counter() - start, stage=stage)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "counters": [[name, list(labels), value] for (name, labels), value in self.counters.items()],
+                "gauges": [[name, list(labels), value, at] for (name, labels), (value, at) in self.gauges.items()],
+                "histograms": [[name, list(labels), list(values)] for (name, labels), values in self.histograms.items()],
+            }
+
+    def flush(self):
+        """Write this process's snapshot for the other workers to aggregate"""
+        if not (self.counters or self.gauges or self.histograms):
+            return
+        self.dir.mkdir(exist_ok=True)
+        atomic_write(self.dir / f"{os.getpid()}.json", json.dumps(self.snapshot()).encode("utf-8"))
+
+    def _snapshots(self) -> List[dict]:
+        return [self.snapshot()] + process_snapshots(self.dir)
+
+    def collect(self):
+        """(counters, gauges, histograms) summed over every process"""
+        counters: Dict[Key, float] = {}
+        gauges: Dict[Key, Tuple[float, float]] = {}
+        histograms: Dict[Key, List[float]] = {}
+        for snapshot in self._snapshots():
+            for name, labels, value in snapshot["counters"]:
+                key = (name, tuple(tuple(pair) for pair in labels))
+                counters[key] = counters.get(key, 0) + value
+            for name, labels, value, at in snapshot["gauges"]:
+                key = (name, tuple(tuple(pair) for pair in labels))
+                if key not in gauges or at > gauges[key][1]:
+                    gauges[key] = (value, at)
+            for name, labels, values in snapshot["histograms"]:
+                key = (name, tuple(tuple(pair) for pair in labels))
+                if key in histograms:
+                    histograms[key] = [a + b for a, b in zip(histograms[key], values)]
+                else:
+                    histograms[key] = list(values)
+        return counters, gauges, histograms
+
+    def render(self, extra_gauges: Dict[str, float] = None) -> str:
+        """Prometheus text exposition format"""
+        counters, gauges, histograms = self.collect()
+        for name, value in (extra_gauges or {}).items():
+            gauges[(name, ())] = (value, time.time())
+
+        families: Dict[str, List[str]] = {}
+        for (name, labels), value in sorted(counters.items()):
+            families.setdefault(name, []).append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        for (name, labels), (value, _) in sorted(gauges.items()):
+            families.setdefault(name, []).append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        for (name, labels), values in sorted(histograms.items()):
+            lines = families.setdefault(name, [])
+            cumulative = 0
+            for bound, count in zip(BUCKETS, values):
+                cumulative += count
+                lines.append(f"{name}_bucket{_format_labels(labels, (('le', _format_value(bound)),))} {_format_value(cumulative)}")
+            lines.append(f"{name}_bucket{_format_labels(labels, (('le', '+Inf'),))} {_format_value(values[-1])}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(values[-2])}")
+            lines.append(f"{name}_count{_format_labels(labels)} {_format_value(values[-1])}")
+
+        output = []
+        for name, lines in families.items():
+            metric_type, description = METRICS.get(name, ("untyped", name))
+            output.append(f"# HELP {name} {description}")
+            output.append(f"# TYPE {name} {metric_type}")
+            output.extend(lines)
+        return "\n".join(output) + "\n"
@@ -0,0 +1,179 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import BrokenExecutor, Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Optional
+
+from .serialization import LIBYAML
+
+# thread: 在线程中运行, libyaml 的解析和序列化不需要复制数据; process: 在子进程中运行, 不占用 worker 的 GIL
+EXECUTOR = os.getenv("TRANSFORM_EXECUTOR") or ("thread" if LIBYAML else "process")
+WORKERS = int(os.getenv("TRANSFORM_WORKERS", "2"))
+# 单个阶段的最长运行时间, 与请求超时一致
+TIMEOUT = float(os.getenv("TRANSFORM_TIMEOUT", "300"))
+
+
+def _call_in_process(fn, args):
+    """Run fn in a pool process and write out the stage timings it recorded"""
+    from .config import config_manager
+    try:
+        return fn(*args)
+    finally:
+        config_manager.metrics.flush()
+
+
+class Ticket:
+    """Cancellation state of one stage run in a thread, which cannot be interrupted
+
+    The stage wraps the step that makes its result visible in
+    committing(); once the caller gave up, that step raises instead of
+    publishing a result the refresh already reported as failed.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.cancelled = False
+        self.committed = False
+
+    def cancel(self) -> bool:
+        """Mark the stage cancelled, False when it already committed"""
+        with self._lock:
+            if self.committed:
+                return False
+            self.cancelled = True
+            return True
+
+    @contextmanager
+    def commit(self):
+        with self._lock:
+            if self.cancelled:
+                raise Exception("阶段已取消, 不再发布结果")
+            yield
+            self.committed = True
+
+
+_current = threading.local()
+
+
+@contextmanager
+def committing():
+    """Guard the publishing step of a stage; no-op outside the thread pool"""
+    ticket = getattr(_current, "ticket", None)
+    if ticket is None:
+        yield
+        return
+    with ticket.commit():
+        yield
+
+
+def _call_in_thread(ticket: Ticket, fn, args):
+    _current.ticket = ticket
+    try:
+        return fn(*args)
+    finally:
+        _current.ticket = None
+
+
+def _discard(future: asyncio.Future):
+    # 放弃等待的阶段随后会以取消或进程被终止的异常结束, 取出异常避免事件循环报告未处理
+    if not future.cancelled():
+        future.exception()
+
+
+def _terminate(executor: ProcessPoolExecutor):
+    processes = list((getattr(executor, "_processes", None) or {}).values())
+    executor.shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        process.terminate()
+
+
+class CpuPool:
+    """Bounded executor for the CPU-bound refresh stages (parse, transform, write)
+
+    Stages are awaited from the event loop, so a worker keeps answering
+    other requests while a large subscription is parsed, sorted and dumped.
+    Functions and arguments must be picklable in process mode: they run in
+    a spawned child that uses its own config_manager over the same
+    DATA_DIR. A stage that times out or whose caller is cancelled kills the
+    pool processes; threads cannot be interrupted, so in thread mode the
+    stage finishes in the background and its committing() step refuses to
+    publish.
+    """
+
+    def __init__(self, kind: str = EXECUTOR, workers: int = WORKERS, timeout: float = TIMEOUT):
+        if kind not in ("thread", "process"):
+            raise Exception(f"不支持的执行方式: {kind}")
+        self.kind = kind
+        self.workers = max(1, workers)
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._executor: Optional[Executor] = None
+
+    def executor(self) -> Executor:
+        with self._lock:
+            if self._executor is None:
+                if self.kind == "process":
+                    # spawn: 不从带有事件循环和线程的 worker 中 fork
+                    self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+                else:
+                    self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="transform")
+            return self._executor
+
+    def warm(self):
+        """Start the pool processes ahead of the first refresh, without waiting for them"""
+        if self.kind == "process":
+            for _ in range(self.workers):
+                self.executor().submit(os.getpid)
+
+    async def run(self, stage: str, fn, *args):
+        """Await fn(*args) in the pool, cancelling it after the timeout"""
+        loop = asyncio.get_running_loop()
+        executor = self.executor()
+        ticket = future = None
+        try:
+            if self.kind == "process":
+                future = loop.run_in_executor(executor, _call_in_process, fn, args)
+            else:
+                ticket = Ticket()
+                future = loop.run_in_executor(executor, _call_in_thread, ticket, fn, args)
+            done, _ = await asyncio.wait({future}, timeout=self.timeout)
+            if done:
+                return future.result()
+            if ticket is not None and not ticket.cancel():
+                # 超时的同时阶段已经开始发布, 等它完成, 结果与磁盘上的状态一致
+                return await future
+            future.add_done_callback(_discard)
+            self.reset(executor)
+            raise Exception(f"{stage} 阶段超过 {self.timeout:g}s 未完成, 已取消")
+        except (asyncio.CancelledError, BrokenExecutor):
+            # 子进程意外退出后池不能再用, 下次调用时重新创建
+            if ticket is not None:
+                ticket.cancel()
+            if future is not None:
+                future.add_done_callback(_discard)
+            self.reset(executor)
+            raise
+
+    def reset(self, executor: Executor):
+        """Drop executor if it is still the current pool, killing its processes; the next stage starts a new one"""
+        with self._lock:
+            if self._executor is not executor:
+                # 并发的阶段已经换过新的池
+                return
+            self._executor = None
+        if isinstance(executor, ProcessPoolExecutor):
+            _terminate(executor)
+        else:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+# Create a singleton instance per worker
+cpu_pool = CpuPool()
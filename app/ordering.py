@@ -0,0 +1,186 @@
+import copy
+import math
+import re
+import threading
+from typing import Dict, List, Optional, Tuple
+
+# 默认排序配置, 与旧版 sort_server_name 的顺序一致
+DEFAULT_ORDERING = {
+    # 按顺序排列的地区, 名称中包含任一关键字即归入该地区
+    "regions": [
+        {"name": "新加坡", "keywords": ["新加坡"]},
+        {"name": "日本", "keywords": ["日本"]},
+        {"name": "香港", "keywords": ["香港"]},
+        {"name": "美国", "keywords": ["美国"]},
+    ],
+    # 地区相同时的次级排序键, 可选 multiplier / type / latency
+    "secondary": [],
+    # multiplier: 倍率从低到高 (asc) 或从高到低 (desc)
+    "multiplier_order": "asc",
+    # type: 按协议类型排序, 未列出的类型排在最后
+    "type_order": ["vless", "trojan", "hysteria2", "vmess", "ss"],
+    # 按地区自动生成 url-test / fallback 代理组
+    "region_groups": {
+        "enabled": False,
+        "type": "url-test",
+        "url": "http://www.gstatic.com/generate_204",
+        "interval": 300,
+        "tolerance": 50,
+        "suffix": "自动选择",
+    },
+}
+
+SECONDARY_KEYS = ("multiplier", "type", "latency")
+GROUP_TYPES = ("url-test", "fallback", "load-balance", "select")
+
+# 倍率标记: 先找 x2 / ×1.5 这样的前缀形式, 再找 2x / 3倍 这样的后缀形式,
+# 两者都要求前后不紧挨字母数字, 避免把节点编号 (香港 01 x2 中的 01) 当成倍率
+MULTIPLIER_PATTERNS = (
+    re.compile(r"(?<![\w.])[xX×]\s*(\d+(?:\.\d+)?)", re.ASCII),
+    re.compile(r"(?<![\w.])(\d+(?:\.\d+)?)\s*(?:[xX×](?!\w)|倍)", re.ASCII),
+)
+
+UNMATCHED = 999
+
+
+def default_ordering():
+    return copy.deepcopy(DEFAULT_ORDERING)
+
+
+def parse_multiplier(name: str) -> float:
+    """Traffic multiplier written in a node name, 1.0 when there is none
+
+    >>> parse_multiplier("香港 01 x2"), parse_multiplier("香港 02 ×1.5"), parse_multiplier("香港x0.5")
+    (2.0, 1.5, 0.5)
+    >>> parse_multiplier("日本 03 2x"), parse_multiplier("美国 04 3倍"), parse_multiplier("新加坡 05")
+    (2.0, 3.0, 1.0)
+    >>> sorted(["香港 05 x0.5", "香港 01 x3", "香港 02 x1"], key=parse_multiplier)
+    ['香港 05 x0.5', '香港 02 x1', '香港 01 x3']
+    """
+    for pattern in MULTIPLIER_PATTERNS:
+        match = pattern.search(name)
+        if match:
+            return float(match.group(1))
+    return 1.0
+
+
+def validate_ordering(ordering: dict):
+    """Raise ValueError when an ordering config cannot be compiled"""
+    if not isinstance(ordering.get("regions"), list):
+        raise ValueError("regions 必须是列表")
+    for region in ordering["regions"]:
+        if not region.get("name") or not region.get("keywords"):
+            raise ValueError("每个地区都需要 name 和 keywords")
+    for key in ordering.get("secondary") or []:
+        if key not in SECONDARY_KEYS:
+            raise ValueError(f"不支持的次级排序键: {key}")
+    group_type = (ordering.get("region_groups") or {}).get("type", "url-test")
+    if group_type not in GROUP_TYPES:
+        raise ValueError(f"不支持的代理组类型: {group_type}")
+    CompiledOrdering(ordering)
+
+
+class CompiledOrdering:
+    """Location keywords compiled into one regex alternation
+
+    Classifying a name is a single regex scan instead of one substring
+    search per keyword. When several regions appear in a name the one
+    listed first wins, as in the original priority map.
+    """
+
+    def __init__(self, ordering: dict):
+        self.ordering = ordering
+        self.regions = [region["name"] for region in ordering["regions"]]
+        self._priority = {}
+        for priority, region in enumerate(ordering["regions"]):
+            for keyword in region["keywords"]:
+                self._priority.setdefault(keyword, priority)
+        # 长关键字优先, 避免被其前缀抢先匹配
+        keywords = sorted(self._priority, key=len, reverse=True)
+        self.pattern = re.compile("|".join(map(re.escape, keywords))) if keywords else None
+        self.secondary = [key for key in ordering.get("secondary") or [] if key in SECONDARY_KEYS]
+        self.multiplier_sign = -1 if ordering.get("multiplier_order") == "desc" else 1
+        self.type_rank = {name: rank for rank, name in enumerate(ordering.get("type_order") or [])}
+
+    def region_of(self, name: str) -> int:
+        """Index of the region a name belongs to, UNMATCHED when none"""
+        if self.pattern is None:
+            return UNMATCHED
+        matches = self.pattern.findall(name)
+        if not matches:
+            return UNMATCHED
+        if len(matches) == 1:
+            return self._priority[matches[0]]
+        return min(self._priority[keyword] for keyword in matches)
+
+    def sort_key(self, proxy: dict, region: int, latency: Optional[Dict[str, float]] = None) -> tuple:
+        key = [region]
+        name = proxy["name"]
+        for secondary in self.secondary:
+            if secondary == "multiplier":
+                key.append(self.multiplier_sign * parse_multiplier(name))
+            elif secondary == "type":
+                key.append(self.type_rank.get(proxy.get("type"), len(self.type_rank)))
+            elif secondary == "latency":
+                key.append((latency or {}).get(name, math.inf))
+        key.append(name)
+        return tuple(key)
+
+    def arrange(self, proxies: List[dict], latency: Optional[Dict[str, float]] = None) -> Tuple[List[dict], List[dict]]:
+        """Sort proxies and build per-region groups in one classification pass"""
+        region_of = self.region_of
+        if self.secondary:
+            keys = [self.sort_key(proxy, region_of(proxy["name"]), latency) for proxy in proxies]
+        else:
+            keys = [(region_of(proxy["name"]), proxy["name"]) for proxy in proxies]
+        keyed = sorted(zip(keys, proxies), key=lambda item: item[0])
+        proxies[:] = [proxy for _, proxy in keyed]
+        return proxies, self._region_groups(keyed)
+
+    def _region_groups(self, keyed) -> List[dict]:
+        settings = self.ordering.get("region_groups") or {}
+        if not settings.get("enabled"):
+            return []
+
+        members: Dict[int, List[str]] = {}
+        for key, proxy in keyed:
+            if key[0] != UNMATCHED:
+                members.setdefault(key[0], []).append(proxy["name"])
+
+        groups = []
+        for region, names in sorted(members.items()):
+            group = {
+                "name": f"{self.regions[region]} {settings.get('suffix', '自动选择')}".strip(),
+                "type": settings.get("type", "url-test"),
+                "proxies": names,
+            }
+            if group["type"] != "select":
+                group["url"] = settings.get("url", DEFAULT_ORDERING["region_groups"]["url"])
+                group["interval"] = settings.get("interval", 300)
+            if group["type"] == "url-test":
+                group["tolerance"] = settings.get("tolerance", 50)
+            groups.append(group)
+        return groups
+
+
+class OrderingEngine:
+    """Node ordering configured in data_dir/ordering.json, recompiled only when the file changes"""
+
+    def __init__(self, manager):
+        self.manager = manager
+        self._lock = threading.Lock()
+        self._version = None
+        self._compiled: Optional[CompiledOrdering] = None
+
+    def compiled(self) -> CompiledOrdering:
+        ordering_file = self.manager.ordering_file
+        ordering = ordering_file.view()
+        if self._compiled is None or ordering_file.version != self._version:
+            with self._lock:
+                if self._compiled is None or ordering_file.version != self._version:
+                    self._compiled = CompiledOrdering(ordering)
+                    self._version = ordering_file.version
+        return self._compiled
+
+    def arrange(self, proxies: List[dict], latency: Optional[Dict[str, float]] = None):
+        return self.compiled().arrange(proxies, latency)
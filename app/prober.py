@@ -0,0 +1,229 @@
+import asyncio
+import hashlib
+import json
+import math
+import ssl
+import time
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from .storage import JsonFile
+
+DEFAULT_PROBE = {
+    "enabled": False,
+    # 从输出中去掉探测失败的节点
+    "drop_dead": False,
+    # 对使用 TLS 的节点额外完成一次 TLS 握手
+    "tls": False,
+    "timeout": 3.0,
+    "concurrency": 64,
+    # 探测结果的有效期（秒）
+    "ttl": 600,
+}
+
+# 按延迟排序时的分档（毫秒）
+RTT_BUCKET = 50
+
+# 基于 UDP 的协议无法用 TCP 连接探测, 结果视为未知, 始终保留
+UDP_TYPES = frozenset(("hysteria", "hysteria2", "tuic", "wireguard"))
+
+
+def rtt_bucket(rtt: float) -> float:
+    """RTT rounded to RTT_BUCKET ms, so jitter between probe rounds does not reorder nodes"""
+    return round(rtt / RTT_BUCKET) * RTT_BUCKET
+
+
+def probe_settings(config: dict) -> dict:
+    return dict(DEFAULT_PROBE, **(config.get("probe") or {}))
+
+
+def endpoint(proxy: dict) -> Optional[str]:
+    """"server:port" key of a TCP-probeable proxy, None for UDP protocols or incomplete entries"""
+    if proxy.get("type") in UDP_TYPES or not proxy.get("server") or not proxy.get("port"):
+        return None
+    return f"{proxy['server']}:{proxy['port']}"
+
+
+def uses_tls(proxy: dict) -> bool:
+    return bool(proxy.get("tls")) or proxy.get("type") == "trojan"
+
+
+def _tls_context() -> ssl.SSLContext:
+    # 只测量握手耗时, 不校验证书, 自签名证书的节点同样可用
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    return context
+
+
+async def probe_endpoint(server: str, port: int, timeout: float, tls: bool = False,
+                         server_name: Optional[str] = None) -> dict:
+    """TCP connect (and optional TLS handshake) to server:port, returning {alive, rtt, error}"""
+    start = time.perf_counter()
+    writer = None
+    try:
+        _, writer = await asyncio.wait_for(
+            asyncio.open_connection(
+                server, int(port),
+                ssl=_tls_context() if tls else None,
+                server_hostname=(server_name or server) if tls else None
+            ),
+            timeout
+        )
+        return {"alive": True, "rtt": round((time.perf_counter() - start) * 1000, 1), "error": None}
+    except (OSError, asyncio.TimeoutError, ssl.SSLError, ValueError) as e:
+        return {"alive": False, "rtt": None, "error": type(e).__name__ if not str(e) else str(e)}
+    finally:
+        if writer is not None:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except (OSError, ssl.SSLError):
+                pass
+
+
+def cached_proxies(manager) -> List[dict]:
+    """Merged proxies of the enabled sources as last fetched, without touching the upstreams"""
+    from .sources import SourceCache, merge_proxies
+
+    cache = SourceCache(manager.data_dir)
+    results = []
+    for source in manager.subscription_sources():
+        result = cache.load(source) if source["enabled"] else None
+        if result is not None:
+            cache.fill(result)
+            results.append(result)
+    return merge_proxies(results)
+
+
+class Prober:
+    """Concurrent reachability and latency probes with a TTL cache in data_dir/probe_cache.json
+
+    Results are keyed by server:port, so the same node listed by several
+    subscriptions is probed once. Only the refresh leader probes; every
+    worker reads the shared cache to drop dead nodes and to order by RTT.
+    """
+
+    def __init__(self, manager):
+        self.manager = manager
+        self.cache = JsonFile(manager.data_dir / "probe_cache.json", dict)
+        # (缓存版本等, 失效时间, 版本)
+        self._version = None
+
+    def settings(self) -> dict:
+        return probe_settings(self.manager.config_view())
+
+    def _latency_ordering(self) -> bool:
+        return "latency" in (self.manager.ordering_file.view().get("secondary") or [])
+
+    def version(self) -> Optional[str]:
+        """Hash of what apply() feeds into the output, part of the output signature
+
+        Only the alive / dead set of the fresh results and, when nodes are
+        ordered by latency, their RTT buckets count: a probe round that
+        confirms the same results does not force a rebuild, a new snapshot
+        and a new ETag.
+        """
+        settings = self.settings()
+        if not settings["enabled"]:
+            return None
+        latency = self._latency_ordering()
+        if not settings["drop_dead"] and not latency:
+            # 探测结果不影响输出
+            return ""
+
+        cached = self.cache.view()
+        now = datetime.now().timestamp()
+        key = (self.cache.version, latency, settings["ttl"])
+        if self._version is not None and self._version[0] == key and now < self._version[1]:
+            return self._version[2]
+        fresh = self.fresh(cached, now, settings["ttl"])
+        material = sorted(
+            [name, result["alive"], rtt_bucket(result["rtt"]) if latency and result["alive"] else None]
+            for name, result in fresh.items()
+        )
+        version = hashlib.sha256(json.dumps(material).encode("utf-8")).hexdigest()
+        # 最早过期的结果失效时输出会变化, 到时重新计算
+        expires_at = min((result["checked_at"] + settings["ttl"] for result in fresh.values()), default=math.inf)
+        self._version = (key, expires_at, version)
+        return version
+
+    def _fresh(self, result: Optional[dict], now: float, ttl: float) -> bool:
+        return bool(result) and result.get("checked_at", 0) + ttl > now
+
+    def fresh(self, cached: Dict[str, dict], now: float, ttl: float) -> Dict[str, dict]:
+        """Results still within their TTL; older ones count as not probed"""
+        return {key: result for key, result in cached.items() if self._fresh(result, now, ttl)}
+
+    async def probe(self, proxies: Iterable[dict], force: bool = False) -> Dict[str, dict]:
+        """Probe every endpoint whose cached result expired, returning the updated cache"""
+        settings = self.settings()
+        cached = self.cache.view()
+        now = datetime.now().timestamp()
+
+        targets: Dict[str, dict] = {}
+        for proxy in proxies:
+            key = endpoint(proxy)
+            if key and key not in targets and (force or not self._fresh(cached.get(key), now, settings["ttl"])):
+                targets[key] = proxy
+        if not targets:
+            return cached
+
+        semaphore = asyncio.Semaphore(max(1, int(settings["concurrency"])))
+
+        async def run(key: str, proxy: dict) -> Tuple[str, dict]:
+            tls = settings["tls"] and uses_tls(proxy)
+            server_name = proxy.get("sni") or proxy.get("servername")
+            async with semaphore:
+                result = await probe_endpoint(proxy["server"], proxy["port"], settings["timeout"], tls, server_name)
+            result["checked_at"] = now
+            return key, result
+
+        probed = dict(await asyncio.gather(*[run(key, proxy) for key, proxy in targets.items()]))
+
+        # 只保留仍在有效期内或刚探测过的结果, 防止文件随节点变化无限增长
+        merged = {key: value for key, value in cached.items() if self._fresh(value, now, settings["ttl"] * 2)}
+        merged.update(probed)
+        self.cache.save(merged)
+        return merged
+
+    def apply(self, proxies: List[dict]) -> Tuple[List[dict], Dict[str, float]]:
+        """(proxies without dead nodes when drop_dead is on, {name: rtt ms}) from the cached results"""
+        settings = self.settings()
+        if not settings["enabled"]:
+            return proxies, {}
+        # 过期的结果不再可信, 对应的节点按未探测处理
+        cached = self.fresh(self.cache.view(), datetime.now().timestamp(), settings["ttl"])
+        kept, latency = [], {}
+        for proxy in proxies:
+            result = cached.get(endpoint(proxy)) if endpoint(proxy) else None
+            if result is None:
+                kept.append(proxy)
+            elif result["alive"]:
+                kept.append(proxy)
+                # 与 version() 使用相同的分档, 版本不变时输出也不变
+                latency[proxy["name"]] = rtt_bucket(result["rtt"])
+            elif not settings["drop_dead"]:
+                kept.append(proxy)
+        if not kept:
+            # 全部探测失败更可能是本机网络问题, 不清空输出
+            return proxies, latency
+        return kept, latency
+
+    def stats(self) -> dict:
+        """Summary of the cached results for the UI"""
+        cached = self.cache.view()
+        alive = sorted(result["rtt"] for result in cached.values() if result.get("alive"))
+        return {
+            "total": len(cached),
+            "alive": len(alive),
+            "dead": len(cached) - len(alive),
+            "median_rtt": alive[len(alive) // 2] if alive else None,
+            "checked_at": max((result.get("checked_at", 0) for result in cached.values()), default=0),
+        }
+
+    def results(self) -> List[dict]:
+        """Cached results as rows, dead endpoints first then slowest first"""
+        rows = [dict(result, endpoint=key) for key, result in self.cache.view().items()]
+        rows.sort(key=lambda row: (row.get("alive", False), -(row.get("rtt") or 0)))
+        return rows
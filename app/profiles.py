@@ -0,0 +1,193 @@
+import asyncio
+import hashlib
+import json
+import re
+import threading
+from pathlib import Path
+from typing import Dict, Optional
+
+from .cache import LRUCache, RenderedCache, RenderedConfig, make_digest
+from .serialization import load_yaml
+from .storage import atomic_write
+
+# 方案可覆盖的端口字段
+PORT_KEYS = ("port", "socks-port", "mixed-port")
+
+
+def profile_version(profile: dict) -> str:
+    raw = json.dumps(profile, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    return hashlib.sha256(raw).hexdigest()[:16]
+
+
+def apply_profile(config: dict, profile: dict, rules_config: dict) -> dict:
+    """Derive a profile's config from the shared transformed config
+
+    A profile may filter proxies by name (include / exclude regex), replace
+    the rule list and override listening ports. Everything else is shared.
+    """
+    proxies = config.get("proxies") or []
+    include = profile.get("include")
+    exclude = profile.get("exclude")
+    if include:
+        pattern = re.compile(include)
+        proxies = [proxy for proxy in proxies if pattern.search(proxy["name"])]
+    if exclude:
+        pattern = re.compile(exclude)
+        proxies = [proxy for proxy in proxies if not pattern.search(proxy["name"])]
+
+    # 只移除被过滤掉的节点, 保留 DIRECT 和其它分组名
+    all_names = {proxy["name"] for proxy in config.get("proxies") or []}
+    removed_names = all_names - {proxy["name"] for proxy in proxies}
+    proxy_groups = []
+    for group in config.get("proxy-groups") or []:
+        members = [name for name in group.get("proxies", []) if name not in removed_names]
+        if group.get("proxies") and not members:
+            # 过滤后为空的分组 (如地区自动选择组) 整个移除
+            removed_names.add(group["name"])
+            continue
+        proxy_groups.append(dict(group, proxies=members))
+    proxy_groups = [
+        dict(group, proxies=[name for name in group["proxies"] if name not in removed_names])
+        for group in proxy_groups
+    ]
+
+    new_config = dict(config, proxies=proxies)
+    new_config["proxy-groups"] = proxy_groups
+    new_config["rules"] = profile.get("rules") or rules_config["rules"]
+    new_config["rule-providers"] = rules_config["rule_providers"]
+    for key in PORT_KEYS:
+        if key in profile:
+            new_config[key] = profile[key]
+    return new_config
+
+
+# 每个进程缓存最近一次解析的上游配置, 同一次刷新编译多个方案时只解析一次
+_base_lock = threading.Lock()
+_base = (None, None)
+
+
+def _parse_base(body: bytes) -> dict:
+    global _base
+    digest = make_digest(body)
+    with _base_lock:
+        if _base[0] != digest:
+            _base = (digest, load_yaml(body))
+        return _base[1]
+
+
+def publish_profile(path: Path, base_body: bytes, profile: dict, rules_config: dict):
+    """Compile a profile's output and write it with its compressed variants to path
+
+    Runs in the CPU pool, possibly in another process, so it only takes
+    plain data and renders through that process's config_manager.
+    """
+    from .config import config_manager
+
+    config = apply_profile(_parse_base(base_body), profile, rules_config)
+    body = config_manager.render_config(config)
+    cache = RenderedCache(path)
+    path.parent.mkdir(exist_ok=True)
+    # 先写压缩文件, 再写主文件, 读取方总能找到对应的压缩版本
+    cache.write_variants(body)
+    atomic_write(path, body)
+
+
+class ProfileCompiler:
+    """Compiled, serialized output per profile
+
+    Outputs are keyed by (profile, upstream version, rules version, profile
+    version). They are compiled in the CPU pool right after a refresh and
+    published to data_dir/profiles/<key>.yaml, so every worker serves them
+    by reading a file once into a size-bounded LRU. A request for an output
+    that is not published yet (e.g. a profile saved after the refresh)
+    awaits one compile in the pool, shared by concurrent requests; nothing
+    is compiled on the event loop.
+    """
+
+    def __init__(self, manager, cache: LRUCache = None):
+        self.manager = manager
+        self.dir = manager.data_dir / "profiles"
+        self.cache = cache or LRUCache()
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    def _profile(self, profile_name: Optional[str]) -> Optional[dict]:
+        profiles = self.manager.config_view().get("profiles") or {}
+        return profiles.get(profile_name) if profile_name else None
+
+    def key(self, profile_name: str, rendered: RenderedConfig) -> Optional[str]:
+        """Output key of profile_name, None when the profile no longer exists"""
+        version = self.manager.config_file.profile_versions.get(profile_name)
+        if version is None:
+            return None
+        raw = json.dumps([profile_name, rendered.etag, self.manager.rules_version, version], ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:32]
+
+    def path(self, key: str) -> Path:
+        return self.dir / f"{key}.yaml"
+
+    def published(self, profile_name: Optional[str], rendered: RenderedConfig) -> Optional[RenderedConfig]:
+        """Output of profile_name if it was already compiled, the base output without a profile
+
+        Only reads memory or the published file, never compiles.
+        """
+        key = self.key(profile_name, rendered) if self._profile(profile_name) else None
+        if key is None:
+            # 没有指定方案, 或者方案已被删除, 使用默认输出
+            return rendered
+        compiled = self.cache.get(key)
+        if compiled is None:
+            compiled = RenderedCache(self.path(key)).get()
+            if compiled is None:
+                return None
+            # 方案输出跟随上游配置的时间, 用于 X-Config-Age
+            compiled = RenderedConfig(body=compiled.body, etag=compiled.etag,
+                                      mtime=rendered.mtime, variants=compiled.variants)
+            self.cache.put(key, compiled)
+        return compiled
+
+    async def get(self, profile_name: Optional[str], rendered: RenderedConfig) -> RenderedConfig:
+        """Return the compiled output of profile_name for the given upstream version"""
+        compiled = self.published(profile_name, rendered)
+        if compiled is not None:
+            return compiled
+        await self.compile(profile_name, rendered)
+        compiled = self.published(profile_name, rendered)
+        if compiled is None:
+            raise Exception(f"配置方案 {profile_name} 编译后没有找到输出")
+        return compiled
+
+    async def compile(self, profile_name: str, rendered: RenderedConfig):
+        """Publish the output of profile_name in the CPU pool, joining a compile already in flight"""
+        from .offload import cpu_pool
+
+        key = self.key(profile_name, rendered)
+        profile = self._profile(profile_name)
+        if key is None or profile is None:
+            # 方案已被删除, 读取时回退到默认输出
+            return
+        future = self._inflight.get(key)
+        if future is None:
+            future = self._inflight[key] = asyncio.ensure_future(cpu_pool.run(
+                "profile", publish_profile, self.path(key), bytes(rendered.body),
+                profile, self.manager.rules_view()
+            ))
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # shield: 单个请求被取消时不影响其它等待者
+        await asyncio.shield(future)
+
+    async def warm(self, rendered: RenderedConfig):
+        """Compile every profile right after a refresh and remove outputs of older versions"""
+        profiles = self.manager.config_view().get("profiles") or {}
+        for profile_name in profiles:
+            try:
+                await self.get(profile_name, rendered)
+            except Exception as e:
+                print(f"编译配置方案 {profile_name} 失败: {e}")
+        current = {self.key(profile_name, rendered) for profile_name in profiles} - {None}
+        for path in self.dir.glob("*.yaml*") if self.dir.exists() else ():
+            # 以 . 开头的是其它进程正在写入的临时文件
+            if not path.name.startswith(".") and path.name.split(".", 1)[0] not in current:
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
@@ -0,0 +1,122 @@
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import time
+from pathlib import Path
+from typing import Optional
+
+DEFAULT_RATE_LIMIT = {
+    # 默认关闭: 多个客户端共用令牌或位于运营商 NAT 之后时, 下面的限制可能过严
+    "enabled": False,
+    # 每个令牌每分钟补充的请求数和桶容量, 正常客户端每次更新只请求一两次
+    "token_per_minute": 6,
+    "token_burst": 20,
+    # 每个客户端 IP, 同时限制猜测令牌的请求
+    "ip_per_minute": 12,
+    "ip_burst": 30,
+}
+
+# 共享表的槽位数和每个键最多探查的槽位
+SLOTS = 4096
+PROBES = 8
+# 键的哈希, 剩余令牌数, 上次更新时间, 写入时的每秒补充数和桶容量
+# 令牌和 IP 的桶共用一张表, 判断槽位能否复用时要按槽位自己的速率计算
+SLOT = struct.Struct("<Qdddd")
+
+
+def rate_limit_settings(config: dict) -> dict:
+    return dict(DEFAULT_RATE_LIMIT, **(config.get("rate_limit") or {}))
+
+
+def bucket_key(kind: str, value: str) -> int:
+    digest = hashlib.blake2b(f"{kind}:{value}".encode("utf-8"), digest_size=8).digest()
+    # 0 表示空槽位
+    return int.from_bytes(digest, "little") or 1
+
+
+class RateLimiter:
+    """Token buckets per access token and per client IP, shared by all workers
+
+    The buckets live in a fixed-size open-addressing table in
+    data_dir/ratelimit.bin that every worker maps; flock on the same file
+    serializes the read-modify-write of a bucket. A slot whose bucket has
+    been idle long enough to be full again is reused for new keys, so the
+    table never grows.
+    """
+
+    def __init__(self, manager, slots: int = SLOTS):
+        self.manager = manager
+        self.path: Path = manager.data_dir / "ratelimit.bin"
+        self.slots = slots
+        self._fd = None
+        self._map: Optional[mmap.mmap] = None
+
+    def settings(self) -> dict:
+        return rate_limit_settings(self.manager.config_view())
+
+    def _table(self) -> mmap.mmap:
+        if self._map is None:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            size = self.slots * SLOT.size
+            if os.fstat(fd).st_size != size:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                try:
+                    # 槽位数或槽位格式变化后旧表无法沿用, 清空重建
+                    if os.fstat(fd).st_size != size:
+                        os.ftruncate(fd, 0)
+                        os.ftruncate(fd, size)
+                finally:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+            self._fd = fd
+            self._map = mmap.mmap(fd, size)
+        return self._map
+
+    def _take(self, table: mmap.mmap, key: int, per_minute: float, burst: float, now: float) -> float:
+        """Take one token from the key's bucket, returning 0 or the seconds until one is available"""
+        rate = per_minute / 60
+        start = key % self.slots
+        reusable = None
+        for probe in range(PROBES):
+            offset = (start + probe) % self.slots * SLOT.size
+            stored, tokens, updated, stored_rate, stored_burst = SLOT.unpack_from(table, offset)
+            if stored == key:
+                tokens = min(burst, tokens + (now - updated) * rate)
+                break
+            if reusable is None and (stored == 0 or tokens + (now - updated) * stored_rate >= stored_burst):
+                reusable = offset
+        else:
+            # 新的键: 使用已经空闲的槽位, 没有时覆盖第一个探查到的槽位
+            offset = reusable if reusable is not None else start * SLOT.size
+            tokens = burst
+
+        if tokens >= 1:
+            SLOT.pack_into(table, offset, key, tokens - 1, now, rate, burst)
+            return 0.0
+        SLOT.pack_into(table, offset, key, tokens, now, rate, burst)
+        return (1 - tokens) / rate if rate > 0 else 60.0
+
+    def check(self, token: Optional[str], ip: Optional[str]) -> float:
+        """0 when the request may proceed, otherwise the seconds to wait before retrying
+
+        The IP bucket is always charged; the token bucket only for valid
+        tokens (pass None otherwise) and only when the IP was allowed.
+        """
+        settings = self.settings()
+        if not settings["enabled"]:
+            return 0.0
+        table = self._table()
+        now = time.time()
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            if ip:
+                wait = self._take(table, bucket_key("ip", ip), settings["ip_per_minute"], settings["ip_burst"], now)
+                if wait:
+                    return wait
+            if token:
+                return self._take(table, bucket_key("token", token),
+                                  settings["token_per_minute"], settings["token_burst"], now)
+            return 0.0
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
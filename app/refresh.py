@@ -0,0 +1,187 @@
+import asyncio
+from datetime import datetime
+from typing import Optional
+
+from .config import config_manager
+from .locks import FileLock
+from .profiles import ProfileCompiler
+
+
+class RefreshCoordinator:
+    """Single-flight refresh of the cached subscription
+
+    Inside a worker, concurrent callers share one in-flight future. Across
+    workers, a file lock in data_dir makes sure only one process talks to the
+    upstream at a time; whoever waited on the lock re-checks the cache first
+    and reuses the result written by the previous holder.
+    """
+
+    def __init__(self, manager=config_manager):
+        self.manager = manager
+        self.lock = FileLock(manager.data_dir / "refresh.lock")
+        self._inflight: Optional[asyncio.Future] = None
+
+    @property
+    def refreshing(self) -> bool:
+        return self._inflight is not None and not self._inflight.done()
+
+    async def refresh(self, force: bool = False, rebuild: bool = False, progress=None):
+        """Refresh the cache, joining an in-flight refresh when there is one
+
+        rebuild re-renders from the source caches even when no update is
+        due; sources are only re-fetched if their own interval expired.
+        progress is handed to refresh_config and only reports when this
+        call starts the refresh.
+        """
+        if not self.refreshing:
+            self._inflight = asyncio.ensure_future(self._run(force, rebuild, progress))
+        # shield: 单个请求被取消时不影响其它等待者
+        return await asyncio.shield(self._inflight)
+
+    async def _run(self, force: bool, rebuild: bool = False, progress=None):
+        from .incremental import refresh_config
+
+        requested_at = datetime.now().timestamp()
+        async with self.lock:
+            # 等锁期间其它进程可能已经完成了刷新
+            rendered = self.manager.load_rendered_proxy()
+            if rendered and not rebuild:
+                if force:
+                    if self.manager.config_view().get("last_update", 0) >= requested_at:
+                        return rendered
+                elif not self.manager.need_update():
+                    return rendered
+
+            rendered, changes = await refresh_config(self.manager, force=force, progress=progress)
+            if changes is not None:
+                # 输出有变化时立即在 CPU 池中编译各个配置方案, 请求只读取编译好的结果
+                await profile_compiler.warm(rendered)
+            return rendered
+
+
+# Create singleton instances per worker
+profile_compiler = ProfileCompiler(config_manager)
+refresh_coordinator = RefreshCoordinator()
+
+
+class RefreshScheduler:
+    """Background refresh loop run by a single elected worker
+
+    Every worker starts the loop, but only the one holding the scheduler
+    lock in data_dir refreshes; the others keep trying to take over, so a
+    crashed leader is replaced within one tick. Upstream failures keep the
+    last good cache and back off exponentially up to update_interval.
+    """
+
+    TICK = 5
+    MIN_RETRY_DELAY = 30
+    MIRROR_CHECK_INTERVAL = 60
+
+    def __init__(self, manager=config_manager, coordinator: RefreshCoordinator = None):
+        self.manager = manager
+        self.coordinator = coordinator or refresh_coordinator
+        self.leader_lock = FileLock(manager.data_dir / "scheduler.lock")
+        self.trigger_path = manager.data_dir / "refresh.request"
+        self.consecutive_failures = 0
+        self.last_error: Optional[str] = None
+        self._retry_at = 0.0
+        self._mirror_checked_at = 0.0
+        self._probed_at = 0.0
+        self._handled_trigger = self._trigger_mtime()
+        self._wakeup = asyncio.Event()
+
+    def _trigger_mtime(self) -> float:
+        try:
+            return self.trigger_path.stat().st_mtime
+        except FileNotFoundError:
+            return 0.0
+
+    def request_refresh(self):
+        """Ask the elected scheduler (possibly in another process) to refresh now"""
+        self.trigger_path.touch()
+        self._wakeup.set()
+
+    def _retry_delay(self, update_interval: float) -> float:
+        delay = self.MIN_RETRY_DELAY * (2 ** (self.consecutive_failures - 1))
+        return min(delay, max(update_interval, self.MIN_RETRY_DELAY))
+
+    async def tick(self):
+        """Refresh once if this process is the leader and a refresh is due"""
+        if not self.leader_lock.try_acquire():
+            return
+
+        await self.refresh_rule_mirror()
+        if not self.manager.subscription_sources():
+            return
+        await self.probe_proxies()
+
+        trigger_mtime = self._trigger_mtime()
+        forced = trigger_mtime > self._handled_trigger
+        now = datetime.now().timestamp()
+        if not forced and (now < self._retry_at or not self.manager.need_update()):
+            return
+
+        self._handled_trigger = trigger_mtime
+        try:
+            await self.coordinator.refresh(force=forced)
+        except Exception as e:
+            # 上游失败时保留上一次成功的缓存, 按指数退避重试
+            self.consecutive_failures += 1
+            self.last_error = str(e)
+            update_interval = self.manager.config_view().get("update_interval", 3600)
+            self._retry_at = now + self._retry_delay(update_interval)
+            print(f"后台刷新失败 ({self.consecutive_failures}): {e}")
+        else:
+            self.consecutive_failures = 0
+            self.last_error = None
+            self._retry_at = 0.0
+
+    async def probe_proxies(self):
+        """Re-probe expired endpoints and rebuild the output when the results changed"""
+        from .prober import cached_proxies
+
+        prober = self.manager.prober
+        settings = prober.settings()
+        if not settings["enabled"]:
+            return
+        now = datetime.now().timestamp()
+        # 有效期过半时重新探测, 保证输出使用的结果始终在有效期内
+        if now < self._probed_at + settings["ttl"] / 2:
+            return
+        self._probed_at = now
+
+        version = prober.version()
+        try:
+            await prober.probe(cached_proxies(self.manager))
+            if prober.version() != version and self.manager.load_rendered_proxy():
+                await self.coordinator.refresh(rebuild=True)
+        except Exception as e:
+            print(f"节点探测失败: {e}")
+
+    async def refresh_rule_mirror(self):
+        """Revalidate mirrored rule-provider lists, each on its own interval"""
+        if not self.manager.rule_mirror_settings()["enabled"] and self.manager.rule_mode() != "inline":
+            return
+        now = datetime.now().timestamp()
+        if now < self._mirror_checked_at + self.MIRROR_CHECK_INTERVAL:
+            return
+        self._mirror_checked_at = now
+        try:
+            await self.manager.ruleset_mirror.refresh()
+        except Exception as e:
+            print(f"规则集镜像更新失败: {e}")
+
+    async def run(self):
+        try:
+            while True:
+                await self.tick()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.TICK)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+        finally:
+            self.leader_lock.release()
+
+
+refresh_scheduler = RefreshScheduler()
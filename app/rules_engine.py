@@ -0,0 +1,424 @@
+import ipaddress
+import re
+import threading
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# 内置策略, 无需在代理组中定义
+BUILTIN_TARGETS = ("DIRECT", "REJECT", "REJECT-DROP", "PASS", "COMPATIBLE")
+
+DOMAIN_TYPES = ("DOMAIN", "DOMAIN-SUFFIX", "DOMAIN-KEYWORD", "DOMAIN-REGEX", "GEOSITE")
+IP_TYPES = ("IP-CIDR", "IP-CIDR6", "IP-SUFFIX", "IP-ASN", "GEOIP", "SRC-IP-CIDR", "SRC-GEOIP", "SRC-IP-ASN")
+PORT_TYPES = ("SRC-PORT", "DST-PORT", "IN-PORT", "IN-TYPE", "IN-USER", "IN-NAME")
+PROCESS_TYPES = ("PROCESS-NAME", "PROCESS-PATH", "PROCESS-NAME-REGEX", "PROCESS-PATH-REGEX", "UID")
+OTHER_TYPES = ("NETWORK", "DSCP", "RULE-SET", "SUB-RULE")
+LOGIC_TYPES = ("AND", "OR", "NOT")
+RULE_TYPES = frozenset(DOMAIN_TYPES + IP_TYPES + PORT_TYPES + PROCESS_TYPES + OTHER_TYPES + LOGIC_TYPES + ("MATCH",))
+
+# 允许 no-resolve 选项的规则类型
+RESOLVE_TYPES = frozenset(("IP-CIDR", "IP-CIDR6", "IP-SUFFIX", "IP-ASN", "GEOIP", "RULE-SET"))
+RULE_OPTIONS = frozenset(("no-resolve", "src"))
+
+
+@dataclass
+class Rule:
+    """One parsed rule line"""
+    index: int
+    raw: str
+    type: str
+    value: Optional[str]
+    target: str
+    options: Tuple[str, ...] = ()
+    # RULE-SET 展开后的条目指向原始规则
+    source: Optional[str] = None
+
+    @property
+    def no_resolve(self) -> bool:
+        return "no-resolve" in self.options
+
+
+@dataclass
+class Issue:
+    index: int
+    rule: str
+    level: str  # error / warning
+    kind: str  # invalid / unknown-target / duplicate / shadowed / unreachable
+    message: str
+    by: Optional[int] = None
+
+    def to_dict(self) -> dict:
+        return {
+            "index": self.index,
+            "rule": self.rule,
+            "level": self.level,
+            "kind": self.kind,
+            "message": self.message,
+            "by": self.by,
+        }
+
+
+def split_rule(line: str) -> List[str]:
+    """Split on commas outside parentheses, so logic rules keep their sub-rules"""
+    parts, depth, current = [], 0, []
+    for char in line:
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        if char == "," and depth == 0:
+            parts.append("".join(current).strip())
+            current = []
+        else:
+            current.append(char)
+    parts.append("".join(current).strip())
+    return parts
+
+
+def parse_rule(index: int, line: str) -> Rule:
+    """Parse a rule line, raising ValueError for malformed rules"""
+    parts = split_rule(line.strip())
+    rule_type = parts[0].upper()
+    if rule_type not in RULE_TYPES:
+        raise ValueError(f"未知的规则类型: {parts[0]}")
+    if rule_type == "MATCH":
+        if len(parts) != 2 or not parts[1]:
+            raise ValueError("MATCH 规则格式应为 MATCH,代理方式")
+        return Rule(index, line, rule_type, None, parts[1])
+    if len(parts) < 3 or not parts[1] or not parts[2]:
+        raise ValueError("规则格式应为 类型,匹配内容,代理方式[,选项]")
+
+    options = tuple(parts[3:])
+    for option in options:
+        if option not in RULE_OPTIONS:
+            raise ValueError(f"未知的规则选项: {option}")
+    if "no-resolve" in options and rule_type not in RESOLVE_TYPES:
+        raise ValueError(f"{rule_type} 不支持 no-resolve")
+
+    value = parts[1]
+    if rule_type in ("IP-CIDR", "IP-CIDR6", "SRC-IP-CIDR"):
+        try:
+            network = ipaddress.ip_network(value, strict=False)
+        except ValueError:
+            raise ValueError(f"无效的 IP 段: {value}")
+        if rule_type == "IP-CIDR6" and network.version != 6:
+            raise ValueError(f"IP-CIDR6 需要 IPv6 地址段: {value}")
+        value = str(network)
+    elif rule_type == "DOMAIN-REGEX":
+        try:
+            re.compile(value)
+        except re.error as e:
+            raise ValueError(f"无效的正则表达式: {e}")
+    elif rule_type in ("DOMAIN", "DOMAIN-SUFFIX", "DOMAIN-KEYWORD"):
+        value = value.lower().rstrip(".")
+    return Rule(index, line, rule_type, value, parts[2], options)
+
+
+class DomainTrie:
+    """Trie over reversed domain labels: com -> google -> www
+
+    Each node keeps the first rule index of a DOMAIN (exact) and a
+    DOMAIN-SUFFIX ending there, so both shadowing checks and lookups walk
+    at most one path per label.
+    """
+
+    def __init__(self):
+        self.root = {}
+
+    @staticmethod
+    def _labels(domain: str):
+        return reversed(domain.split("."))
+
+    def add(self, domain: str, suffix: bool, index: int):
+        node = self.root
+        for label in self._labels(domain):
+            node = node.setdefault(label, {})
+        key = "#suffix" if suffix else "#exact"
+        node.setdefault(key, index)
+
+    def first_match(self, domain: str) -> Optional[int]:
+        """Smallest rule index matching domain (suffixes on the path, exact at the leaf)"""
+        best = None
+        node = self.root
+        for label in self._labels(domain):
+            node = node.get(label)
+            if node is None:
+                return best
+            index = node.get("#suffix")
+            if index is not None and (best is None or index < best):
+                best = index
+        index = node.get("#exact")
+        if index is not None and (best is None or index < best):
+            best = index
+        return best
+
+    def covering_suffix(self, domain: str, include_self: bool) -> Optional[int]:
+        """Smallest index of a DOMAIN-SUFFIX that covers domain"""
+        best = None
+        node = self.root
+        labels = list(self._labels(domain))
+        for depth, label in enumerate(labels):
+            node = node.get(label)
+            if node is None:
+                return best
+            if depth == len(labels) - 1 and not include_self:
+                break
+            index = node.get("#suffix")
+            if index is not None and (best is None or index < best):
+                best = index
+        return best
+
+
+class CidrTree:
+    """Binary radix tree of IP prefixes keeping the first rule index per prefix"""
+
+    def __init__(self):
+        self.roots = {4: {}, 6: {}}
+
+    @staticmethod
+    def _bits(network) -> Iterable[int]:
+        value = int(network.network_address)
+        width = network.max_prefixlen
+        for i in range(network.prefixlen):
+            yield (value >> (width - 1 - i)) & 1
+
+    def add(self, network, index: int):
+        node = self.roots[network.version]
+        for bit in self._bits(network):
+            node = node.setdefault(bit, {})
+        node.setdefault("#", index)
+
+    def first_covering(self, network) -> Optional[int]:
+        """Smallest index of a stored prefix containing network"""
+        best = None
+        node = self.roots[network.version]
+        index = node.get("#")
+        if index is not None:
+            best = index
+        for bit in self._bits(network):
+            node = node.get(bit)
+            if node is None:
+                break
+            index = node.get("#")
+            if index is not None and (best is None or index < best):
+                best = index
+        return best
+
+
+def provider_entries(rule: Rule, entries: List[list]) -> List[Rule]:
+    """Typed rules of a compiled RULE-SET list, carrying the RULE-SET's index and target"""
+    expanded = []
+    for entry in entries:
+        entry_type, value = entry[0].upper(), entry[1]
+        if entry_type in ("DOMAIN", "DOMAIN-SUFFIX", "DOMAIN-KEYWORD"):
+            value = value.lower()
+        expanded.append(Rule(rule.index, rule.raw, entry_type, value, rule.target,
+                             tuple(entry[2:]) + rule.options, source=rule.value))
+    return expanded
+
+
+class RulesEngine:
+    """Parsed, indexed rule list used for validation, shadowing analysis and match queries"""
+
+    def __init__(self, lines: List[str], targets: Iterable[str] = (), providers: Optional[Dict[str, dict]] = None,
+                 provider_rules: Optional[Dict[str, List[list]]] = None):
+        self.rules: List[Rule] = []
+        self.issues: List[Issue] = []
+        self.targets = set(BUILTIN_TARGETS) | set(targets)
+        # None: 没有提供者列表, 不检查 RULE-SET 引用
+        self.providers = providers
+        # 已同步的规则集展开后的条目, 用于匹配查询
+        self.provider_rules = provider_rules or {}
+
+        self.domains = DomainTrie()
+        self.keywords: List[Tuple[str, int]] = []
+        self.regexes: List[Tuple[re.Pattern, int]] = []
+        # 带 / 不带 no-resolve 的 IP 规则分别建索引
+        self.cidrs = {False: CidrTree(), True: CidrTree()}
+        self.seen: Dict[tuple, int] = {}
+        self.match_index: Optional[int] = None
+
+        for index, line in enumerate(lines):
+            if not line.strip():
+                continue
+            try:
+                rule = parse_rule(index, line)
+            except ValueError as e:
+                self.issues.append(Issue(index, line, "error", "invalid", str(e)))
+                continue
+            self._check_target(rule)
+            self.rules.append(rule)
+            self._analyze(rule)
+
+    def _check_target(self, rule: Rule):
+        if rule.target not in self.targets:
+            self.issues.append(Issue(rule.index, rule.raw, "warning", "unknown-target",
+                                     f"代理方式 {rule.target} 不是已知的代理组或内置策略"))
+        if rule.type == "RULE-SET" and self.providers is not None and rule.value not in self.providers:
+            self.issues.append(Issue(rule.index, rule.raw, "error", "invalid",
+                                     f"规则提供者 {rule.value} 不存在"))
+
+    def _covered_by(self, rule: Rule) -> Optional[Tuple[str, int]]:
+        """(kind, earlier index) when an earlier rule always matches first"""
+        if self.match_index is not None:
+            return "unreachable", self.match_index
+        key = (rule.type, rule.value, rule.options)
+        if key in self.seen:
+            return "duplicate", self.seen[key]
+        if rule.type == "DOMAIN":
+            index = self.domains.first_match(rule.value)
+            if index is not None:
+                return "shadowed", index
+            for keyword, index in self.keywords:
+                if keyword in rule.value:
+                    return "shadowed", index
+        elif rule.type == "DOMAIN-SUFFIX":
+            index = self.domains.covering_suffix(rule.value, include_self=True)
+            if index is not None:
+                return "shadowed", index
+            for keyword, index in self.keywords:
+                if keyword in rule.value:
+                    return "shadowed", index
+        elif rule.type == "DOMAIN-KEYWORD":
+            for keyword, index in self.keywords:
+                if keyword in rule.value:
+                    return "shadowed", index
+        elif rule.type in ("IP-CIDR", "IP-CIDR6"):
+            network = ipaddress.ip_network(rule.value)
+            index = self.cidrs[False].first_covering(network)
+            if index is None and rule.no_resolve:
+                index = self.cidrs[True].first_covering(network)
+            if index is not None:
+                return "shadowed", index
+        return None
+
+    def _index(self, rule: Rule):
+        self.seen.setdefault((rule.type, rule.value, rule.options), rule.index)
+        if rule.type == "DOMAIN":
+            self.domains.add(rule.value, False, rule.index)
+        elif rule.type == "DOMAIN-SUFFIX":
+            self.domains.add(rule.value, True, rule.index)
+        elif rule.type == "DOMAIN-KEYWORD":
+            self.keywords.append((rule.value, rule.index))
+        elif rule.type == "DOMAIN-REGEX":
+            self.regexes.append((re.compile(rule.value), rule.index))
+        elif rule.type in ("IP-CIDR", "IP-CIDR6"):
+            try:
+                self.cidrs[rule.no_resolve].add(ipaddress.ip_network(rule.value, strict=False), rule.index)
+            except ValueError:
+                pass
+        elif rule.type == "MATCH" and self.match_index is None:
+            self.match_index = rule.index
+
+    def _analyze(self, rule: Rule):
+        covered = self._covered_by(rule)
+        if covered:
+            kind, by = covered
+            messages = {
+                "unreachable": f"位于第 {by + 1} 行的 MATCH 之后, 永远不会生效",
+                "duplicate": f"与第 {by + 1} 行重复",
+                "shadowed": f"已被第 {by + 1} 行的规则覆盖, 永远不会生效",
+            }
+            self.issues.append(Issue(rule.index, rule.raw, "warning", kind, messages[kind], by))
+            return
+
+        self._index(rule)
+        if rule.type == "RULE-SET" and rule.value in self.provider_rules:
+            for entry in provider_entries(rule, self.provider_rules[rule.value]):
+                if entry.type == "MATCH":
+                    continue
+                self._index(entry)
+
+    @property
+    def errors(self) -> List[Issue]:
+        return [issue for issue in self.issues if issue.level == "error"]
+
+    def match(self, host: Optional[str] = None, ip: Optional[str] = None) -> Optional[Rule]:
+        """First rule matching a request for host and/or ip
+
+        With only an ip the request is treated as an IP connection. With a
+        host (and optionally its resolved ip), IP rules marked no-resolve
+        are skipped, as Clash does for domain requests.
+        """
+        candidates = []
+        if host:
+            host = host.lower().rstrip(".")
+            index = self.domains.first_match(host)
+            if index is not None:
+                candidates.append(index)
+            candidates.extend(index for keyword, index in self.keywords if keyword in host)
+            candidates.extend(index for pattern, index in self.regexes if pattern.search(host))
+        if ip:
+            try:
+                address = ipaddress.ip_address(ip)
+            except ValueError:
+                raise ValueError(f"无效的 IP 地址: {ip}")
+            network = ipaddress.ip_network(address)
+            index = self.cidrs[False].first_covering(network)
+            if index is not None:
+                candidates.append(index)
+            if not host:
+                index = self.cidrs[True].first_covering(network)
+                if index is not None:
+                    candidates.append(index)
+        if self.match_index is not None:
+            candidates.append(self.match_index)
+        if not candidates:
+            return None
+        first = min(candidates)
+        return next(rule for rule in self.rules if rule.index == first)
+
+
+def known_targets(manager) -> set:
+    """Proxy group names the emitted config is going to contain"""
+    targets = {"🔰 节点选择", "🎯 不用代理"}
+    ordering = manager.ordering_file.view()
+    settings = ordering.get("region_groups") or {}
+    if settings.get("enabled"):
+        for region in ordering.get("regions") or []:
+            targets.add(f"{region['name']} {settings.get('suffix', '自动选择')}".strip())
+    return targets
+
+
+def build_engine(manager, rules: Optional[List[str]] = None,
+                 providers: Optional[Dict[str, dict]] = None) -> RulesEngine:
+    """RulesEngine over the saved (or given) rules and providers, with mirrored RULE-SET contents when available"""
+    rules_config = manager.rules_view()
+    if providers is None:
+        providers = rules_config["rule_providers"]
+    provider_rules = {}
+    for name, provider in providers.items():
+        rendered = manager.ruleset_mirror.get(name)
+        if rendered is not None:
+            provider_rules[name] = manager.inline_compiler.compiled_provider(
+                rendered.body, provider.get("behavior", "domain"))
+    return RulesEngine(
+        rules if rules is not None else rules_config["rules"],
+        targets=known_targets(manager),
+        providers=providers,
+        provider_rules=provider_rules
+    )
+
+
+class RulesEngineCache:
+    """Engine over the saved rules, rebuilt when rules, mirrored lists or region groups change"""
+
+    def __init__(self, manager):
+        self.manager = manager
+        self._lock = threading.Lock()
+        self._version = None
+        self._engine: Optional[RulesEngine] = None
+
+    def get(self) -> RulesEngine:
+        manager = self.manager
+        # view() 会在文件变化时重新加载并更新 version
+        manager.ordering_file.view()
+        version = (
+            manager.rules_version,
+            manager.ordering_file.version,
+            manager.inline_compiler.version(manager.rules_view()["rule_providers"])
+        )
+        with self._lock:
+            if version != self._version:
+                self._engine = build_engine(manager)
+                self._version = version
+            return self._engine
@@ -0,0 +1,147 @@
+import asyncio
+import json
+import re
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Optional
+
+from .cache import RenderedCache, RenderedConfig
+from .compression import compress_variants
+from .storage import atomic_write
+
+# 同时抓取的规则集数量上限
+MAX_PARALLEL_FETCHES = 4
+
+DEFAULT_MIRROR = {
+    "enabled": False,
+    # 是否把输出配置中的 rule-providers 地址改写为本服务
+    "rewrite": False,
+    # 客户端访问本服务的地址, 例如 http://192.168.1.2:8600
+    "public_url": "",
+}
+
+SAFE_NAME = re.compile(r"^[A-Za-z0-9_.-]+$")
+
+
+def mirror_settings(config: dict) -> dict:
+    return dict(DEFAULT_MIRROR, **(config.get("rule_mirror") or {}))
+
+
+def mirrorable(provider: dict) -> bool:
+    return provider.get("type") == "http" and bool(provider.get("url"))
+
+
+def rewrite_providers(rule_providers: dict, settings: dict) -> dict:
+    """Point http rule-providers at this server's /ruleset/<name> mirror"""
+    if not (settings.get("enabled") and settings.get("rewrite") and settings.get("public_url")):
+        return rule_providers
+    base_url = settings["public_url"].rstrip("/")
+    rewritten = {}
+    for name, provider in rule_providers.items():
+        if mirrorable(provider) and SAFE_NAME.match(name):
+            provider = dict(provider, url=f"{base_url}/ruleset/{name}")
+        rewritten[name] = provider
+    return rewritten
+
+
+class RuleSetMirror:
+    """Local copies of the rule-provider lists, stored in data_dir/ruleset
+
+    Each list is revalidated upstream with ETag / Last-Modified once per its
+    interval and served from memory with the same conditional GET and
+    pre-compressed variants as the subscription itself.
+    """
+
+    def __init__(self, manager):
+        self.manager = manager
+        self.dir = manager.data_dir / "ruleset"
+        self._caches: Dict[str, RenderedCache] = {}
+
+    def _path(self, name: str) -> Path:
+        return self.dir / f"{name}.txt"
+
+    def _meta_path(self, name: str) -> Path:
+        return self.dir / f"{name}.meta.json"
+
+    def _cache(self, name: str) -> RenderedCache:
+        if name not in self._caches:
+            self._caches[name] = RenderedCache(self._path(name))
+        return self._caches[name]
+
+    def load_meta(self, name: str) -> dict:
+        try:
+            with open(self._meta_path(name), "rb") as f:
+                return json.loads(f.read())
+        except FileNotFoundError:
+            return {}
+
+    def get(self, name: str) -> Optional[RenderedConfig]:
+        """Mirrored list of a configured provider, None when unknown or not fetched yet"""
+        provider = self.manager.rules_view()["rule_providers"].get(name)
+        if not provider or not mirrorable(provider) or not SAFE_NAME.match(name):
+            return None
+        return self._cache(name).get()
+
+    def status(self) -> Dict[str, dict]:
+        """Meta information of every mirrored list, for the UI"""
+        return {
+            name: self.load_meta(name)
+            for name, provider in self.manager.rules_view()["rule_providers"].items()
+            if mirrorable(provider) and SAFE_NAME.match(name)
+        }
+
+    async def refresh_one(self, name: str, provider: dict, semaphore: asyncio.Semaphore,
+                          session=None, force: bool = False):
+        from .fetcher import fetch
+        from .offload import cpu_pool
+
+        meta = self.load_meta(name)
+        now = datetime.now().timestamp()
+        same_url = meta.get("url") == provider["url"]
+        if not force and same_url and meta.get("checked_at", 0) + provider.get("interval", 86400) > now:
+            return
+
+        try:
+            async with semaphore:
+                result = await fetch(
+                    provider["url"],
+                    session=session,
+                    etag=meta.get("etag") if same_url else None,
+                    last_modified=meta.get("last_modified") if same_url else None
+                )
+        except Exception as e:
+            meta["error"] = str(e)
+            meta["checked_at"] = now
+            atomic_write(self._meta_path(name), json.dumps(meta, ensure_ascii=False).encode("utf-8"))
+            print(f"规则集 {name} 更新失败: {e}")
+            return
+
+        if not result.not_modified:
+            cache = self._cache(name)
+            # 压缩在 CPU 池中进行, 不阻塞事件循环
+            variants = await cpu_pool.run("write", compress_variants, result.body)
+            cache.write_variants(result.body, variants)
+            atomic_write(self._path(name), result.body)
+            rendered = cache.prime(result.body, variants)
+            cache.cleanup_variants(rendered.etag.strip('"'))
+            meta = {
+                "url": provider["url"],
+                "etag": result.headers.get("etag"),
+                "last_modified": result.headers.get("last-modified"),
+                "updated_at": now,
+                "size": len(result.body),
+            }
+        meta["checked_at"] = now
+        meta.pop("error", None)
+        atomic_write(self._meta_path(name), json.dumps(meta, ensure_ascii=False).encode("utf-8"))
+
+    async def refresh(self, session=None, force: bool = False):
+        """Revalidate every due provider list concurrently"""
+        self.dir.mkdir(exist_ok=True)
+        semaphore = asyncio.Semaphore(MAX_PARALLEL_FETCHES)
+        providers = self.manager.rules_view()["rule_providers"]
+        await asyncio.gather(*[
+            self.refresh_one(name, provider, semaphore, session=session, force=force)
+            for name, provider in providers.items()
+            if mirrorable(provider) and SAFE_NAME.match(name)
+        ])
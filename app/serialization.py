@@ -0,0 +1,87 @@
+import threading
+
+import yaml
+
+# 优先使用 libyaml 的 C 实现, 未安装时退回纯 Python 版本
+try:
+    from yaml import CSafeLoader as SafeLoader, CSafeDumper as SafeDumper
+    LIBYAML = True
+except ImportError:  # pragma: no cover - depends on how PyYAML was built
+    from yaml import SafeLoader, SafeDumper
+    LIBYAML = False
+
+# 这两个字段只在保存规则时变化, 预先序列化后拼接到输出末尾
+RULE_KEYS = ("rule-providers", "rules")
+
+
+def load_yaml(stream):
+    """Parse YAML with the fastest available safe loader"""
+    if isinstance(stream, memoryview):
+        # 共享内存中的输出, 解析器只接受 bytes / str
+        stream = stream.tobytes()
+    return yaml.load(stream, Loader=SafeLoader)
+
+
+def dump_yaml(data, stream=None, **kwargs):
+    """Serialize YAML with the fastest available safe dumper"""
+    kwargs.setdefault("allow_unicode", True)
+    return yaml.dump(data, stream, Dumper=SafeDumper, **kwargs)
+
+
+def dump_rules(rule_providers, rules) -> bytes:
+    return dump_yaml({"rule-providers": rule_providers, "rules": rules}).encode("utf-8")
+
+
+class RulesFragment:
+    """Serialized rules + rule-providers section, rebuilt only when the rules version changes"""
+
+    def __init__(self, manager):
+        self.manager = manager
+        self._lock = threading.Lock()
+        self._version = None
+        self._fragment = b""
+
+    def version(self) -> tuple:
+        """Everything the serialized fragment depends on"""
+        settings = self.manager.rule_mirror_settings()
+        rule_mode = self.manager.rule_mode()
+        # 规则镜像的设置会改写 rule-providers 地址, 内联模式依赖规则集内容, 都要作为版本的一部分
+        version = (self.manager.rules_version, settings["enabled"], settings["rewrite"], settings["public_url"], rule_mode)
+        if rule_mode == "inline":
+            version += self.manager.inline_compiler.version(self.manager.rules_view()["rule_providers"])
+        return version
+
+    def get(self) -> bytes:
+        version = self.version()
+        if version != self._version:
+            with self._lock:
+                if version != self._version:
+                    rules_config = self.manager.rules_view()
+                    self._fragment = self._dump(rules_config["rule_providers"], rules_config["rules"])
+                    self._version = version
+        return self._fragment
+
+    def _dump(self, rule_providers, rules) -> bytes:
+        from .rulesets import rewrite_providers
+        if self.manager.rule_mode() == "inline":
+            rules, rule_providers = self.manager.inline_compiler.compile(rules or [], rule_providers)
+        return dump_rules(rewrite_providers(rule_providers, self.manager.rule_mirror_settings()), rules)
+
+    def render(self, config: dict) -> bytes:
+        """Serialize config, splicing in the cached rules fragment when the rules are the current ones
+
+        Keys are sorted as yaml.dump does, so only the rules section moves to
+        the end of the document; the parsed result is identical.
+        """
+        body = {key: value for key, value in config.items() if key not in RULE_KEYS}
+        rule_providers = config.get("rule-providers")
+        rules = config.get("rules")
+        if rule_providers is None and rules is None:
+            return dump_yaml(body).encode("utf-8")
+
+        rules_config = self.manager.rules_view()
+        if rules == rules_config["rules"] and rule_providers == rules_config["rule_providers"]:
+            fragment = self.get()
+        else:
+            fragment = self._dump(rule_providers or {}, rules)
+        return dump_yaml(body).encode("utf-8") + fragment
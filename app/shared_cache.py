@@ -0,0 +1,117 @@
+import json
+import mmap
+import os
+import struct
+import threading
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from .cache import RenderedCache, RenderedConfig, make_etag
+from .storage import atomic_writer
+
+SEGMENT_MAGIC = b"CLASHSEG"
+# magic, 代数, 配置文件的修改时间, 目录长度
+HEADER = struct.Struct("<8sQdI")
+GENERATION = struct.Struct("<Q")
+# 目录中未压缩正文的名称, 其它条目是 Content-Encoding
+IDENTITY = "identity"
+
+
+class SharedRenderedCache(RenderedCache):
+    """Rendered config published once into a memory-mapped segment shared by every worker
+
+    <cache>.seg holds a header, a JSON directory (etag and the offset of
+    the plain body and of each compressed variant) and the bytes. <cache>.gen
+    is an 8-byte generation counter that each worker keeps mapped, so a
+    request only compares two integers; after a refresh the counter moves
+    and the worker maps the new segment, without reading or parsing any
+    file. Bodies are memoryview slices of the mapping: all workers share the
+    same pages instead of holding one copy each on their heaps.
+
+    The segment lives next to cached_config.yaml rather than in /dev/shm,
+    which Docker limits to 64 MB by default.
+    """
+
+    def __init__(self, path: Path):
+        super().__init__(path)
+        self.segment_path = path.with_name(path.name + ".seg")
+        self.generation_path = path.with_name(path.name + ".gen")
+        self._counter: Optional[mmap.mmap] = None
+        self._generation = 0
+
+    def _counter_map(self) -> mmap.mmap:
+        if self._counter is None:
+            fd = os.open(self.generation_path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                if os.fstat(fd).st_size < GENERATION.size:
+                    os.ftruncate(fd, GENERATION.size)
+                self._counter = mmap.mmap(fd, GENERATION.size)
+            finally:
+                os.close(fd)
+        return self._counter
+
+    def generation(self) -> int:
+        """Generation of the most recently published segment, 0 when nothing was published yet"""
+        return GENERATION.unpack_from(self._counter_map())[0]
+
+    def _map_segment(self) -> Optional[Tuple[int, RenderedConfig]]:
+        try:
+            with open(self.segment_path, "rb") as f:
+                mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (FileNotFoundError, ValueError):
+            # ValueError: 空文件无法映射
+            return None
+        magic, generation, mtime, directory_size = HEADER.unpack_from(mapping)
+        if magic != SEGMENT_MAGIC:
+            return None
+        directory = json.loads(mapping[HEADER.size:HEADER.size + directory_size])
+        base = HEADER.size + directory_size
+        view = memoryview(mapping)
+        sections = {
+            name: view[base + offset:base + offset + length]
+            for name, (offset, length) in directory["sections"].items()
+        }
+        body = sections.pop(IDENTITY)
+        return generation, RenderedConfig(body=body, etag=directory["etag"], mtime=mtime, variants=sections)
+
+    def get(self) -> Optional[RenderedConfig]:
+        """Return the published config, mapping the segment again only when the generation moved"""
+        entry = self._entry
+        if entry is not None and self._generation and self._generation == self.generation():
+            return entry
+
+        with self._lock:
+            mapped = self._map_segment() if self.generation() else None
+            if mapped is not None:
+                self._generation, self._entry = mapped
+                return self._entry
+
+        # 还没有发布过（例如从旧版本升级）, 读取 cached_config.yaml 后发布一次
+        entry = super().get()
+        if entry is None:
+            return None
+        return self.publish(entry.body, entry.variants, entry.mtime)
+
+    def prime(self, body: bytes, variants: Dict[str, bytes]) -> RenderedConfig:
+        """Publish the config right after the file was written"""
+        return self.publish(body, variants, os.stat(self.path).st_mtime)
+
+    def publish(self, body: bytes, variants: Dict[str, bytes], mtime: float) -> RenderedConfig:
+        """Write a new segment, then move the generation counter so the other workers map it"""
+        sections = {IDENTITY: body, **variants}
+        offsets, offset = {}, 0
+        for name, data in sections.items():
+            offsets[name] = [offset, len(data)]
+            offset += len(data)
+        directory = json.dumps({"etag": make_etag(body), "sections": offsets}).encode("utf-8")
+
+        with self._lock:
+            generation = max(self.generation(), self._generation) + 1
+            with atomic_writer(self.segment_path) as f:
+                f.write(HEADER.pack(SEGMENT_MAGIC, generation, mtime, len(directory)))
+                f.write(directory)
+                for data in sections.values():
+                    f.write(data)
+            GENERATION.pack_into(self._counter_map(), 0, generation)
+            self._generation, self._entry = self._map_segment()
+            return self._entry
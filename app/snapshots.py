@@ -0,0 +1,162 @@
+import os
+import threading
+from datetime import datetime
+from typing import List, Optional
+
+from .cache import make_digest
+from .storage import JsonFile, atomic_write
+
+DEFAULT_SNAPSHOTS = {
+    # 保留的快照记录数
+    "retention": 20,
+    # 节点数少于该值的配置不会发布
+    "min_proxies": 1,
+    # 节点数比当前配置减少超过该比例时不发布, 0 表示不检查
+    "max_drop": 0.9,
+}
+
+# 代理组中除节点和其它代理组外允许引用的名称
+BUILTIN_PROXIES = frozenset(("DIRECT", "REJECT", "REJECT-DROP", "PASS", "COMPATIBLE"))
+
+
+def snapshot_settings(config: dict) -> dict:
+    return dict(DEFAULT_SNAPSHOTS, **(config.get("snapshots") or {}))
+
+
+def check_config(config: dict, settings: dict, previous_proxies: Optional[int] = None) -> List[str]:
+    """Reasons a transformed config must not be served, empty when it passes the gates"""
+    errors = []
+    proxies = config.get("proxies")
+    if not isinstance(proxies, list):
+        return ["proxies 不是列表"]
+    if len(proxies) < settings["min_proxies"]:
+        errors.append(f"节点数 {len(proxies)} 少于下限 {settings['min_proxies']}")
+    if previous_proxies and settings["max_drop"] and len(proxies) < previous_proxies * (1 - settings["max_drop"]):
+        errors.append(f"节点数从 {previous_proxies} 降到 {len(proxies)}, 超过允许的降幅 {settings['max_drop']:.0%}")
+
+    invalid = next((index for index, proxy in enumerate(proxies) if not isinstance(proxy, dict)
+                    or not all(proxy.get(key) for key in ("name", "type", "server", "port"))), None)
+    if invalid is not None:
+        errors.append(f"第 {invalid + 1} 个节点缺少 name / type / server / port")
+        return errors
+    names = {proxy["name"] for proxy in proxies}
+    if len(names) != len(proxies):
+        errors.append("节点名称重复")
+
+    groups = config.get("proxy-groups")
+    if not isinstance(groups, list) or not all(isinstance(group, dict) and group.get("name") for group in groups):
+        errors.append("proxy-groups 格式错误")
+    else:
+        known = names | {group["name"] for group in groups} | BUILTIN_PROXIES
+        for group in groups:
+            missing = [name for name in group.get("proxies") or [] if name not in known]
+            if missing:
+                errors.append(f"代理组 {group['name']} 引用了不存在的节点: {', '.join(map(str, missing[:5]))}")
+    if not isinstance(config.get("rules"), list):
+        errors.append("rules 不是列表")
+    return errors
+
+
+class SnapshotStore:
+    """Content-addressed outputs in data_dir/snapshots, with cached_config.yaml pointing at the served one
+
+    Every rendered output is stored once as snapshots/<digest>.yaml, so a
+    refresh that produces an output seen before costs no extra space.
+    cached_config.yaml is a relative symlink to the promoted snapshot:
+    promoting or rolling back replaces that link atomically instead of
+    rebuilding anything. snapshots/index.json lists the most recent
+    outputs, including the ones the sanity gates rejected.
+    """
+
+    def __init__(self, manager):
+        self.manager = manager
+        self.dir = manager.data_dir / "snapshots"
+        self.index = JsonFile(self.dir / "index.json", list, indent=2)
+        self._lock = threading.Lock()
+
+    def settings(self) -> dict:
+        return snapshot_settings(self.manager.config_view())
+
+    def path(self, digest: str):
+        return self.dir / f"{digest}.yaml"
+
+    def current(self) -> Optional[str]:
+        """Digest of the snapshot cached_config.yaml points at, None before the first snapshot"""
+        try:
+            target = os.readlink(self.manager.cache_path)
+        except OSError:
+            return None
+        return os.path.basename(target)[:-len(".yaml")]
+
+    def entries(self) -> List[dict]:
+        """Newest first, with the promoted one marked"""
+        current = self.current()
+        return [dict(entry, current=entry["digest"] == current) for entry in self.index.view()]
+
+    def store(self, config: dict, body: bytes) -> str:
+        """Store body, record it in the index and raise when it fails the sanity gates"""
+        digest = make_digest(body)
+        self.dir.mkdir(exist_ok=True)
+        if self.path(digest).exists():
+            # 相同的输出只保存一份, 更新时间用于计算配置的年龄
+            os.utime(self.path(digest))
+        else:
+            atomic_write(self.path(digest), body)
+
+        current = self.current()
+        previous = next((entry for entry in self.index.view() if entry["digest"] == current), None)
+        # 升级前的缓存没有快照记录, 使用上次刷新记录的节点数
+        previous_proxies = previous["proxies"] if previous else len(self.manager.refresh_state.view().get("proxies") or {})
+        errors = check_config(config, self.settings(), previous_proxies)
+        self._record({
+            "digest": digest,
+            "created_at": datetime.now().timestamp(),
+            "proxies": len(config.get("proxies") or []),
+            "size": len(body),
+            "status": "rejected" if errors else "accepted",
+            "errors": errors,
+        })
+        if errors:
+            raise Exception(f"新配置未通过检查, 继续使用当前配置: {'; '.join(errors)}")
+        return digest
+
+    def _record(self, entry: dict):
+        with self._lock:
+            # 同一份配置再次写入时替换原记录并移到最前, 保留数量按不同的配置计算
+            entries = [entry] + [item for item in self.index.load() if item["digest"] != entry["digest"]]
+            kept = entries[:max(1, int(self.settings()["retention"]))]
+            self.index.save(kept)
+            keep = {item["digest"] for item in kept} | {self.current()}
+            for path in self.dir.glob("*.yaml"):
+                if path.stem not in keep:
+                    path.unlink()
+
+    def digests(self) -> List[str]:
+        """Digests of the retained snapshots, whose compressed variants are kept too"""
+        digests = {entry["digest"] for entry in self.index.view() if entry["status"] == "accepted"}
+        return list(digests | {self.current()} - {None})
+
+    def point(self, digest: str):
+        """Atomically make cached_config.yaml a link to the snapshot"""
+        link = self.manager.cache_path
+        tmp = link.with_name(f".{link.name}.{os.getpid()}.link")
+        try:
+            tmp.unlink()
+        except FileNotFoundError:
+            pass
+        os.symlink(os.path.relpath(self.path(digest), link.parent), tmp)
+        os.replace(tmp, link)
+
+    def promote(self, digest: str):
+        """Serve an accepted snapshot again, e.g. to roll back a bad upstream change"""
+        entry = next((entry for entry in self.index.view() if entry["digest"] == digest), None)
+        if entry is None or not self.path(digest).exists():
+            raise Exception("快照不存在")
+        if entry["status"] != "accepted":
+            raise Exception("该快照未通过检查, 不能发布")
+        with open(self.path(digest), "rb") as f:
+            body = f.read()
+        cache = self.manager.rendered_cache
+        variants = cache.load_variants(body)
+        self.point(digest)
+        return cache.prime(body, variants)
@@ -0,0 +1,282 @@
+import asyncio
+import hashlib
+import json
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from .storage import atomic_write, atomic_writer
+
+# 同时抓取的订阅数量上限
+MAX_PARALLEL_FETCHES = 4
+# 单个订阅下载大小的默认上限, 可在 config.json 中用 max_upstream_bytes 覆盖
+MAX_UPSTREAM_BYTES = 32 * 1024 * 1024
+
+# 从上游配置中保留的基础字段, 合并时取第一个成功的订阅
+BASE_KEYS = ("port", "socks-port", "mode", "dns", "log-level", "external-controller")
+
+
+def normalize_sources(config: dict) -> List[dict]:
+    """Subscription sources of config.json, with the legacy single url mapped to one source"""
+    default_interval = config.get("update_interval", 3600)
+    max_bytes = int(config.get("max_upstream_bytes") or MAX_UPSTREAM_BYTES)
+    sources = config.get("subscriptions")
+    if not sources:
+        sources = [{"name": "默认订阅", "url": config.get("url", "")}] if config.get("url") else []
+
+    normalized = []
+    for source in sources:
+        url = (source.get("url") or "").strip()
+        if not url:
+            continue
+        normalized.append({
+            "name": source.get("name") or url,
+            "url": url,
+            "update_interval": int(source.get("update_interval") or default_interval),
+            "prefix": source.get("prefix") or "",
+            "enabled": source.get("enabled", True) is not False,
+            "max_bytes": max_bytes,
+        })
+    return normalized
+
+
+def source_id(source: dict) -> str:
+    return hashlib.sha1(source["url"].encode("utf-8")).hexdigest()[:16]
+
+
+@dataclass
+class SourceResult:
+    """Proxies of one subscription, either freshly fetched or from its cache entry
+
+    Results taken from the cache start with proxies=None; SourceCache.fill
+    reads them only when the merged output actually has to be rebuilt.
+    """
+    source: dict
+    proxies: Optional[List[dict]] = None
+    base: Optional[Dict] = None
+    fetched_at: float = 0
+    error: Optional[str] = None
+    from_cache: bool = False
+    # 上游原始内容的哈希, 内容未变时直接复用上次的解析结果
+    body_hash: str = ""
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    # 本次抓取是否得到了与上次不同的内容
+    changed: bool = False
+
+    @property
+    def ok(self) -> bool:
+        return self.fetched_at > 0
+
+
+class SourceCache:
+    """Per-subscription cache entries in data_dir/sources
+
+    <id>.json holds the parsed proxies, <id>.meta.json the small part that
+    changes on every check (fetch time, validators, body hash), so an
+    unchanged upstream only rewrites the meta file.
+    """
+
+    def __init__(self, data_dir: Path):
+        self.dir = data_dir / "sources"
+
+    def _path(self, source: dict) -> Path:
+        return self.dir / f"{source_id(source)}.json"
+
+    def _meta_path(self, source: dict) -> Path:
+        return self.dir / f"{source_id(source)}.meta.json"
+
+    def download_path(self, source: dict) -> Path:
+        return self.dir / f"{source_id(source)}.download"
+
+    def load(self, source: dict) -> Optional[SourceResult]:
+        """Cached result without its proxies, None when the source was never fetched"""
+        try:
+            with open(self._meta_path(source), "rb") as f:
+                meta = json.loads(f.read())
+        except FileNotFoundError:
+            if not self._path(source).exists():
+                return None
+            # 旧版缓存没有 meta 文件, 直接读取完整条目
+            result = SourceResult(source=source, from_cache=True)
+            self.fill(result)
+            return result
+        if meta.get("url") != source["url"] or not self._path(source).exists():
+            return None
+        return SourceResult(
+            source=source,
+            fetched_at=meta.get("fetched_at", 0),
+            from_cache=True,
+            body_hash=meta.get("body_hash", ""),
+            etag=meta.get("etag"),
+            last_modified=meta.get("last_modified")
+        )
+
+    def fill(self, result: SourceResult):
+        """Read the cached proxies of a result loaded without them"""
+        if result.proxies is not None:
+            return
+        with open(self._path(result.source), "rb") as f:
+            entry = json.loads(f.read())
+        result.proxies = entry["proxies"]
+        result.base = entry.get("base", {})
+        if not result.fetched_at:
+            result.fetched_at = entry.get("fetched_at", 0)
+            result.body_hash = entry.get("body_hash", "")
+
+    def save_meta(self, result: SourceResult):
+        self.dir.mkdir(exist_ok=True)
+        meta = {
+            "url": result.source["url"],
+            "fetched_at": result.fetched_at,
+            "body_hash": result.body_hash,
+            "etag": result.etag,
+            "last_modified": result.last_modified,
+        }
+        atomic_write(self._meta_path(result.source), json.dumps(meta, ensure_ascii=False).encode("utf-8"))
+
+    def save(self, result: SourceResult):
+        """Write the entry proxy by proxy instead of serializing it as one string"""
+        self.dir.mkdir(exist_ok=True)
+        header = {
+            "url": result.source["url"],
+            "fetched_at": result.fetched_at,
+            "body_hash": result.body_hash,
+            "base": result.base or {},
+        }
+        with atomic_writer(self._path(result.source)) as f:
+            f.write(json.dumps(header, ensure_ascii=False)[:-1].encode("utf-8"))
+            f.write(b', "proxies": [')
+            for index, proxy in enumerate(result.proxies or []):
+                if index:
+                    f.write(b", ")
+                f.write(json.dumps(proxy, ensure_ascii=False).encode("utf-8"))
+            f.write(b"]}")
+        self.save_meta(result)
+
+
+def file_digest(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def parse_download(cache: SourceCache, result: SourceResult, download_path: Path) -> SourceResult:
+    """Parse a downloaded body into result and save it as the source's cache entry"""
+    from .subscription_formats import read_subscription_file
+
+    result.proxies, result.base = read_subscription_file(download_path, BASE_KEYS)
+    result.changed = True
+    cache.save(result)
+    return result
+
+
+async def fetch_source(source: dict, cache: SourceCache, semaphore: asyncio.Semaphore,
+                       session=None, force: bool = False) -> SourceResult:
+    """Fetch one subscription, falling back to its last good cache entry on failure
+
+    The upstream is asked with If-None-Match / If-Modified-Since; a 304 or
+    a body hashing the same as last time only refreshes the meta file.
+    """
+    from .config import config_manager
+    from .fetcher import fetch
+    from .offload import cpu_pool
+
+    cached = cache.load(source)
+    now = datetime.now().timestamp()
+    if cached and not force and cached.fetched_at + source["update_interval"] > now:
+        return cached
+
+    # 先分块下载到文件, 再流式解析, 避免整个响应和完整的 YAML 文档同时驻留内存
+    download_path = cache.download_path(source)
+    try:
+        cache.dir.mkdir(exist_ok=True)
+        async with semaphore:
+            with config_manager.metrics.timer("fetch"):
+                response = await fetch(
+                    source["url"],
+                    session=session,
+                    etag=cached.etag if cached else None,
+                    last_modified=cached.last_modified if cached else None,
+                    path=download_path,
+                    max_bytes=source.get("max_bytes", MAX_UPSTREAM_BYTES)
+                )
+        if response.not_modified:
+            cached.fetched_at = now
+            cache.save_meta(cached)
+            return cached
+
+        config_manager.metrics.set("clash_upstream_response_bytes", response.size, source=source["name"])
+        result = SourceResult(
+            source=source,
+            fetched_at=now,
+            body_hash=file_digest(download_path),
+            etag=response.headers.get("etag"),
+            last_modified=response.headers.get("last-modified")
+        )
+        if cached and cached.body_hash == result.body_hash:
+            # 内容与上次相同, 跳过解析, 只更新抓取时间和校验信息
+            result.from_cache = True
+            cache.save_meta(result)
+            return result
+
+        with config_manager.metrics.timer("parse"):
+            # 解析和写缓存在 CPU 池中进行, 期间 worker 继续处理其它请求
+            return await cpu_pool.run("parse", parse_download, cache, result, download_path)
+    except Exception as e:
+        # 单个订阅失败不影响其它订阅, 使用上一次成功的结果
+        if cached:
+            cached.error = str(e)
+            return cached
+        return SourceResult(source=source, error=str(e))
+    finally:
+        try:
+            download_path.unlink()
+        except FileNotFoundError:
+            pass
+
+
+async def fetch_sources(sources: List[dict], cache: SourceCache, session=None,
+                        force: bool = False, concurrency: int = MAX_PARALLEL_FETCHES) -> List[SourceResult]:
+    """并发抓取所有启用的订阅"""
+    semaphore = asyncio.Semaphore(concurrency)
+    enabled = [source for source in sources if source["enabled"]]
+    return await asyncio.gather(*[
+        fetch_source(source, cache, semaphore, session=session, force=force)
+        for source in enabled
+    ])
+
+
+def merge_proxies(results: List[SourceResult]) -> List[dict]:
+    """Merge proxies of all sources into one pool
+
+    Nodes pointing at the same (server, port, type) are kept once, and name
+    collisions between different nodes get a numeric suffix because Clash
+    requires proxy names to be unique.
+    """
+    merged = []
+    seen_endpoints = set()
+    seen_names = set()
+    for result in results:
+        prefix = result.source.get("prefix", "")
+        for proxy in result.proxies:
+            endpoint = (proxy.get("server"), proxy.get("port"), proxy.get("type"))
+            if endpoint in seen_endpoints:
+                continue
+            seen_endpoints.add(endpoint)
+
+            name = f"{prefix}{proxy['name']}"
+            if name in seen_names:
+                index = 2
+                while f"{name} {index}" in seen_names:
+                    index += 1
+                name = f"{name} {index}"
+            seen_names.add(name)
+
+            if name != proxy["name"]:
+                proxy = dict(proxy, name=name)
+            merged.append(proxy)
+    return merged
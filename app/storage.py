@@ -0,0 +1,110 @@
+import copy
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+
+# mkstemp 创建的文件权限是 0600, 新文件改为按 umask 计算的默认权限; 只在导入时读取一次, os.umask 会影响整个进程
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+DEFAULT_MODE = 0o666 & ~_UMASK
+
+
+def _target_mode(path: Path) -> int:
+    """Mode of the file being replaced, the umask default for a new file"""
+    try:
+        return os.stat(path).st_mode & 0o7777
+    except FileNotFoundError:
+        return DEFAULT_MODE
+
+
+@contextmanager
+def atomic_writer(path: Path):
+    """Binary file object that replaces path on success, for content written in pieces
+
+    Readers in other processes see either the old or the new content, never
+    a half-written file; on error the temp file is removed.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            yield f
+            f.flush()
+            # 保持与直接写入相同的权限, 读取数据目录的其它进程或用户不受影响
+            os.fchmod(f.fileno(), _target_mode(path))
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def atomic_write(path: Path, data: bytes):
+    """Write data to a temp file in the same directory and rename it over path"""
+    with atomic_writer(path) as f:
+        f.write(data)
+
+
+def stat_key(path: Path) -> Optional[tuple]:
+    """(mtime, size, inode) of path, None when it does not exist"""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+class JsonFile:
+    """JSON document kept parsed in memory and reloaded only when the file changes"""
+
+    def __init__(self, path: Path, default: Callable[[], Any], indent: Optional[int] = None):
+        self.path = path
+        self.default = default
+        self.indent = indent
+        self._lock = threading.Lock()
+        self._key = None
+        self._data = None
+        self.version = ""
+
+    def _reload(self, key):
+        if key is None:
+            data = self.default()
+            raw = b""
+        else:
+            with open(self.path, "rb") as f:
+                raw = f.read()
+            data = json.loads(raw)
+        self._data = data
+        self._key = key
+        self.version = hashlib.sha256(raw).hexdigest()[:16]
+        self.on_reload(data)
+
+    def on_reload(self, data):
+        """Hook for subclasses to rebuild derived indexes"""
+
+    def view(self):
+        """Parsed document shared between callers, must not be modified"""
+        key = stat_key(self.path)
+        if self._data is None or key != self._key:
+            with self._lock:
+                if self._data is None or key != self._key:
+                    self._reload(key)
+        return self._data
+
+    def load(self):
+        """Private copy of the document that callers are free to modify"""
+        return copy.deepcopy(self.view())
+
+    def save(self, data):
+        raw = json.dumps(data, indent=self.indent, ensure_ascii=False).encode("utf-8")
+        atomic_write(self.path, raw)
+        with self._lock:
+            self._reload(stat_key(self.path))
@@ -0,0 +1,126 @@
+from typing import BinaryIO, Dict, Iterable, List, Tuple
+
+import yaml
+from yaml.events import (AliasEvent, DocumentStartEvent, MappingEndEvent, MappingStartEvent, ScalarEvent,
+                         SequenceEndEvent, SequenceStartEvent, StreamStartEvent)
+from yaml.nodes import MappingNode, ScalarNode, SequenceNode
+
+from .serialization import SafeLoader
+
+
+class SubscriptionReader:
+    """Event-based reader that keeps only `proxies` and a few top-level keys
+
+    The document is never built as a whole: each proxy is composed and
+    constructed on its own and every other top-level value is skipped event
+    by event. Anchored nodes inside skipped values are still composed so
+    that proxies can refer to them with aliases or merge keys.
+    """
+
+    def __init__(self, stream: BinaryIO, keys: Iterable[str] = ()):
+        self.loader = SafeLoader(stream)
+        self.keys = set(keys)
+        self.anchors: Dict[str, yaml.Node] = {}
+
+    def _compose(self, event) -> yaml.Node:
+        loader = self.loader
+        if isinstance(event, AliasEvent):
+            if event.anchor not in self.anchors:
+                raise Exception(f"订阅内容不是有效的 Clash 配置: 未定义的锚点 {event.anchor}")
+            return self.anchors[event.anchor]
+
+        if isinstance(event, ScalarEvent):
+            tag = event.tag
+            if tag is None or tag == "!":
+                tag = loader.resolve(ScalarNode, event.value, event.implicit)
+            node = ScalarNode(tag, event.value, event.start_mark, event.end_mark, style=event.style)
+        elif isinstance(event, SequenceStartEvent):
+            tag = event.tag
+            if tag is None or tag == "!":
+                tag = loader.resolve(SequenceNode, None, event.implicit)
+            node = SequenceNode(tag, [], event.start_mark, None, flow_style=event.flow_style)
+            if event.anchor is not None:
+                self.anchors[event.anchor] = node
+            while not loader.check_event(SequenceEndEvent):
+                node.value.append(self._compose(loader.get_event()))
+            node.end_mark = loader.get_event().end_mark
+        elif isinstance(event, MappingStartEvent):
+            tag = event.tag
+            if tag is None or tag == "!":
+                tag = loader.resolve(MappingNode, None, event.implicit)
+            node = MappingNode(tag, [], event.start_mark, None, flow_style=event.flow_style)
+            if event.anchor is not None:
+                self.anchors[event.anchor] = node
+            while not loader.check_event(MappingEndEvent):
+                key = self._compose(loader.get_event())
+                node.value.append((key, self._compose(loader.get_event())))
+            node.end_mark = loader.get_event().end_mark
+        else:
+            raise Exception("订阅内容不是有效的 Clash 配置")
+
+        if event.anchor is not None:
+            self.anchors[event.anchor] = node
+        return node
+
+    def _construct(self, node: yaml.Node):
+        return self.loader.construct_document(node)
+
+    def _skip(self, event):
+        """Consume a value without building it, except for anchored sub-nodes"""
+        if getattr(event, "anchor", None) is not None and not isinstance(event, AliasEvent):
+            self._compose(event)
+            return
+        if isinstance(event, (SequenceStartEvent, MappingStartEvent)):
+            end = SequenceEndEvent if isinstance(event, SequenceStartEvent) else MappingEndEvent
+            while not self.loader.check_event(end):
+                self._skip(self.loader.get_event())
+            self.loader.get_event()
+
+    def _proxies(self, event) -> List[dict]:
+        if not isinstance(event, SequenceStartEvent):
+            # proxies: null 或其它非列表值按没有节点处理
+            self._skip(event)
+            return []
+        proxies = []
+        while not self.loader.check_event(SequenceEndEvent):
+            proxy = self._construct(self._compose(self.loader.get_event()))
+            if isinstance(proxy, dict):
+                proxies.append(proxy)
+        self.loader.get_event()
+        return proxies
+
+    def read(self) -> Tuple[List[dict], dict]:
+        """(proxies, {key: value} for the requested top-level keys) of the first document"""
+        loader = self.loader
+        try:
+            if loader.check_event(StreamStartEvent):
+                loader.get_event()
+            if not loader.check_event(DocumentStartEvent):
+                raise Exception("订阅内容为空")
+            loader.get_event()
+            if not loader.check_event(MappingStartEvent):
+                raise Exception("订阅内容不是有效的 Clash 配置")
+            loader.get_event()
+
+            proxies, base = [], {}
+            while not loader.check_event(MappingEndEvent):
+                key_node = self._compose(loader.get_event())
+                key = key_node.value if isinstance(key_node, ScalarNode) else None
+                event = loader.get_event()
+                if key == "proxies":
+                    proxies = self._proxies(event)
+                elif key in self.keys:
+                    base[key] = self._construct(self._compose(event))
+                else:
+                    self._skip(event)
+            return proxies, base
+        except yaml.YAMLError as e:
+            raise Exception(f"订阅内容不是有效的 Clash 配置: {e}")
+        finally:
+            loader.dispose()
+
+
+def read_subscription(path, keys: Iterable[str] = ()) -> Tuple[List[dict], dict]:
+    """Stream a downloaded Clash subscription file into (proxies, base keys)"""
+    with open(path, "rb") as f:
+        return SubscriptionReader(f, keys).read()
@@ -0,0 +1,272 @@
+import base64
+import binascii
+import json
+import re
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, unquote, urlsplit
+
+# 识别格式时只看文件开头的这部分内容
+DETECT_BYTES = 4096
+
+BASE64_BODY = re.compile(rb"^[A-Za-z0-9+/=_\-\s]+$")
+URI_LINE = re.compile(rb"^\s*[a-z][a-z0-9+.-]*://", re.IGNORECASE)
+
+
+def detect_format(head: bytes) -> str:
+    """"clash", "uri" (one link per line) or "base64" (an encoded link list)"""
+    head = head.lstrip(b"\xef\xbb\xbf")
+    if URI_LINE.match(head):
+        return "uri"
+    if head.strip() and BASE64_BODY.match(head):
+        return "base64"
+    return "clash"
+
+
+def b64decode(data) -> bytes:
+    """Decode standard or url-safe base64 with or without padding"""
+    if isinstance(data, str):
+        data = data.encode("ascii")
+    data = b"".join(data.split())
+    data = data.replace(b"-", b"+").replace(b"_", b"/")
+    return base64.b64decode(data + b"=" * (-len(data) % 4), validate=True)
+
+
+def _name(fragment: str, server: str, port) -> str:
+    return unquote(fragment).strip() or f"{server}:{port}"
+
+
+def _flag(value: Optional[str]) -> bool:
+    return (value or "").lower() in ("1", "true", "yes")
+
+
+def _first(query: Dict[str, List[str]], key: str, default: str = "") -> str:
+    values = query.get(key)
+    return values[0] if values else default
+
+
+def transport_opts(proxy: dict, network: str, host: str, path: str, service_name: str = ""):
+    """Fill network and *-opts of a trojan / vless / vmess proxy"""
+    if not network or network == "tcp":
+        return
+    proxy["network"] = network
+    if network == "ws":
+        opts = {"path": path or "/"}
+        if host:
+            opts["headers"] = {"Host": host}
+        proxy["ws-opts"] = opts
+    elif network == "grpc":
+        proxy["grpc-opts"] = {"grpc-service-name": service_name or path}
+    elif network in ("h2", "http"):
+        opts = {"path": path or "/"}
+        if host:
+            opts["host"] = [host]
+        proxy["h2-opts"] = opts
+        proxy["network"] = "h2"
+
+
+def parse_ss(uri: str) -> dict:
+    """ss://base64(method:password)@host:port#name (SIP002) or ss://base64(method:password@host:port)#name"""
+    body, _, fragment = uri[5:].partition("#")
+    body, _, query = body.partition("?")
+    body = body.rstrip("/")
+    if "@" not in body:
+        body = b64decode(body).decode("utf-8")
+    userinfo, _, address = body.rpartition("@")
+    if ":" not in userinfo:
+        userinfo = b64decode(unquote(userinfo)).decode("utf-8")
+    cipher, _, password = unquote(userinfo).partition(":")
+    server, _, port = address.rpartition(":")
+    server = server.strip("[]")
+    proxy = {
+        "name": _name(fragment, server, port),
+        "type": "ss",
+        "server": server,
+        "port": int(port),
+        "cipher": cipher,
+        "password": password,
+        "udp": True,
+    }
+    plugin = _first(parse_qs(query), "plugin")
+    if plugin:
+        name, *options = unquote(plugin).split(";")
+        options = dict(option.partition("=")[::2] for option in options)
+        if name in ("obfs-local", "simple-obfs"):
+            proxy["plugin"] = "obfs"
+            proxy["plugin-opts"] = {"mode": options.get("obfs", "http"), "host": options.get("obfs-host", "")}
+        elif name == "v2ray-plugin":
+            proxy["plugin"] = "v2ray-plugin"
+            proxy["plugin-opts"] = {
+                "mode": options.get("mode", "websocket"),
+                "host": options.get("host", ""),
+                "path": options.get("path", "/"),
+                "tls": "tls" in options,
+            }
+    return proxy
+
+
+def parse_vmess(uri: str) -> dict:
+    """vmess://base64(json) in the v2rayN format"""
+    data = json.loads(b64decode(uri[8:].partition("#")[0]))
+    server, port = data["add"], int(data["port"])
+    proxy = {
+        "name": str(data.get("ps") or f"{server}:{port}"),
+        "type": "vmess",
+        "server": server,
+        "port": port,
+        "uuid": data["id"],
+        "alterId": int(data.get("aid") or 0),
+        "cipher": data.get("scy") or "auto",
+        "udp": True,
+    }
+    if data.get("tls") == "tls":
+        proxy["tls"] = True
+        if data.get("sni"):
+            proxy["servername"] = data["sni"]
+        if data.get("fp"):
+            proxy["client-fingerprint"] = data["fp"]
+    network = data.get("net") or "tcp"
+    if network == "tcp" and data.get("type") == "http":
+        proxy["network"] = "http"
+        proxy["http-opts"] = {"path": [data.get("path") or "/"], "headers": {"Host": [data.get("host") or server]}}
+    else:
+        transport_opts(proxy, network, data.get("host", ""), data.get("path", ""), data.get("path", ""))
+    return proxy
+
+
+def _split_url(uri: str):
+    parts = urlsplit(uri)
+    if not parts.hostname or not parts.port:
+        raise ValueError("缺少服务器地址或端口")
+    return parts, parse_qs(parts.query)
+
+
+def parse_trojan(uri: str) -> dict:
+    """trojan://password@host:port?sni=...&type=ws&path=...#name"""
+    parts, query = _split_url(uri)
+    proxy = {
+        "name": _name(parts.fragment, parts.hostname, parts.port),
+        "type": "trojan",
+        "server": parts.hostname,
+        "port": parts.port,
+        "password": unquote(parts.username or ""),
+        "udp": True,
+    }
+    sni = _first(query, "sni") or _first(query, "peer")
+    if sni:
+        proxy["sni"] = sni
+    if _flag(_first(query, "allowInsecure")):
+        proxy["skip-cert-verify"] = True
+    transport_opts(proxy, _first(query, "type"), _first(query, "host"), _first(query, "path"),
+                   _first(query, "serviceName"))
+    return proxy
+
+
+def parse_vless(uri: str) -> dict:
+    """vless://uuid@host:port?security=tls|reality&type=ws&flow=...#name"""
+    parts, query = _split_url(uri)
+    proxy = {
+        "name": _name(parts.fragment, parts.hostname, parts.port),
+        "type": "vless",
+        "server": parts.hostname,
+        "port": parts.port,
+        "uuid": unquote(parts.username or ""),
+        "udp": True,
+    }
+    security = _first(query, "security")
+    if security in ("tls", "reality"):
+        proxy["tls"] = True
+        if _first(query, "sni"):
+            proxy["servername"] = _first(query, "sni")
+        if _first(query, "fp"):
+            proxy["client-fingerprint"] = _first(query, "fp")
+    if security == "reality":
+        proxy["reality-opts"] = {"public-key": _first(query, "pbk"), "short-id": _first(query, "sid")}
+    if _first(query, "flow"):
+        proxy["flow"] = _first(query, "flow")
+    if _flag(_first(query, "allowInsecure")):
+        proxy["skip-cert-verify"] = True
+    transport_opts(proxy, _first(query, "type"), _first(query, "host"), _first(query, "path"),
+                   _first(query, "serviceName"))
+    return proxy
+
+
+def parse_hysteria2(uri: str) -> dict:
+    """hysteria2://auth@host:port/?sni=...&obfs=salamander&obfs-password=...#name (also hy2://)"""
+    parts, query = _split_url(uri)
+    proxy = {
+        "name": _name(parts.fragment, parts.hostname, parts.port),
+        "type": "hysteria2",
+        "server": parts.hostname,
+        "port": parts.port,
+        "password": unquote(parts.username or ""),
+    }
+    if _first(query, "sni"):
+        proxy["sni"] = _first(query, "sni")
+    if _flag(_first(query, "insecure")):
+        proxy["skip-cert-verify"] = True
+    if _first(query, "obfs"):
+        proxy["obfs"] = _first(query, "obfs")
+        proxy["obfs-password"] = _first(query, "obfs-password")
+    return proxy
+
+
+PARSERS: Dict[str, Callable[[str], dict]] = {
+    "ss": parse_ss,
+    "vmess": parse_vmess,
+    "trojan": parse_trojan,
+    "vless": parse_vless,
+    "hysteria2": parse_hysteria2,
+    "hy2": parse_hysteria2,
+}
+
+
+def parse_links(text: str) -> Tuple[List[dict], int]:
+    """Decode a link list into Clash proxies, returning (proxies, skipped line count)
+
+    Unknown schemes and malformed lines are skipped so that one bad node
+    does not drop the whole subscription.
+    """
+    proxies = []
+    skipped = 0
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        scheme, sep, _ = line.partition("://")
+        parser = PARSERS.get(scheme.lower()) if sep else None
+        if parser is None:
+            skipped += 1
+            continue
+        try:
+            proxies.append(parser(line))
+        except (ValueError, KeyError, TypeError, IndexError, UnicodeDecodeError, binascii.Error):
+            skipped += 1
+    return proxies, skipped
+
+
+def decode_subscription(body: bytes) -> Tuple[List[dict], int]:
+    """Proxies of a base64 or plain link-list subscription"""
+    if detect_format(body[:DETECT_BYTES]) == "base64":
+        try:
+            body = b64decode(body)
+        except (ValueError, binascii.Error):
+            raise Exception("订阅内容既不是 Clash 配置, 也不是有效的 base64 链接列表")
+    return parse_links(body.decode("utf-8", errors="replace"))
+
+
+def read_subscription_file(path, keys=()) -> Tuple[List[dict], dict]:
+    """(proxies, base keys) of a downloaded subscription in any supported format"""
+    from .streaming import SubscriptionReader
+
+    with open(path, "rb") as f:
+        head = f.read(DETECT_BYTES)
+        if detect_format(head) == "clash":
+            f.seek(0)
+            return SubscriptionReader(f, keys).read()
+        body = head + f.read()
+    proxies, skipped = decode_subscription(body)
+    if skipped:
+        print(f"订阅中有 {skipped} 行无法解析, 已跳过")
+    if not proxies:
+        raise Exception("订阅中没有可用的节点")
+    return proxies, {}
@@ -1,24 +1,14 @@
-import requests
-import yaml
+import asyncio
+from .serialization import load_yaml
 from typing import List, Dict
 import re
+from .ordering import CompiledOrdering, DEFAULT_ORDERING
+
+_default_ordering = CompiledOrdering(DEFAULT_ORDERING)
 
 def sort_server_name(name: str) -> tuple:
     """Sort server names by location priority and then alphabetically"""
-    priority_map = {
-        "新加坡": 0,
-        "日本": 1,
-        "香港": 2,
-        "美国": 3
-    }
-    
-    # Check for each location in the name
-    for location, priority in priority_map.items():
-        if location in name:
-            return (priority, name)
-    
-    # If no priority location found, return with lowest priority
-    return (999, name)
+    return (_default_ordering.region_of(name), name)
 
 # 定义默认规则
 DEFAULT_RULES = [
@@ -139,34 +129,38 @@ DEFAULT_RULE_PROVIDERS = {
     }
 }
 
-def fetch_and_transform_config(url: str) -> dict:
-    """获取并转换Clash配置"""
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7',
-        'Accept-Language': 'zh-CN,zh;q=0.9,en;q=0.8',
-        'Accept-Encoding': 'gzip, deflate, br',
-        'Connection': 'keep-alive'
-    }
-    response = requests.get(url, headers=headers)
-    if response.status_code != 200:
-        raise Exception(f"获取配置失败: {response.status_code}")
-    
-    # 加载原始配置
-    config = yaml.safe_load(response.text)
-    
-    # 保留原始代理
-    proxies = config.get("proxies", [])
-    
-    # 按名称排序代理
-    proxies.sort(key=lambda x: sort_server_name(x["name"]))
-    
-    # 创建新的代理组
+def parse_subscription(text: str) -> dict:
+    """解析上游返回的 Clash 配置, base64 或链接列表格式的订阅转换为只含 proxies 的配置"""
+    from .subscription_formats import DETECT_BYTES, decode_subscription, detect_format
+
+    body = text.encode("utf-8")
+    if detect_format(body[:DETECT_BYTES]) != "clash":
+        proxies, _ = decode_subscription(body)
+        return {"proxies": proxies}
+    config = load_yaml(text)
+    if not isinstance(config, dict):
+        raise Exception("订阅内容不是有效的 Clash 配置")
+    return config
+
+
+def sort_proxies(proxies: List[Dict]):
+    """按排序配置排列代理, 同时得到按地区生成的代理组
+
+    开启节点探测时按缓存的探测结果去掉失效节点, 并提供延迟用于 latency 排序
+    """
+    from .config import config_manager
+    proxies, latency = config_manager.prober.apply(proxies)
+    return config_manager.ordering_engine.arrange(proxies, latency)
+
+
+def build_proxy_groups(proxies: List[Dict], region_groups: List[Dict] = ()) -> List[Dict]:
+    """创建新的代理组"""
     proxy_groups = [{
         "name": "🔰 节点选择",
         "type": "select",
-        "proxies": [proxy["name"] for proxy in proxies]
+        "proxies": [group["name"] for group in region_groups] + [proxy["name"] for proxy in proxies]
     }]
+    proxy_groups.extend(region_groups)
     
     # 添加直连代理组
     proxy_groups.append({
@@ -174,24 +168,96 @@ def fetch_and_transform_config(url: str) -> dict:
         "type": "select",
         "proxies": ["DIRECT"]
     })
+    return proxy_groups
+
+
+def build_config(proxies: List[Dict], base: dict) -> dict:
+    """根据代理列表和上游基础配置生成新的Clash配置"""
+    from .config import config_manager
+    with config_manager.metrics.timer("sort"):
+        proxies, region_groups = sort_proxies(proxies)
+    with config_manager.metrics.timer("groups"):
+        proxy_groups = build_proxy_groups(proxies, region_groups)
     
     # 从配置管理器获取规则配置
-    from .config import config_manager
-    rules_config = config_manager.load_rules_config()
+    rules_config = config_manager.rules_view()
     
     # 创建新配置
     new_config = {
-        "port": config.get("port", 7890),
-        "socks-port": config.get("socks-port", 7891),
+        "port": base.get("port", 7890),
+        "socks-port": base.get("socks-port", 7891),
         "allow-lan": True,
-        "mode": config.get("mode", "rule"),
-        "dns": config.get("dns"),
-        "log-level": config.get("log-level", "info"),
-        "external-controller": config.get("external-controller", "127.0.0.1:9090"),
+        "mode": base.get("mode", "rule"),
+        "dns": base.get("dns"),
+        "log-level": base.get("log-level", "info"),
+        "external-controller": base.get("external-controller", "127.0.0.1:9090"),
         "proxies": proxies,
         "proxy-groups": proxy_groups,
         "rules": rules_config["rules"],
         "rule-providers": rules_config["rule_providers"]
     }
     
-    return new_config 
+    return new_config
+
+
+def transform_config(text: str) -> dict:
+    """转换Clash配置"""
+    # 加载原始配置
+    config = parse_subscription(text)
+    
+    # 保留原始代理
+    return build_config(config.get("proxies", []), config)
+
+
+async def fetch_source_results(sources, session=None, force: bool = False):
+    """并发抓取所有订阅, 返回可用的结果; 全部失败时抛出异常
+
+    sources 可以是单个订阅地址, 也可以是订阅列表
+    """
+    from .config import config_manager
+    from .sources import SourceCache, normalize_sources, fetch_sources
+
+    if isinstance(sources, str):
+        sources = normalize_sources({"url": sources})
+    if config_manager.rule_mode() == "inline":
+        # 内联模式需要规则集内容, 先同步到期的规则集
+        await config_manager.ruleset_mirror.refresh(session=session)
+    results = await fetch_sources(sources, SourceCache(config_manager.data_dir), session=session, force=force)
+    available = [result for result in results if result.ok]
+    if not available:
+        errors = "; ".join(f"{result.source['name']}: {result.error}" for result in results)
+        raise Exception(errors or "没有可用的订阅")
+
+    for result in results:
+        if result.error:
+            fallback = "使用上次缓存" if result.ok else "已跳过"
+            print(f"订阅 {result.source['name']} 获取失败, {fallback}: {result.error}")
+    return available
+
+
+def transform_results(results) -> dict:
+    """合并各订阅的节点并生成新的Clash配置"""
+    from .config import config_manager
+    from .sources import SourceCache, merge_proxies
+
+    cache = SourceCache(config_manager.data_dir)
+    for result in results:
+        cache.fill(result)
+    return build_config(merge_proxies(results), results[0].base)
+
+
+async def fetch_and_transform_config_async(sources, session=None, force: bool = False) -> dict:
+    """异步获取并转换Clash配置, 各订阅并发抓取后合并到同一个节点池"""
+    return transform_results(await fetch_source_results(sources, session=session, force=force))
+
+
+def fetch_and_transform_config(sources, force: bool = False) -> dict:
+    """获取并转换Clash配置（同步版本, 供 Streamlit 使用）"""
+    from .fetcher import create_session
+
+    async def run():
+        # 每次调用使用独立会话, 避免跨事件循环共享连接
+        async with create_session() as session:
+            return await fetch_and_transform_config_async(sources, session=session, force=force)
+
+    return asyncio.run(run())
@@ -0,0 +1,115 @@
+"""Peak memory of subscription ingestion: full document parse vs streaming reader
+
+    python benchmarks/ingest.py --sizes 10000 50000 --max-rss-mb 200
+
+Each mode runs in its own process so the VmHWM peak only covers that mode. The
+synthetic upstream also carries the kind of top-level keys we throw away
+(proxy groups listing every node, a long rule list). With --max-rss-mb the
+script exits non-zero when the streaming path exceeds the ceiling.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss 会继承 fork 出子进程的父进程的峰值, VmHWM 在 exec 后重新计算
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def write_upstream(path: Path, size: int):
+    from app.serialization import dump_yaml
+    from benchmarks.synthetic import make_subscription
+
+    subscription = make_subscription(size)
+    names = [proxy["name"] for proxy in subscription["proxies"]]
+    subscription["proxy-groups"] = [
+        {"name": f"group {i}", "type": "select", "proxies": names} for i in range(4)
+    ]
+    subscription["rules"] = [f"DOMAIN-SUFFIX,site{i}.example.com,group {i % 4}" for i in range(size)]
+    with open(path, "w", encoding="utf-8") as f:
+        dump_yaml(subscription, f)
+
+
+def child(mode: str, path: str) -> dict:
+    from app.sources import BASE_KEYS, SourceCache, SourceResult
+    from app.streaming import read_subscription
+    from app.utils import parse_subscription
+
+    baseline = peak_rss_mb()
+    start = time.perf_counter()
+    if mode == "full":
+        with open(path, encoding="utf-8") as f:
+            config = parse_subscription(f.read())
+        proxies = config.get("proxies") or []
+        base = {key: config[key] for key in BASE_KEYS if key in config}
+    else:
+        proxies, base = read_subscription(path, BASE_KEYS)
+    elapsed = time.perf_counter() - start
+    cache = SourceCache(Path(tempfile.mkdtemp(prefix="clash-bench-")))
+    cache.save(SourceResult(source={"url": path}, proxies=proxies, base=base, fetched_at=time.time()))
+    return {
+        "mode": mode,
+        "proxies": len(proxies),
+        "parse_seconds": round(elapsed, 3),
+        "baseline_rss_mb": round(baseline, 1),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+def run(mode: str, path: Path) -> dict:
+    output = subprocess.run(
+        [sys.executable, __file__, "--child", mode, str(path)],
+        check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 50000])
+    parser.add_argument("--max-rss-mb", type=float, help="fail when the streaming path peaks above this")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--child", nargs=2, metavar=("MODE", "PATH"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(child(*args.child)))
+        return
+
+    results = []
+    over_ceiling = False
+    with tempfile.TemporaryDirectory(prefix="clash-bench-") as tmp:
+        for size in args.sizes:
+            path = Path(tmp) / f"upstream-{size}.yaml"
+            write_upstream(path, size)
+            for mode in ("full", "streaming"):
+                result = run(mode, path)
+                result["body_bytes"] = os.path.getsize(path)
+                print(json.dumps(result, ensure_ascii=False))
+                results.append(result)
+                if mode == "streaming" and args.max_rss_mb and result["peak_rss_mb"] > args.max_rss_mb:
+                    over_ceiling = True
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"benchmark": "ingest", "results": results}, f, indent=2)
+    if over_ceiling:
+        print(f"streaming ingestion exceeded {args.max_rss_mb} MB", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
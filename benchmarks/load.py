@@ -0,0 +1,196 @@
+"""Load test of /link/<token> against a real Sanic server
+
+    python benchmarks/load.py --proxies 10000 --concurrency 50 --duration 10 --output load.json
+
+Starts server.py in a temporary data directory pointed at a local upstream
+stand-in, then drives it with concurrent aiohttp clients and reports cold
+start latency, p50/p99 latency, throughput, peak RSS and proportional set
+size (PSS, shared pages split between workers) of the server.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import aiohttp
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from benchmarks.synthetic import UpstreamStandIn  # noqa: E402
+
+TOKEN = "bench"
+
+
+def process_tree(pid: int) -> list:
+    pids = [pid]
+    for task in Path(f"/proc/{pid}/task").glob("*"):
+        try:
+            children = (task / "children").read_text().split()
+        except OSError:
+            continue
+        for child in children:
+            pids.extend(process_tree(int(child)))
+    return pids
+
+
+def peak_rss_mb(pid: int) -> float:
+    """Sum of VmHWM over the server process and its workers"""
+    total_kb = 0
+    for child in process_tree(pid):
+        try:
+            for line in Path(f"/proc/{child}/status").read_text().splitlines():
+                if line.startswith("VmHWM:"):
+                    total_kb += int(line.split()[1])
+        except OSError:
+            continue
+    return total_kb / 1024
+
+
+def pss_mb(pid: int) -> float:
+    """Sum of Pss over the server process and its workers; shared pages count once in total"""
+    total_kb = 0
+    for child in process_tree(pid):
+        try:
+            for line in Path(f"/proc/{child}/smaps_rollup").read_text().splitlines():
+                if line.startswith("Pss:"):
+                    total_kb += int(line.split()[1])
+        except OSError:
+            continue
+    return total_kb / 1024
+
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(q * (len(values) - 1))))
+    return values[index]
+
+
+async def wait_ready(base_url: str, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.monotonic() < deadline:
+            try:
+                async with session.get(base_url + "/") as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.1)
+    raise RuntimeError("server did not become ready")
+
+
+async def client(session, url: str, headers: dict, deadline: float, latencies: list, errors: list):
+    while time.monotonic() < deadline:
+        start = time.perf_counter()
+        try:
+            async with session.get(url, headers=headers) as response:
+                await response.read()
+                if response.status not in (200, 304):
+                    errors.append(response.status)
+                    continue
+        except aiohttp.ClientError as e:
+            errors.append(type(e).__name__)
+            continue
+        latencies.append(time.perf_counter() - start)
+
+
+async def drive(base_url: str, args) -> dict:
+    url = f"{base_url}/link/{TOKEN}"
+    connector = aiohttp.TCPConnector(limit=args.concurrency)
+    # auto_decompress=False: 只测服务端, 不把客户端解压时间算进去
+    async with aiohttp.ClientSession(connector=connector, auto_decompress=False) as session:
+        start = time.perf_counter()
+        async with session.get(url) as response:
+            body = await response.read()
+            etag = response.headers.get("ETag")
+        cold = time.perf_counter() - start
+
+        headers = {"Accept-Encoding": args.encoding}
+        if args.conditional and etag:
+            headers["If-None-Match"] = etag
+
+        latencies, errors = [], []
+        deadline = time.monotonic() + args.duration
+        started = time.perf_counter()
+        await asyncio.gather(*[
+            client(session, url, headers, deadline, latencies, errors)
+            for _ in range(args.concurrency)
+        ])
+        elapsed = time.perf_counter() - started
+
+    return {
+        "cold_first_response": round(cold, 4),
+        "body_bytes": len(body),
+        "requests": len(latencies),
+        "errors": len(errors),
+        "throughput_rps": round(len(latencies) / elapsed, 1),
+        "latency_p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "latency_p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "latency_mean_ms": round(statistics.fmean(latencies) * 1000, 2) if latencies else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--proxies", type=int, default=10000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--port", type=int, default=18000)
+    parser.add_argument("--encoding", default="identity", help="Accept-Encoding sent by the clients")
+    parser.add_argument("--conditional", action="store_true", help="send If-None-Match like a polling client")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    data_dir = Path(tempfile.mkdtemp(prefix="clash-load-"))
+    with UpstreamStandIn() as upstream:
+        (data_dir / "config.json").write_text(json.dumps({
+            "url": "",
+            "subscriptions": [{"name": "bench", "url": upstream.url(args.proxies)}],
+            "update_interval": 3600,
+            "last_update": 0,
+            "auth_tokens": [TOKEN],
+            # 压测的请求来自同一个令牌和 IP, 不限流
+            "rate_limit": {"enabled": False},
+        }))
+        env = dict(os.environ, DATA_DIR=str(data_dir), PORT=str(args.port), WORKER_COUNT=str(args.workers))
+        server = subprocess.Popen([sys.executable, "server.py"], cwd=ROOT, env=env,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            base_url = f"http://127.0.0.1:{args.port}"
+            spawned = time.perf_counter()
+            asyncio.run(wait_ready(base_url))
+            ready = time.perf_counter() - spawned
+            result = asyncio.run(drive(base_url, args))
+            result.update({
+                "benchmark": "load",
+                "proxies": args.proxies,
+                "workers": args.workers,
+                "concurrency": args.concurrency,
+                "encoding": args.encoding,
+                "conditional": args.conditional,
+                "startup_seconds": round(ready, 3),
+                "server_peak_rss_mb": round(peak_rss_mb(server.pid), 1),
+                "server_pss_mb": round(pss_mb(server.pid), 1),
+            })
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+
+    print(json.dumps(result, ensure_ascii=False))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""Event-loop lag while a refresh runs, per CPU pool executor
+
+    python benchmarks/loop_lag.py --proxies 50000 --executors thread process --output loop_lag.json
+
+Runs a full refresh (fetch, parse, transform, write) from a local upstream
+stand-in while a timer on the same event loop ticks every --interval
+seconds, and reports how late the timer woke up. This is the delay every
+other request on the worker would see during the refresh.
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import urllib.request
+from pathlib import Path
+
+# 使用临时数据目录, 不影响真实配置
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp(prefix="clash-bench-"))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import app.offload as offload  # noqa: E402
+from app.config import config_manager  # noqa: E402
+from app.fetcher import close_session  # noqa: E402
+from app.incremental import refresh_config  # noqa: E402
+from benchmarks.synthetic import UpstreamStandIn  # noqa: E402
+
+
+async def measure(interval: float) -> dict:
+    lags = []
+
+    async def tick():
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + interval
+            await asyncio.sleep(interval)
+            lags.append(loop.time() - expected)
+
+    ticker = asyncio.ensure_future(tick())
+    start = time.perf_counter()
+    _, entry = await refresh_config(config_manager, force=True)
+    duration = time.perf_counter() - start
+    ticker.cancel()
+    await close_session()
+    # 刷新一直占用事件循环时定时器一次也没有运行, 延迟就是整个刷新的时间
+    lags = lags or [duration]
+    return {
+        "refresh_seconds": round(duration, 3),
+        "proxies": entry["total"],
+        "lag_max_seconds": round(max(lags), 4),
+        "lag_p99_seconds": round(sorted(lags)[int(len(lags) * 0.99)], 4),
+        "lag_median_seconds": round(statistics.median(lags), 4),
+    }
+
+
+def run(kind: str, interval: float) -> dict:
+    # 每次都从空的订阅缓存开始, 保证完整执行解析和生成
+    shutil.rmtree(config_manager.data_dir / "sources", ignore_errors=True)
+    config_manager.refresh_state.save({"signature": "", "proxies": {}})
+    offload.cpu_pool = offload.CpuPool(kind=kind)
+    try:
+        return {"executor": kind, **asyncio.run(measure(interval))}
+    finally:
+        offload.cpu_pool.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--proxies", type=int, default=50000)
+    parser.add_argument("--executors", nargs="+", default=["thread", "process"], choices=["thread", "process"])
+    parser.add_argument("--interval", type=float, default=0.005, help="timer period in seconds")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    results = []
+    with UpstreamStandIn() as upstream:
+        config = config_manager.load_config()
+        config["subscriptions"] = [{"name": "bench", "url": upstream.url(args.proxies)}]
+        config_manager.save_config(config)
+        # 模拟服务在第一次请求时才生成订阅内容, 提前请求一次, 不计入刷新
+        urllib.request.urlopen(upstream.url(args.proxies)).read()
+        for kind in args.executors:
+            result = run(kind, args.interval)
+            print(json.dumps(result, ensure_ascii=False))
+            results.append(result)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"benchmark": "loop_lag", "proxies": args.proxies, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
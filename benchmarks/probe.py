@@ -0,0 +1,118 @@
+"""Node prober against local listener stand-ins
+
+    python benchmarks/probe.py --alive 200 --dead 50 --concurrency 64
+
+Starts one local TCP listener per alive node and points the dead nodes at
+closed ports. Checks that every node is classified correctly (UDP nodes
+are kept unprobed) and times a second run that is answered from the cache.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# 使用临时数据目录, 不影响真实配置
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp(prefix="clash-bench-"))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.config import config_manager  # noqa: E402
+
+
+class ListenerStandIn:
+    """Local TCP listener standing in for a proxy server"""
+
+    def __init__(self):
+        self.server = None
+
+    async def start(self) -> int:
+        async def close(reader, writer):
+            writer.close()
+
+        self.server = await asyncio.start_server(close, "127.0.0.1", 0)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+
+def closed_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def run(args) -> dict:
+    rng = random.Random(0)
+    listeners, proxies = [], []
+    for index in range(args.alive):
+        listener = ListenerStandIn()
+        port = await listener.start()
+        listeners.append(listener)
+        proxies.append({"name": f"alive {index:04d}", "type": "ss", "server": "127.0.0.1", "port": port})
+    for index in range(args.dead):
+        proxies.append({"name": f"dead {index:04d}", "type": "ss", "server": "127.0.0.1", "port": closed_port()})
+    proxies.append({"name": "udp node", "type": "hysteria2", "server": "127.0.0.1", "port": 1})
+    rng.shuffle(proxies)
+
+    config = config_manager.load_config()
+    config["probe"] = {"enabled": True, "drop_dead": True, "timeout": args.timeout,
+                       "concurrency": args.concurrency, "ttl": 600}
+    config_manager.save_config(config)
+    prober = config_manager.prober
+
+    start = time.perf_counter()
+    await prober.probe(proxies, force=True)
+    first = time.perf_counter() - start
+
+    start = time.perf_counter()
+    await prober.probe(proxies)
+    cached = time.perf_counter() - start
+
+    kept, latency = prober.apply(proxies)
+    for listener in listeners:
+        await listener.stop()
+
+    names = {proxy["name"] for proxy in kept}
+    correct = all(
+        (proxy["name"] in names) == (not proxy["name"].startswith("dead"))
+        for proxy in proxies
+    )
+    return {
+        "alive": args.alive,
+        "dead": args.dead,
+        "concurrency": args.concurrency,
+        "probe_seconds": round(first, 3),
+        "cached_seconds": round(cached, 4),
+        "classified_correctly": correct,
+        "measured": len(latency),
+        "stats": prober.stats(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--alive", type=int, default=200)
+    parser.add_argument("--dead", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--timeout", type=float, default=1.0)
+    parser.add_argument("--output", help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    print(json.dumps(result, ensure_ascii=False))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"benchmark": "probe", "results": [result]}, f, indent=2)
+    if not result["classified_correctly"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""Cold start of server.py until the first 200 from /link/<token>
+
+    python benchmarks/startup.py --proxies 10000 --runs 5 --workers 2 --output startup.json
+
+The first run starts without a cache, so its first response includes one
+refresh from a local upstream stand-in. The following runs restart the
+server over the cache written by the first one, which is what a container
+restart or a crashed server looks like, and report how long it takes until
+the subscription is served again.
+"""
+import argparse
+import json
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from benchmarks.synthetic import UpstreamStandIn  # noqa: E402
+
+TOKEN = "bench"
+# 第一次返回 200 后到停止服务之前的等待时间, 不计入结果
+STOP_GRACE = 1.0
+
+
+def first_ok(url: str, timeout: float = 120) -> float:
+    """Poll url until it answers 200, returning the monotonic time of that response"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=timeout) as response:
+                response.read()
+                if response.status == 200:
+                    return time.monotonic()
+        except (urllib.error.URLError, ConnectionError):
+            time.sleep(0.01)
+    raise RuntimeError("server did not answer 200")
+
+
+def start_once(data_dir: Path, args) -> float:
+    env = dict(os.environ, DATA_DIR=str(data_dir), PORT=str(args.port), WORKER_COUNT=str(args.workers))
+    spawned = time.monotonic()
+    # 独立的进程组, 出错时连同 Sanic 的 worker 一起结束
+    server = subprocess.Popen([sys.executable, "server.py"], cwd=ROOT, env=env, start_new_session=True,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        return first_ok(f"http://127.0.0.1:{args.port}/link/{TOKEN}") - spawned
+    finally:
+        stop(server)
+
+
+def stop(server: subprocess.Popen):
+    """Stop the server, killing its whole process group when it does not exit in time"""
+    # 已有缓存时 worker 可能在向 Sanic 主进程确认启动之前就返回了 200, 这时收到 SIGTERM
+    # 会让主进程一直等待确认; 等确认完成后再停止
+    time.sleep(STOP_GRACE)
+    server.terminate()
+    try:
+        server.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        pass
+    try:
+        os.killpg(server.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--proxies", type=int, default=10000)
+    parser.add_argument("--runs", type=int, default=5, help="restarts over the warm cache")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--port", type=int, default=18010)
+    parser.add_argument("--output", help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    data_dir = Path(tempfile.mkdtemp(prefix="clash-startup-"))
+    with UpstreamStandIn() as upstream:
+        (data_dir / "config.json").write_text(json.dumps({
+            "url": "",
+            "subscriptions": [{"name": "bench", "url": upstream.url(args.proxies)}],
+            "update_interval": 3600,
+            "last_update": 0,
+            "auth_tokens": [TOKEN],
+            # 压测的请求来自同一个令牌和 IP, 不限流
+            "rate_limit": {"enabled": False},
+        }))
+        without_cache = start_once(data_dir, args)
+        with_cache = [start_once(data_dir, args) for _ in range(args.runs)]
+
+    result = {
+        "benchmark": "startup",
+        "proxies": args.proxies,
+        "workers": args.workers,
+        "first_200_without_cache_seconds": round(without_cache, 3),
+        "first_200_seconds_median": round(statistics.median(with_cache), 3),
+        "first_200_seconds_min": round(min(with_cache), 3),
+        "runs": [round(value, 3) for value in with_cache],
+    }
+    print(json.dumps(result, ensure_ascii=False))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
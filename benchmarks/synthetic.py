@@ -0,0 +1,102 @@
+"""Synthetic Clash subscriptions for benchmarks"""
+import random
+
+import yaml
+
+LOCATIONS = [
+    "香港", "日本", "新加坡", "美国", "台湾", "韩国", "英国", "德国",
+    "法国", "荷兰", "加拿大", "澳大利亚", "俄罗斯", "印度", "土耳其", "阿根廷",
+]
+CITIES = ["", "东京", "大阪", "洛杉矶", "圣何塞", "首尔", "伦敦", "法兰克福"]
+TAGS = ["", "IPLC", "IEPL", "专线", "游戏", "流媒体"]
+TYPES = ["ss", "vmess", "trojan", "vless"]
+
+
+def make_proxy(index: int, rng: random.Random) -> dict:
+    location = rng.choice(LOCATIONS)
+    name = f"{location}{rng.choice(CITIES)} {rng.choice(TAGS)} {index:05d}".replace("  ", " ")
+    if rng.random() < 0.3:
+        name += f" x{rng.choice(['0.5', '1', '1.5', '2', '3'])}"
+    proxy_type = rng.choice(TYPES)
+    proxy = {
+        "name": name,
+        "type": proxy_type,
+        "server": f"node{index}.example{index % 37}.com",
+        "port": rng.randint(1000, 65000),
+        "udp": True,
+    }
+    if proxy_type == "ss":
+        proxy.update({"cipher": "aes-256-gcm", "password": f"pw{index:08x}"})
+    elif proxy_type == "vmess":
+        proxy.update({"uuid": f"{index:08x}-0000-4000-8000-000000000000", "alterId": 0,
+                      "cipher": "auto", "network": "ws", "ws-opts": {"path": "/ws"}})
+    else:
+        proxy.update({"password" if proxy_type == "trojan" else "uuid": f"{index:08x}-secret",
+                      "sni": f"sni{index}.example.com", "skip-cert-verify": False})
+    return proxy
+
+
+def make_subscription(count: int, seed: int = 0) -> dict:
+    rng = random.Random(seed)
+    return {
+        "port": 7890,
+        "socks-port": 7891,
+        "mode": "rule",
+        "log-level": "info",
+        "dns": {"enable": True, "nameserver": ["223.5.5.5", "119.29.29.29"]},
+        "proxies": [make_proxy(i, rng) for i in range(count)],
+        "proxy-groups": [{"name": "auto", "type": "select", "proxies": ["DIRECT"]}],
+        "rules": ["MATCH,DIRECT"],
+    }
+
+
+def make_subscription_text(count: int, seed: int = 0) -> str:
+    return yaml.dump(make_subscription(count, seed), allow_unicode=True)
+
+
+class UpstreamStandIn:
+    """Local HTTP server that plays the subscription provider
+
+    Every path /<count> returns a synthetic subscription with that many
+    proxies; bodies are generated once and kept in memory.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        import threading
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        bodies = {}
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                try:
+                    count = int(self.path.strip("/"))
+                except ValueError:
+                    self.send_error(404)
+                    return
+                if count not in bodies:
+                    bodies[count] = make_subscription_text(count).encode("utf-8")
+                body = bodies[count]
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *_):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def url(self, count: int) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/{count}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *_):
+        self.server.shutdown()
+        self.server.server_close()
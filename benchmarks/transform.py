@@ -0,0 +1,87 @@
+"""Per-stage timings of the subscription transform
+
+    python benchmarks/transform.py --sizes 1000 10000 50000 --output transform.json
+
+Stages are timed separately against a local upstream stand-in: fetch,
+parse, sort, proxy-group build and YAML serialization.
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# 使用临时数据目录, 不影响真实配置
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp(prefix="clash-bench-"))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.config import config_manager  # noqa: E402
+from app.fetcher import create_session, fetch_text  # noqa: E402
+from app.utils import build_config, build_proxy_groups, parse_subscription, sort_proxies  # noqa: E402
+from benchmarks.synthetic import UpstreamStandIn  # noqa: E402
+
+
+def peak_rss_mb() -> float:
+    # Linux 上 ru_maxrss 的单位是 KB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def fetch(url: str) -> str:
+    async with create_session() as session:
+        return await fetch_text(url, session=session)
+
+
+def timed(stages: dict, name: str, func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    stages[name] = round(time.perf_counter() - start, 4)
+    return result
+
+
+def run(upstream: UpstreamStandIn, size: int) -> dict:
+    stages = {}
+    start = time.perf_counter()
+    text = asyncio.run(fetch(upstream.url(size)))
+    stages["fetch"] = round(time.perf_counter() - start, 4)
+
+    config = timed(stages, "parse", parse_subscription, text)
+    proxies, region_groups = timed(stages, "sort", sort_proxies, config["proxies"])
+    timed(stages, "groups", build_proxy_groups, proxies, region_groups)
+    # build_config 重复排序已排好的列表, 只用于得到完整输出
+    new_config = build_config(proxies, config)
+    body = timed(stages, "serialize", config_manager.render_config, new_config)
+
+    return {
+        "proxies": size,
+        "body_bytes": len(text.encode("utf-8")),
+        "output_bytes": len(body),
+        "stages": stages,
+        "total": round(sum(stages.values()), 4),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--output", help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    results = []
+    with UpstreamStandIn() as upstream:
+        for size in args.sizes:
+            result = run(upstream, size)
+            print(json.dumps(result, ensure_ascii=False))
+            results.append(result)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"benchmark": "transform", "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""Before/after benchmark of the YAML parse and serialize stages
+
+    python benchmarks/yaml_pipeline.py --sizes 1000 10000
+"""
+import argparse
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import yaml
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.config import ConfigManager  # noqa: E402
+from app.serialization import LIBYAML, load_yaml  # noqa: E402
+from benchmarks.synthetic import make_subscription_text  # noqa: E402
+
+
+def best_of(func, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def run(size: int, repeat: int) -> dict:
+    manager = ConfigManager(Path(tempfile.mkdtemp()))
+    text = make_subscription_text(size)
+    config = load_yaml(text)
+    rules_config = manager.rules_view()
+    config["rules"] = rules_config["rules"]
+    config["rule-providers"] = rules_config["rule_providers"]
+
+    result = {
+        "proxies": size,
+        "libyaml": LIBYAML,
+        "parse_before": best_of(lambda: yaml.safe_load(text), repeat),
+        "parse_after": best_of(lambda: load_yaml(text), repeat),
+        "dump_before": best_of(lambda: yaml.dump(config, allow_unicode=True), repeat),
+        "dump_after": best_of(lambda: manager.render_config(config), repeat),
+    }
+    # 两种方式的输出解析后必须完全一致
+    assert yaml.safe_load(manager.render_config(config)) == yaml.safe_load(yaml.dump(config, allow_unicode=True))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    for size in args.sizes:
+        result = run(size, args.repeat)
+        print(json.dumps({key: round(value, 4) if isinstance(value, float) else value
+                          for key, value in result.items()}))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,42 +1,141 @@
 import asyncio
+import os
+import secrets
+import signal
+import sys
+import time
+
+# 服务端和界面的端口, 用于健康检查
+PORT = int(os.getenv('PORT', '8000'))
+UI_PORT = int(os.getenv('UI_PORT', '8501'))
+
+# 健康检查间隔、超时, 连续失败多少次后重启
+HEALTH_INTERVAL = 10
+HEALTH_TIMEOUT = 5
+HEALTH_FAILURES = 3
+# 启动后多久内不做健康检查
+START_GRACE = 30
+# 重启退避: 从 1 秒开始翻倍, 最长 60 秒; 稳定运行超过 STABLE_AFTER 后重置
+BACKOFF_MIN = 1
+BACKOFF_MAX = 60
+STABLE_AFTER = 60
+# 发送 SIGTERM 后等待退出的时间, 超时则 SIGKILL
+STOP_TIMEOUT = 15
+
+
+async def http_ok(port: int, path: str, timeout: float = HEALTH_TIMEOUT) -> bool:
+    """GET http://127.0.0.1:port/path answered with 200, without importing an HTTP client"""
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection('127.0.0.1', port), timeout)
+    except (OSError, asyncio.TimeoutError):
+        return False
+    try:
+        writer.write(f'GET {path} HTTP/1.0\r\nHost: 127.0.0.1\r\n\r\n'.encode())
+        await writer.drain()
+        status_line = await asyncio.wait_for(reader.readline(), timeout)
+        return status_line.split()[1:2] == [b'200']
+    except (OSError, asyncio.TimeoutError):
+        return False
+    finally:
+        writer.close()
+
+
+class Child:
+    """A supervised subprocess, restarted with backoff when it exits or stops answering health checks
+
+    Output is inherited rather than piped, so log lines go straight to the
+    container log without passing through this process.
+    """
+
+    def __init__(self, name: str, argv: list, port: int, health_path: str):
+        self.name = name
+        self.argv = argv
+        self.port = port
+        self.health_path = health_path
+        self.process = None
+        self.stopping = False
+        self.restarts = 0
+
+    def send(self, signum: int):
+        if self.process is not None and self.process.returncode is None:
+            self.process.send_signal(signum)
+
+    async def watch_health(self):
+        await asyncio.sleep(START_GRACE)
+        failures = 0
+        while True:
+            if await http_ok(self.port, self.health_path):
+                failures = 0
+            else:
+                failures += 1
+                print(f'{self.name} 健康检查失败 ({failures}/{HEALTH_FAILURES})', flush=True)
+                if failures >= HEALTH_FAILURES:
+                    await self.terminate()
+                    return
+            await asyncio.sleep(HEALTH_INTERVAL)
+
+    async def terminate(self):
+        self.send(signal.SIGTERM)
+        try:
+            await asyncio.wait_for(self.process.wait(), STOP_TIMEOUT)
+        except asyncio.TimeoutError:
+            self.send(signal.SIGKILL)
+            await self.process.wait()
+
+    async def run(self):
+        backoff = BACKOFF_MIN
+        while not self.stopping:
+            started = time.monotonic()
+            self.process = await asyncio.create_subprocess_exec(*self.argv)
+            print(f'{self.name} 已启动, pid {self.process.pid}', flush=True)
+            health = asyncio.create_task(self.watch_health())
+            try:
+                returncode = await self.process.wait()
+            finally:
+                health.cancel()
+            if self.stopping:
+                return
+            if time.monotonic() - started > STABLE_AFTER:
+                backoff = BACKOFF_MIN
+            self.restarts += 1
+            print(f'{self.name} 已退出 (code {returncode}), {backoff} 秒后重启', flush=True)
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, BACKOFF_MAX)
+
+    async def stop(self):
+        self.stopping = True
+        if self.process is not None and self.process.returncode is None:
+            await self.terminate()
 
-async def read_output(stream, prefix):
-    while True:
-        line = await stream.readline()
-        if not line:
-            break
-        print(f"{prefix}: {line.decode().strip()}")
 
 async def run_scripts():
-    # 运行 python server.py
-    process1 = await asyncio.create_subprocess_exec(
-        'python',
-        'server.py',
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.PIPE
+    if not os.getenv('ADMIN_TOKEN'):
+        # 未设置时生成随机的管理令牌, 只传给服务端和界面两个子进程; 服务端没有令牌时不提供管理接口
+        os.environ['ADMIN_TOKEN'] = secrets.token_urlsafe(32)
+    server = Child('Server', [sys.executable, 'server.py'], PORT, '/')
+    ui = Child(
+        'Streamlit',
+        [sys.executable, '-m', 'streamlit', 'run', 'ui.py', '--server.port', str(UI_PORT)],
+        UI_PORT,
+        '/_stcore/health'
     )
-    
-    # 运行 streamlit
-    process2 = await asyncio.create_subprocess_exec(
-        'python',
-        '-m',
-        'streamlit',
-        'run',
-        'ui.py',
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.PIPE
-    )
-    
-    # 创建读取输出的任务
-    tasks = [
-        asyncio.create_task(read_output(process1.stdout, "Server")),
-        asyncio.create_task(read_output(process1.stderr, "Server Error")),
-        asyncio.create_task(read_output(process2.stdout, "Streamlit")),
-        asyncio.create_task(read_output(process2.stderr, "Streamlit Error"))
-    ]
-    
-    # 等待所有任务完成
-    await asyncio.gather(*tasks)
+    children = [server, ui]
+
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    loop.add_signal_handler(signal.SIGTERM, stop.set)
+    loop.add_signal_handler(signal.SIGINT, stop.set)
+    # SIGHUP 转发给服务主进程, 由它无中断地逐个替换 worker
+    loop.add_signal_handler(signal.SIGHUP, server.send, signal.SIGHUP)
+
+    tasks = [asyncio.create_task(child.run()) for child in children]
+    await stop.wait()
+    print('正在停止...', flush=True)
+    await asyncio.gather(*(child.stop() for child in children))
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
 
 if __name__ == "__main__":
     asyncio.run(run_scripts())
@@ -1,19 +1,180 @@
+import asyncio
 import datetime
+import signal
+import time
 from sanic import Sanic, json, response
-from sanic.worker.manager import WorkerManager
-from functools import partial
 import os
-import yaml
-from app.utils import fetch_and_transform_config
+from app.refresh import refresh_coordinator, refresh_scheduler, profile_compiler
 from app.config import config_manager
+from app.cache import etag_matches
+from app.compression import choose_encoding
+from app.admin import ADMIN_TOKEN, admin
+from app.offload import cpu_pool
 
 # Sanic app configuration
 app = Sanic("ClashProxy")
 app.config.REQUEST_TIMEOUT = 300
 app.config.REQUEST_MAX_SIZE = 1000000000
+# 管理接口, 供 Streamlit 界面读写配置和触发刷新; 没有管理令牌时不注册
+if ADMIN_TOKEN:
+    app.blueprint(admin)
+else:
+    print("未设置 ADMIN_TOKEN, 不提供管理接口")
+
+# 每个 worker 定期写出自己的指标快照, /metrics 汇总所有 worker
+METRICS_FLUSH_INTERVAL = 10
+# 收到 SIGHUP 时主进程写入该文件, 由其中一个 worker 发起无中断重载
+RELOAD_REQUEST = config_manager.data_dir / "reload.request"
+RELOAD_CHECK_INTERVAL = 1
+# 定时器被唤醒的延迟就是每个请求在事件循环中额外等待的时间
+LOOP_LAG_INTERVAL = 0.5
+
+metrics = config_manager.metrics
+token_stats = config_manager.token_stats
 
 # Clash proxy configurations
 
+async def flush_metrics():
+    while True:
+        await asyncio.sleep(METRICS_FLUSH_INTERVAL)
+        metrics.flush()
+        # 令牌访问统计同样按批写出, 不在每个请求中写文件
+        token_stats.flush()
+
+async def monitor_loop_lag():
+    """Observe how late the event loop runs a timer, which stays low while refreshes run in the CPU pool"""
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + LOOP_LAG_INTERVAL
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        metrics.observe("clash_event_loop_lag_seconds", max(0.0, loop.time() - expected))
+
+async def watch_reload(app, started_at: float):
+    """Restart all workers one by one when a reload was requested after this worker started"""
+    while True:
+        await asyncio.sleep(RELOAD_CHECK_INTERVAL)
+        try:
+            requested_at = RELOAD_REQUEST.stat().st_mtime
+            if requested_at <= started_at:
+                # 本 worker 启动前的请求已经处理过了
+                RELOAD_REQUEST.unlink()
+                continue
+            # 只有成功删除请求文件的 worker 发起重载
+            RELOAD_REQUEST.unlink()
+        except FileNotFoundError:
+            continue
+        print(f"Worker {os.getpid()} 收到重载请求, 先启动新 worker 再停止旧 worker")
+        app.m.restart(all_workers=True, zero_downtime=True)
+
+@app.main_process_start
+async def handle_sighup(app, _):
+    # 由 main.py 转发或直接 kill -HUP 发给服务主进程
+    signal.signal(signal.SIGHUP, lambda *_: RELOAD_REQUEST.touch())
+
+@app.before_server_start
+async def warm_up(app, _):
+    """Load everything the first request needs before this worker accepts connections"""
+    started = time.perf_counter()
+    config_manager.config_view()
+    config_manager.rules_view()
+    rendered = config_manager.load_rendered_proxy()
+    # 进程池的子进程在后台启动, 第一次刷新时无需等待
+    cpu_pool.warm()
+    if rendered:
+        # 已发布的方案输出只需读取, 缺少的在 CPU 池中编译
+        await profile_compiler.warm(rendered)
+    print(f"Worker {os.getpid()} 预热完成, 用时 {time.perf_counter() - started:.3f}s")
+
+@app.after_server_start
+async def start_refresh_scheduler(app, _):
+    app.add_task(refresh_scheduler.run(), name="refresh_scheduler")
+    app.add_task(flush_metrics(), name="flush_metrics")
+    app.add_task(watch_reload(app, datetime.datetime.now().timestamp()), name="watch_reload")
+    app.add_task(monitor_loop_lag(), name="monitor_loop_lag")
+
+@app.before_server_stop
+async def stop_refresh_scheduler(app, _):
+    await app.cancel_task("refresh_scheduler", raise_exception=False)
+    await app.cancel_task("flush_metrics", raise_exception=False)
+    await app.cancel_task("watch_reload", raise_exception=False)
+    await app.cancel_task("monitor_loop_lag", raise_exception=False)
+    cpu_pool.shutdown()
+    metrics.flush()
+    token_stats.flush()
+
+@app.on_request
+async def start_timer(request):
+    request.ctx.started_at = time.perf_counter()
+
+@app.on_response
+async def record_request(request, response):
+    started_at = getattr(request.ctx, "started_at", None)
+    if started_at is None:
+        return
+    # 使用路由模板而不是实际路径, 避免令牌出现在标签中
+    route = request.route.path if request.route else "unmatched"
+    metrics.inc("clash_http_requests_total", route=route, method=request.method, status=response.status)
+    metrics.observe("clash_http_request_duration_seconds", time.perf_counter() - started_at, route=route)
+    token = getattr(request.ctx, "token", None)
+    if token:
+        token_stats.record(token, request.headers.get("user-agent", ""), response.status, len(response.body or b""))
+
+@app.after_server_stop
+async def close_upstream_session(*_):
+    # aiohttp 只在刷新时需要, 不在 worker 启动时导入
+    from app.fetcher import close_session
+    await close_session()
+
+def rendered_response(request, rendered, extra_headers: dict = None):
+    """Serve pre-rendered bytes, answering 304 when the client is up to date"""
+    # 根据 Accept-Encoding 选择预先压缩好的版本, 不在请求中压缩
+    encoding = choose_encoding(request.headers.get("accept-encoding"), rendered.variants)
+    body, etag = rendered.representation(encoding)
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "no-cache",
+        "Vary": "Accept-Encoding",
+        **(extra_headers or {}),
+    }
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return response.empty(status=304, headers=headers)
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return response.raw(
+        body,
+        content_type="text/plain; charset=utf-8",
+        headers=headers
+    )
+
+def subscription_response(request, rendered, cache_status: str):
+    """Serve the subscription with cache freshness headers"""
+    metrics.inc("clash_subscription_cache_total", status=cache_status)
+    return rendered_response(request, rendered, {
+        # 缓存新鲜度: HIT 表示在更新间隔内, STALE 表示正在等待后台刷新
+        "X-Cache-Status": cache_status,
+        "X-Config-Age": str(max(0, int(datetime.datetime.now().timestamp() - rendered.mtime))),
+    })
+
+def limited_response(request, token, retry_after: float):
+    """Answer a rate-limited poll: 304 when the client already has the current config, else 429"""
+    headers = {"Retry-After": str(max(1, int(retry_after + 0.999)))}
+    rendered = config_manager.load_rendered_proxy() if token else None
+    if rendered:
+        # 限流时不编译, 只与已经发布的方案输出比较
+        rendered = profile_compiler.published(config_manager.token_profile(token), rendered)
+    if rendered:
+        encoding = choose_encoding(request.headers.get("accept-encoding"), rendered.variants)
+        _, etag = rendered.representation(encoding)
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            metrics.inc("clash_rate_limited_total", response="304")
+            return response.empty(status=304, headers={"ETag": etag, "Cache-Control": "no-cache", **headers})
+    metrics.inc("clash_rate_limited_total", response="429")
+    return json({
+        "code": 429,
+        "message": "请求过于频繁, 请稍后再试",
+        "data": None
+    }, status=429, headers=headers)
+
 @app.get("/")
 async def welcome(_):
     return json({
@@ -22,18 +183,24 @@ async def welcome(_):
     })
 
 @app.get("/link/<token>")
-async def get_subscription(_, token: str):
+async def get_subscription(request, token: str):
     """Get transformed Clash configuration"""
     # 从配置中读取 auth_tokens
-    config = config_manager.load_config()
-    if not config.get("auth_tokens") or token not in config["auth_tokens"]:
+    valid = config_manager.is_valid_token(token)
+    # 按客户端 IP 和令牌限流, 无效令牌只计入 IP
+    retry_after = config_manager.rate_limiter.check(token if valid else None, request.remote_addr or request.ip)
+    if valid:
+        request.ctx.token = token
+    if retry_after:
+        return limited_response(request, token if valid else None, retry_after)
+    if not valid:
         return json({
             "code": 403,
             "message": "无效的访问令牌",
             "data": None
         }, status=403)
     
-    if not config["url"]:
+    if not config_manager.subscription_sources():
         return json({
             "code": 400,
             "message": "未配置订阅地址",
@@ -42,22 +209,18 @@ async def get_subscription(_, token: str):
     
     try:
         # 尝试首先从缓存加载
-        cached_config = config_manager.load_cached_proxy()
-        if cached_config and not config_manager.need_update():
-            # 如果有缓存且不需要更新,直接返回缓存的配置
-            return response.text(
-                yaml.dump(cached_config, allow_unicode=True),
-                content_type="text/plain; charset=utf-8"
-            )
+        rendered = config_manager.load_rendered_proxy()
+        profile = config_manager.token_profile(token)
+        if rendered:
+            rendered = await profile_compiler.get(profile, rendered)
+            # 有缓存时总是立即返回, 过期的缓存由后台调度器刷新
+            if config_manager.need_update():
+                return subscription_response(request, rendered, "STALE")
+            return subscription_response(request, rendered, "HIT")
         
-        # 如果没有缓存，则获取并转换
-        transformed_config = fetch_and_transform_config(config["url"])
-        config_manager.save_cached_proxy(transformed_config)
-        config_manager.update_last_update_time()
-        return response.text(
-            yaml.dump(transformed_config, allow_unicode=True),
-            content_type="text/plain; charset=utf-8"
-        )
+        # 如果没有缓存，则获取并转换; 并发请求共享同一次刷新
+        rendered = await profile_compiler.get(profile, await refresh_coordinator.refresh())
+        return subscription_response(request, rendered, "MISS")
     except Exception as e:
         return json({
             "code": 500,
@@ -65,7 +228,68 @@ async def get_subscription(_, token: str):
             "data": None
         }, status=500)
 
+@app.get("/ruleset/<name>")
+async def get_ruleset(request, name: str):
+    """Serve a mirrored rule-provider list"""
+    rendered = config_manager.ruleset_mirror.get(name)
+    if rendered is None:
+        return json({
+            "code": 404,
+            "message": "规则集不存在或尚未同步",
+            "data": None
+        }, status=404)
+    return rendered_response(request, rendered)
+
+@app.get("/debug/match/<token>")
+async def debug_match(request, token: str):
+    """Which saved rule matches ?host= and/or ?ip="""
+    if not config_manager.is_valid_token(token):
+        return json({
+            "code": 403,
+            "message": "无效的访问令牌",
+            "data": None
+        }, status=403)
+
+    host = request.args.get("host")
+    ip = request.args.get("ip")
+    if not host and not ip:
+        return json({
+            "code": 400,
+            "message": "请提供 host 或 ip 参数",
+            "data": None
+        }, status=400)
+
+    try:
+        rule = config_manager.rules_engine.get().match(host=host, ip=ip)
+    except ValueError as e:
+        return json({
+            "code": 400,
+            "message": str(e),
+            "data": None
+        }, status=400)
+    return json({
+        "code": 200,
+        "message": "success",
+        "data": None if rule is None else {
+            "index": rule.index,
+            "rule": rule.raw,
+            "type": rule.type,
+            "target": rule.target,
+            "rule_set": rule.source,
+        }
+    })
+
+@app.get("/metrics")
+async def get_metrics(_):
+    """Prometheus metrics aggregated over all workers"""
+    metrics.flush()
+    extra = {}
+    rendered = config_manager.load_rendered_proxy()
+    if rendered:
+        extra["clash_cached_config_age_seconds"] = max(0.0, datetime.datetime.now().timestamp() - rendered.mtime)
+    return response.text(metrics.render(extra), content_type="text/plain; version=0.0.4; charset=utf-8")
+
 if __name__ == '__main__':
     cpu_count = int(os.getenv('WORKER_COUNT', '1'))
     print(f"Starting server with {cpu_count} workers")
-    app.run(host='0.0.0.0', port=8000, workers=cpu_count)
\ No newline at end of file
+    app.run(host='0.0.0.0', port=int(os.getenv('PORT', '8000')), workers=cpu_count)
\ No newline at end of file
@@ -1,73 +1,201 @@
 import streamlit as st
-import requests
-import yaml
-import json
+import pandas as pd
+import re
 from datetime import datetime, timedelta, timezone
-from app.utils import fetch_and_transform_config, DEFAULT_RULES, DEFAULT_RULE_PROVIDERS
-from app.config import config_manager
+from urllib.parse import quote
+from app.utils import DEFAULT_RULES, DEFAULT_RULE_PROVIDERS
+from app.admin_client import admin_client
+from app.serialization import load_yaml, dump_yaml
+from app.ordering import DEFAULT_ORDERING, validate_ordering
+from app.sources import MAX_UPSTREAM_BYTES, normalize_sources
+from app.rulesets import mirror_settings
+from app.prober import probe_settings
+
+# 缓存配置预览每页显示的节点数
+PREVIEW_PAGE_SIZE = 50
+
+@st.cache_data(show_spinner=False)
+def cached_get(path: str, version: str, **params):
+    """按内容版本缓存的管理接口读取, 版本变化（保存或刷新）后才重新请求"""
+    return admin_client.get(path, **params)
+
+@st.cache_data(show_spinner=False)
+def check_rules(rules: tuple, version: str, host: str = None, ip: str = None):
+    """未保存规则的检查结果, 同一份规则只检查一次"""
+    return admin_client.post("/rules/check", {"rules": list(rules), "host": host, "ip": ip})
 
 def main():
     st.set_page_config(page_title="Clash 配置转换服务", layout="wide")
     st.title("Clash 配置转换服务")
     
+    # 每次运行只请求一次状态, 其余数据按其中的版本号缓存
+    try:
+        status = admin_client.get("/status")
+    except Exception as e:
+        st.error(str(e))
+        return
+    versions = status["versions"]
+    
     # 创建选项卡
-    tabs = st.tabs(["基本配置", "规则配置", "规则提供者配置", "访问令牌管理"])
+    tabs = st.tabs(["基本配置", "规则配置", "规则提供者配置", "节点排序", "访问令牌管理"])
     
     with tabs[0]:
-        show_basic_config()
+        show_basic_config(status)
     with tabs[1]:
-        show_rules_config()
+        show_rules_config(versions)
     with tabs[2]:
-        show_rule_providers_config()
+        show_rule_providers_config(versions)
     with tabs[3]:
-        show_auth_tokens_config()
+        show_ordering_config(versions)
+    with tabs[4]:
+        show_auth_tokens_config(versions)
 
-def show_basic_config():
+def show_basic_config(status):
     """显示基本配置界面"""
     st.header("基本配置")
     
     # Load current configuration
-    config = config_manager.load_config()
+    versions = status["versions"]
+    config = cached_get("/config", versions["config"])["config"]
     
     with st.form("config_form"):
-        new_url = st.text_input("订阅地址", value=config["url"])
         new_interval = st.number_input("更新间隔（秒）", 
                                      min_value=60, 
                                      value=config["update_interval"],
                                      step=60)
+        max_upstream_mb = st.number_input("单个订阅大小上限（MB）",
+                                          min_value=1,
+                                          value=int(config.get("max_upstream_bytes") or MAX_UPSTREAM_BYTES) // (1024 * 1024),
+                                          step=1,
+                                          help="超过上限的订阅会被视为获取失败, 继续使用上次的缓存")
+        st.caption("订阅列表：可添加多个订阅，节点会合并到同一个「🔰 节点选择」分组，名称前缀用于区分来源")
+        sources = pd.DataFrame(
+            normalize_sources(config),
+            columns=["name", "url", "update_interval", "prefix", "enabled"]
+        )
+        edited_sources = st.data_editor(
+            sources,
+            num_rows="dynamic",
+            use_container_width=True,
+            column_config={
+                "name": st.column_config.TextColumn("名称"),
+                "url": st.column_config.TextColumn("订阅地址", required=True),
+                "update_interval": st.column_config.NumberColumn("更新间隔（秒）", min_value=60, step=60, default=new_interval),
+                "prefix": st.column_config.TextColumn("名称前缀", default=""),
+                "enabled": st.column_config.CheckboxColumn("启用", default=True),
+            }
+        )
         
         submitted = st.form_submit_button("保存配置")
         if submitted:
-            config["url"] = new_url
-            config["update_interval"] = new_interval
-            config_manager.save_config(config)
-            st.success("配置已保存")
+            subscriptions = []
+            for row in edited_sources.to_dict("records"):
+                if not isinstance(row.get("url"), str) or not row["url"].strip():
+                    continue
+                subscriptions.append({
+                    "name": row.get("name") if isinstance(row.get("name"), str) else "",
+                    "url": row["url"].strip(),
+                    "update_interval": int(row["update_interval"]) if pd.notna(row.get("update_interval")) else int(new_interval),
+                    "prefix": row.get("prefix") if isinstance(row.get("prefix"), str) else "",
+                    "enabled": bool(row.get("enabled", True)),
+                })
+            try:
+                admin_client.patch("/config", {
+                    "subscriptions": subscriptions,
+                    # 旧版单订阅地址已迁移到订阅列表
+                    "url": "",
+                    "update_interval": new_interval,
+                    "max_upstream_bytes": int(max_upstream_mb) * 1024 * 1024,
+                })
+                st.success("配置已保存")
+            except Exception as e:
+                st.error(f"保存配置失败: {str(e)}")
     
     # Display current status
     st.header("当前状态")
     status_col1, status_col2 = st.columns(2)
     
     with status_col1:
-        if config["last_update"]:
-            last_update = datetime.fromtimestamp(config["last_update"])
+        if status["last_update"]:
+            last_update = datetime.fromtimestamp(status["last_update"])
             st.info(f"最后更新时间: {last_update.astimezone(timezone(timedelta(hours=8))).strftime('%Y-%m-%d %H:%M:%S')}")
         else:
             st.warning("尚未进行过更新")
     
     with status_col2:
-        if st.button("立即更新"):
-            st.info(f"开始更新: {config['url']}")
+        if st.button("立即更新", disabled="refresh_job" in st.session_state):
             try:
-                transformed_config = fetch_and_transform_config(config["url"])
-                config_manager.save_cached_proxy(transformed_config)
-                config_manager.update_last_update_time()
-                st.success("更新成功")
+                # 刷新在服务端后台执行, 页面只轮询进度
+                job = admin_client.post("/refresh")
+                st.session_state["refresh_job"] = job["id"]
             except Exception as e:
                 st.error(f"更新失败: {str(e)}")
+        elif status["job"] and "refresh_job" not in st.session_state:
+            # 其它页面或会话发起的刷新
+            st.session_state["refresh_job"] = status["job"]["id"]
+        if "refresh_job" in st.session_state:
+            show_refresh_progress()
+        show_refresh_result()
+    show_refresh_history(versions["config"])
     # 在基本配置界面中调用 show_cached_proxy 函数
-    show_cached_proxy()
+    show_cached_proxy(versions["cache"])
+    show_snapshots()
+
+@st.fragment(run_every=1)
+def show_refresh_progress():
+    """每秒轮询一次刷新任务, 结束后重新运行整个页面以显示新的状态"""
+    job_id = st.session_state.get("refresh_job")
+    if not job_id:
+        return
+    try:
+        job = admin_client.get(f"/refresh/{job_id}")
+    except Exception as e:
+        job = {"state": "failed", "message": str(e)}
+    if job["state"] == "running":
+        st.progress(job["progress"], text=job["message"])
+        return
+    del st.session_state["refresh_job"]
+    st.session_state["refresh_result"] = job
+    st.rerun()
+
+def show_refresh_result():
+    """显示最近一次刷新任务的结果"""
+    job = st.session_state.pop("refresh_result", None)
+    if job is None:
+        return
+    if job["state"] == "failed":
+        st.error(f"更新失败: {job['message']}")
+    elif job.get("changes") is None:
+        st.success("更新成功, 订阅内容没有变化" if job.get("stage") == "done" else job["message"])
+    else:
+        changes = job["changes"]
+        st.success(f"更新成功: 新增 {changes['added']} 个, 移除 {changes['removed']} 个, 修改 {changes['modified']} 个节点")
+
+def show_refresh_history(version):
+    """显示最近几次刷新的节点变化"""
+    entries = cached_get("/history", version)
+    if not entries:
+        return
+    st.subheader("刷新记录")
+    st.dataframe(
+        pd.DataFrame([{
+            "时间": datetime.fromtimestamp(entry["time"]).astimezone(timezone(timedelta(hours=8))).strftime('%Y-%m-%d %H:%M:%S'),
+            "节点总数": entry["total"],
+            "新增": entry["added"],
+            "移除": entry["removed"],
+            "修改": entry["modified"],
+            "变化的订阅": ", ".join(entry.get("sources") or []),
+        } for entry in entries]),
+        use_container_width=True,
+        hide_index=True
+    )
+    latest = entries[0].get("samples") or {}
+    labels = {"added": "新增", "removed": "移除", "modified": "修改"}
+    for kind, names in latest.items():
+        with st.expander(f"最近一次{labels[kind]}的节点"):
+            st.text("\n".join(names))
 
-def show_auth_tokens_config():
+def show_auth_tokens_config(versions):
     """显示访问令牌管理界面"""
     st.header("访问令牌管理")
     st.markdown("""
@@ -75,51 +203,240 @@ def show_auth_tokens_config():
     """)
     
     # Load current configuration
-    config = config_manager.load_config()
+    config = cached_get("/config", versions["config"])["config"]
     auth_tokens = config.get("auth_tokens", [])
     
+    profiles = config.get("profiles") or {}
+    token_profiles = config.get("token_profiles") or {}
+    profile_options = ["默认"] + list(profiles)
+    
     # 显示现有令牌
     for i, token in enumerate(auth_tokens):
-        cols = st.columns([3, 1])
+        cols = st.columns([3, 2, 1])
         cols[0].text(token)
-        if cols[1].button("删除", key=f"delete_{i}"):
-            auth_tokens.pop(i)
-            config["auth_tokens"] = auth_tokens
-            config_manager.save_config(config)
+        current = token_profiles.get(token)
+        selected = cols[1].selectbox(
+            "配置方案",
+            profile_options,
+            index=profile_options.index(current) if current in profiles else 0,
+            key=f"profile_{i}",
+            label_visibility="collapsed"
+        )
+        if selected != (current if current in profiles else "默认"):
+            admin_client.put(f"/tokens/{quote(token, safe='')}", {"profile": None if selected == "默认" else selected})
+            st.rerun()
+        if cols[2].button("删除", key=f"delete_{i}"):
+            admin_client.delete(f"/tokens/{quote(token, safe='')}")
             st.rerun()
     
     # 添加新令牌
     new_token = st.text_input("添加新令牌")
     if st.button("添加令牌"):
         if new_token.strip():
-            auth_tokens.append(new_token.strip())
-            config["auth_tokens"] = auth_tokens
-            config_manager.save_config(config)
-            st.success("令牌已添加")
-            st.rerun()
+            try:
+                admin_client.post("/tokens", {"token": new_token.strip()})
+                st.success("令牌已添加")
+                st.rerun()
+            except Exception as e:
+                st.error(f"添加令牌失败: {str(e)}")
         else:
             st.warning("令牌不能为空")
-
-def show_cached_proxy():
-    """显示缓存的代理配置"""
-    st.header("缓存的代理配置")
     
-    # Load cached proxy configuration
-    cached_proxy = config_manager.load_cached_proxy()
+    show_token_stats()
+    show_profiles_config(config)
+
+def show_token_stats():
+    """显示各令牌的访问统计和限流配置"""
+    st.subheader("访问统计")
+    st.markdown("""
+    统计各令牌最近的订阅请求，便于发现更新过于频繁的客户端。超过限流的请求会收到 429；客户端已有最新配置时返回 304。
+    """)
+    try:
+        data = admin_client.get("/tokens/stats")
+    except Exception as e:
+        st.error(str(e))
+        return
     
-    if cached_proxy:
-        # Display cached configuration in a text area
-        st.text_area(
-            "当前缓存的代理配置（YAML 格式）",
-            value=yaml.dump(cached_proxy, allow_unicode=True),
-            height=400,
-            help="这是当前缓存的代理配置"
+    if data["stats"]:
+        st.dataframe(
+            pd.DataFrame([{
+                "令牌": token,
+                "最后访问": datetime.fromtimestamp(stats["last_seen"]).astimezone(timezone(timedelta(hours=8))).strftime('%Y-%m-%d %H:%M:%S'),
+                "每分钟请求": stats["per_minute"],
+                "最近一小时": stats["last_hour"],
+                "总请求": stats["requests"],
+                "304": stats["not_modified"],
+                "被限流": stats["limited"],
+                "流量（KB）": round(stats["bytes"] / 1024, 1),
+                "客户端": stats["user_agent"],
+            } for token, stats in data["stats"].items()]),
+            use_container_width=True,
+            hide_index=True
         )
     else:
+        st.info("暂无访问记录")
+    
+    settings = data["rate_limit"]
+    with st.form("rate_limit_form"):
+        enabled = st.checkbox("启用限流", value=settings["enabled"])
+        col1, col2 = st.columns(2)
+        token_per_minute = col1.number_input("每个令牌每分钟请求数", min_value=1.0, value=float(settings["token_per_minute"]), step=1.0)
+        token_burst = col2.number_input("每个令牌突发上限", min_value=1, value=int(settings["token_burst"]), step=1)
+        ip_per_minute = col1.number_input("每个 IP 每分钟请求数", min_value=1.0, value=float(settings["ip_per_minute"]), step=1.0)
+        ip_burst = col2.number_input("每个 IP 突发上限", min_value=1, value=int(settings["ip_burst"]), step=1)
+        if st.form_submit_button("保存限流配置"):
+            try:
+                admin_client.patch("/config", {"rate_limit": {
+                    "enabled": enabled,
+                    "token_per_minute": float(token_per_minute),
+                    "token_burst": int(token_burst),
+                    "ip_per_minute": float(ip_per_minute),
+                    "ip_burst": int(ip_burst),
+                }})
+                st.success("限流配置已保存")
+            except Exception as e:
+                st.error(f"保存限流配置失败: {str(e)}")
+
+def show_profiles_config(config):
+    """显示配置方案编辑界面"""
+    st.subheader("配置方案")
+    st.markdown("""
+    配置方案可以为不同的令牌输出不同的配置，未分配方案的令牌使用默认配置。每个方案支持以下字段（均可选）：
+    - include / exclude: 按节点名称过滤的正则表达式
+    - rules: 替换全局规则的规则列表
+    - port / socks-port / mixed-port: 覆盖监听端口
+    
+    示例：
+    ```yaml
+    family:
+      include: 香港|日本
+      port: 7890
+    ```
+    """)
+    profiles_text = st.text_area(
+        "配置方案（YAML 格式）",
+        value=dump_yaml(config.get("profiles") or {}) if config.get("profiles") else "",
+        height=200
+    )
+    if st.button("保存配置方案"):
+        try:
+            profiles = load_yaml(profiles_text) or {}
+            if not isinstance(profiles, dict) or not all(isinstance(p, dict) for p in profiles.values()):
+                raise ValueError("配置方案必须是 名称: 配置 的映射")
+            for profile in profiles.values():
+                for key in ("include", "exclude"):
+                    if profile.get(key):
+                        re.compile(profile[key])
+            admin_client.patch("/config", {"profiles": profiles})
+            st.success("配置方案已保存")
+        except Exception as e:
+            st.error(f"保存配置方案失败: {str(e)}")
+
+def show_cached_proxy(version):
+    """显示缓存的代理配置摘要和分页的节点列表"""
+    st.header("缓存的代理配置")
+    
+    if not version:
+        st.warning("当前没有缓存的代理配置")
+        return
+    
+    col1, col2 = st.columns([3, 1])
+    query = col1.text_input("搜索节点", placeholder="名称或服务器地址")
+    page = col2.number_input("页码", min_value=1, value=1, step=1)
+    # 只取当前页, 完整的配置不经过界面
+    preview = cached_get("/cache", version, page=int(page), size=PREVIEW_PAGE_SIZE, q=query.strip())
+    if preview is None:
         st.warning("当前没有缓存的代理配置")
+        return
+    
+    cols = st.columns(4)
+    cols[0].metric("节点数", preview["proxies"])
+    cols[1].metric("代理组", len(preview["proxy_groups"]))
+    cols[2].metric("规则数", preview["rules"])
+    cols[3].metric("大小", f"{preview['bytes'] / 1024:.1f} KB")
+    with st.expander("代理组"):
+        st.dataframe(
+            pd.DataFrame([{"名称": group["name"], "类型": group["type"], "成员数": group["size"]}
+                          for group in preview["proxy_groups"]]),
+            use_container_width=True,
+            hide_index=True
+        )
+    st.dataframe(
+        pd.DataFrame(preview["items"], columns=["name", "type", "server", "port"]).rename(
+            columns={"name": "名称", "type": "类型", "server": "服务器", "port": "端口"}),
+        use_container_width=True,
+        hide_index=True
+    )
+    pages = max(1, -(-preview["matched"] // PREVIEW_PAGE_SIZE))
+    st.caption(f"第 {preview['page']} / {pages} 页, 共 {preview['matched']} 个节点")
 
 
-def show_rules_config():
+def show_snapshots():
+    """显示配置快照, 可以回滚到之前的版本"""
+    st.header("配置快照")
+    st.markdown("""
+    每次刷新生成的配置都会保存为快照（内容相同的只保存一份）。节点数低于下限、比当前配置减少过多或格式错误的配置不会发布，客户端继续获取当前配置。
+    """)
+    try:
+        data = admin_client.get("/snapshots")
+    except Exception as e:
+        st.error(str(e))
+        return
+    
+    snapshots = data["snapshots"]
+    if snapshots:
+        st.dataframe(
+            pd.DataFrame([{
+                "时间": datetime.fromtimestamp(snapshot["created_at"]).astimezone(timezone(timedelta(hours=8))).strftime('%Y-%m-%d %H:%M:%S'),
+                "当前": "✅" if snapshot["current"] else "",
+                "节点数": snapshot["proxies"],
+                "大小（KB）": round(snapshot["size"] / 1024, 1),
+                "状态": "通过" if snapshot["status"] == "accepted" else "未通过",
+                "说明": "; ".join(snapshot["errors"]),
+                "版本": snapshot["digest"][:12],
+            } for snapshot in snapshots]),
+            use_container_width=True,
+            hide_index=True
+        )
+        accepted = [snapshot for snapshot in snapshots if snapshot["status"] == "accepted" and not snapshot["current"]]
+        if accepted:
+            col1, col2 = st.columns([3, 1])
+            selected = col1.selectbox(
+                "回滚到",
+                accepted,
+                format_func=lambda snapshot: f"{snapshot['digest'][:12]}（{snapshot['proxies']} 个节点, "
+                                             f"{datetime.fromtimestamp(snapshot['created_at']).astimezone(timezone(timedelta(hours=8))).strftime('%m-%d %H:%M')}）",
+                label_visibility="collapsed"
+            )
+            if col2.button("回滚"):
+                try:
+                    admin_client.post(f"/snapshots/{selected['digest']}/promote")
+                    st.success("已回滚, 下次订阅内容或规则变化时会生成新的配置")
+                    st.rerun()
+                except Exception as e:
+                    st.error(f"回滚失败: {str(e)}")
+    else:
+        st.info("暂无快照")
+    
+    settings = data["settings"]
+    with st.form("snapshot_form"):
+        col1, col2, col3 = st.columns(3)
+        min_proxies = col1.number_input("最少节点数", min_value=0, value=int(settings["min_proxies"]), step=1)
+        max_drop = col2.number_input("节点数最大降幅（%）", min_value=0, max_value=100, value=int(settings["max_drop"] * 100), step=5,
+                                     help="0 表示不检查")
+        retention = col3.number_input("保留快照数", min_value=1, value=int(settings["retention"]), step=1)
+        if st.form_submit_button("保存快照配置"):
+            try:
+                admin_client.patch("/config", {"snapshots": {
+                    "min_proxies": int(min_proxies),
+                    "max_drop": max_drop / 100,
+                    "retention": int(retention),
+                }})
+                st.success("快照配置已保存")
+            except Exception as e:
+                st.error(f"保存快照配置失败: {str(e)}")
+
+def show_rules_config(versions):
     """显示规则配置界面"""
     st.header("规则配置")
     st.markdown("""
@@ -143,7 +460,7 @@ def show_rules_config():
     """)
     
     # 加载当前规则配置
-    rules_config = config_manager.load_rules_config()
+    rules_config = cached_get("/rules", versions["rules"])
     current_rules = rules_config["rules"]
     
     # 创建一个文本区域用于编辑规则
@@ -160,18 +477,52 @@ def show_rules_config():
             rules_text = "\n".join(DEFAULT_RULES)
             st.rerun()
     
+    # 将文本转换为规则列表, 保存前检查格式、重复和被覆盖的规则
+    new_rules = [rule.strip() for rule in rules_text.split("\n") if rule.strip()]
+    # 代理组名称取决于排序配置, 两者任一变化都需要重新检查
+    check_version = f"{versions['rules']}-{versions['ordering']}"
+    check = check_rules(tuple(new_rules), check_version)
+    if check["issues"]:
+        st.dataframe(
+            pd.DataFrame([{
+                "行号": issue["index"] + 1,
+                "级别": "错误" if issue["level"] == "error" else "警告",
+                "规则": issue["rule"],
+                "说明": issue["message"],
+            } for issue in check["issues"]]),
+            use_container_width=True,
+            hide_index=True
+        )
+
     with col2:
         if st.button("保存规则"):
-            try:
-                # 将文本转换为规则列表
-                new_rules = [rule.strip() for rule in rules_text.split("\n") if rule.strip()]
-                rules_config["rules"] = new_rules
-                config_manager.save_rules_config(rules_config)
-                st.success("规则已保存")
-            except Exception as e:
-                st.error(f"保存规则失败: {str(e)}")
+            if check["errors"]:
+                st.error(f"存在 {check['errors']} 条无效规则, 请修正后再保存")
+            else:
+                try:
+                    admin_client.patch("/rules", {"rules": new_rules})
+                    st.success("规则已保存")
+                except Exception as e:
+                    st.error(f"保存规则失败: {str(e)}")
+
+    st.subheader("规则匹配测试")
+    col1, col2 = st.columns(2)
+    with col1:
+        host = st.text_input("域名", placeholder="www.google.com")
+    with col2:
+        ip = st.text_input("IP 地址", placeholder="8.8.8.8")
+    if host or ip:
+        try:
+            rule = check_rules(tuple(new_rules), check_version, host.strip() or None, ip.strip() or None)["match"]
+            if rule is None:
+                st.info("没有匹配的规则")
+            else:
+                source = f"（规则集 {rule['rule_set']}）" if rule["rule_set"] else ""
+                st.success(f"第 {rule['index'] + 1} 行: {rule['rule']} → {rule['target']}{source}")
+        except Exception as e:
+            st.error(str(e))
 
-def show_rule_providers_config():
+def show_rule_providers_config(versions):
     """显示规则提供者配置界面"""
     st.header("规则提供者配置")
     # 显示规则提供者说明
@@ -199,31 +550,174 @@ def show_rule_providers_config():
     col1, col2 = st.columns(2)
     with col1:
         if st.button("恢复默认规则提供者"):
-            providers_text = yaml.dump(DEFAULT_RULE_PROVIDERS, allow_unicode=True)
+            providers_text = dump_yaml(DEFAULT_RULE_PROVIDERS)
             st.rerun()
     
     with col2:
         if st.button("保存规则提供者"):
             try:
                 # 将 YAML 文本转换为字典
-                new_providers = yaml.safe_load(providers_text)
-                rules_config["rule_providers"] = new_providers
-                config_manager.save_rules_config(rules_config)
+                new_providers = load_yaml(providers_text)
+                admin_client.patch("/rules", {"rule_providers": new_providers})
                 st.success("规则提供者已保存")
             except Exception as e:
                 st.error(f"保存规则提供者失败: {str(e)}")
     
     # 加载当前规则提供者配置
-    rules_config = config_manager.load_rules_config()
-    current_providers = rules_config["rule_providers"]
+    current_providers = cached_get("/rules", versions["rules"])["rule_providers"]
     
     # 创建一个文本区域用于编辑规则提供者
     providers_text = st.text_area(
         "规则提供者配置（YAML 格式）",
-        value=yaml.dump(current_providers, allow_unicode=True),
+        value=dump_yaml(current_providers),
         height=400,
         help="使用 YAML 格式配置规则提供者"
     )
+    
+    show_rule_mirror_config(versions)
+
+def show_rule_mirror_config(versions):
+    """显示规则集镜像配置界面"""
+    st.subheader("规则集镜像与内联")
+    st.markdown("""
+    开启后由服务端定期下载各个 http 规则提供者的文件并缓存到数据目录，通过 `/ruleset/<名称>` 提供给客户端。
+    开启地址改写后，输出配置中的 rule-providers 地址会指向本服务，下次更新订阅时生效。
+    
+    内联模式会把 `RULE-SET` 展开成普通规则（去重、合并 IP 段），适用于不支持规则提供者的客户端。
+    """)
+    
+    config = cached_get("/config", versions["config"])["config"]
+    settings = mirror_settings(config)
+    current_mode = "inline" if config.get("rule_mode") == "inline" else "provider"
+    with st.form("rule_mirror_form"):
+        enabled = st.checkbox("启用规则集镜像", value=settings["enabled"])
+        rewrite = st.checkbox("改写 rule-providers 地址", value=settings["rewrite"])
+        public_url = st.text_input(
+            "服务访问地址",
+            value=settings["public_url"],
+            help="客户端访问本服务的地址，例如 http://192.168.1.2:8600"
+        )
+        rule_modes = {"provider": "规则提供者（RULE-SET）", "inline": "内联展开"}
+        rule_mode = st.radio(
+            "规则输出模式",
+            list(rule_modes),
+            index=list(rule_modes).index(current_mode),
+            format_func=rule_modes.get,
+            horizontal=True
+        )
+        if st.form_submit_button("保存镜像配置"):
+            admin_client.patch("/config", {
+                "rule_mirror": {"enabled": enabled, "rewrite": rewrite, "public_url": public_url.strip()},
+                "rule_mode": rule_mode,
+            })
+            st.success("镜像配置已保存")
+    
+    if settings["enabled"] or current_mode == "inline":
+        rows = []
+        for name, meta in admin_client.get("/rulesets").items():
+            rows.append({
+                "名称": name,
+                "大小": meta.get("size"),
+                "最后更新": datetime.fromtimestamp(meta["updated_at"]).astimezone(timezone(timedelta(hours=8))).strftime('%Y-%m-%d %H:%M:%S') if meta.get("updated_at") else "尚未同步",
+                "错误": meta.get("error", ""),
+            })
+        st.dataframe(pd.DataFrame(rows), use_container_width=True, hide_index=True)
+
+def show_ordering_config(versions):
+    """显示节点排序配置界面"""
+    st.header("节点排序")
+    st.markdown("""
+    ### 节点排序配置说明
+    
+    - regions: 按优先级排列的地区，节点名称包含任一关键字即归入该地区，未匹配的节点排在最后
+    - secondary: 同一地区内的次级排序键，可选 `multiplier`（倍率标记，如 x2）、`type`（协议类型）、`latency`（测得的延迟）
+    - multiplier_order: 倍率排序方向，`asc` 或 `desc`
+    - type_order: 协议类型的先后顺序
+    - region_groups: 开启后按地区自动生成 `url-test` / `fallback` 代理组，并加入「🔰 节点选择」
+    
+    修改后在下次更新订阅时生效。
+    """)
+    
+    ordering_text = st.text_area(
+        "节点排序配置（YAML 格式）",
+        value=dump_yaml(cached_get("/ordering", versions["ordering"])["ordering"], sort_keys=False),
+        height=400,
+        help="使用 YAML 格式配置节点排序"
+    )
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        if st.button("恢复默认排序"):
+            admin_client.put("/ordering", DEFAULT_ORDERING)
+            st.rerun()
+    
+    with col2:
+        if st.button("保存排序配置"):
+            try:
+                new_ordering = load_yaml(ordering_text)
+                validate_ordering(new_ordering)
+                admin_client.put("/ordering", new_ordering)
+                st.success("排序配置已保存")
+            except Exception as e:
+                st.error(f"保存排序配置失败: {str(e)}")
+
+    show_probe_config(versions)
+
+def show_probe_config(versions):
+    """显示节点探测配置和探测结果"""
+    st.header("节点探测")
+    st.markdown("""
+    开启后由后台定时对每个节点的 `server:port` 发起 TCP 连接（可选 TLS 握手）测量延迟，基于 UDP 的协议（如 hysteria2）不参与探测。
+    在排序配置的 secondary 中加入 `latency` 即可按测得的延迟排序；开启「去掉失效节点」后，探测失败的节点不会出现在输出中。
+    """)
+    settings = probe_settings(cached_get("/config", versions["config"])["config"])
+
+    with st.form("probe_form"):
+        enabled = st.checkbox("启用节点探测", value=settings["enabled"])
+        drop_dead = st.checkbox("去掉失效节点", value=settings["drop_dead"])
+        tls = st.checkbox("对 TLS 节点进行握手探测", value=settings["tls"])
+        col1, col2, col3 = st.columns(3)
+        timeout = col1.number_input("超时（秒）", min_value=0.5, value=float(settings["timeout"]), step=0.5)
+        concurrency = col2.number_input("并发数", min_value=1, value=int(settings["concurrency"]), step=8)
+        ttl = col3.number_input("结果有效期（秒）", min_value=60, value=int(settings["ttl"]), step=60)
+        if st.form_submit_button("保存探测配置"):
+            admin_client.patch("/config", {"probe": {
+                "enabled": enabled,
+                "drop_dead": drop_dead,
+                "tls": tls,
+                "timeout": float(timeout),
+                "concurrency": int(concurrency),
+                "ttl": int(ttl),
+            }})
+            st.success("探测配置已保存")
+
+    if st.button("立即探测"):
+        with st.spinner("正在探测..."):
+            try:
+                # 探测耗时取决于节点数和超时设置
+                admin_client.post("/probe", timeout=None)
+                st.rerun()
+            except Exception as e:
+                st.error(f"探测失败: {str(e)}")
+
+    probe = cached_get("/probe", versions["probe"])
+    stats = probe["stats"]
+    if stats["total"]:
+        cols = st.columns(4)
+        cols[0].metric("已探测", stats["total"])
+        cols[1].metric("可用", stats["alive"])
+        cols[2].metric("失效", stats["dead"])
+        cols[3].metric("延迟中位数", f"{stats['median_rtt']} ms" if stats["median_rtt"] is not None else "-")
+        st.dataframe(
+            pd.DataFrame([{
+                "节点地址": row["endpoint"],
+                "可用": row["alive"],
+                "延迟（ms）": row["rtt"],
+                "错误": row["error"],
+            } for row in probe["results"]]),
+            use_container_width=True,
+            hide_index=True
+        )
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file